@@ -0,0 +1,55 @@
+"""
+Measures :meth:`.State.find_channel` for guild channels, with guilds from a :class:`.FakeGateway`.
+
+Usage: ``python benchmarks/find_channel.py [--guilds N] [--channels N] [--lookups N]``
+"""
+import argparse
+import random
+import time
+
+import anyio
+
+from curious.core import _current_client, _current_shard
+from curious.core.client import Client
+from curious.ext.fake_gateway import FakeGateway, FakeGatewayConfig
+
+
+async def _run(guilds: int, channels: int, lookups: int) -> None:
+    config = FakeGatewayConfig(guilds=guilds, members_per_guild=0, channels_per_guild=channels)
+    gateway = FakeGateway(config)
+    client = Client("fake.token.here")
+    _current_client.set(client)
+    _current_shard.set(0)
+    state = client.state
+
+    for guild_id in gateway.guild_ids_for(0, 1):
+        async for _ in state.handle_guild_create(gateway.make_guild(guild_id)):
+            pass
+
+    channel_ids = [channel_id for guild in state.guilds.values() for channel_id in guild.channels]
+    targets = [random.choice(channel_ids) for _ in range(lookups)]
+
+    started = time.perf_counter()
+    for channel_id in targets:
+        state.find_channel(channel_id)
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"{len(channel_ids)} channels in {guilds} guilds: "
+        f"{elapsed / lookups * 1e6:.2f} us per find_channel ({lookups} lookups)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--guilds", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=20)
+    parser.add_argument("--lookups", type=int, default=10000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    anyio.run(_run, args.guilds, args.channels, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Measures how many gateway dispatches a shard receives per second with each websocket transport.
+
+A :class:`.FakeGateway` runs in a separate process, sending MESSAGE_CREATEs as fast as the shard
+reads them, so the CPU time measured is the shard's alone. Dispatches are received, inflated and
+decoded, but not run through the state.
+
+Usage: ``python benchmarks/gateway_transport.py [--events N] [--transport lomond|anyio ...]``
+"""
+import argparse
+import logging
+import multiprocessing
+import resource
+import time
+
+import anyio
+
+from curious.core.gateway import open_websocket
+from curious.ext.fake_gateway import FakeGateway, FakeGatewayConfig
+
+
+def _cpu_time() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _serve(urls: multiprocessing.Queue) -> None:
+    # a rate far above what the client can handle, so the socket is never idle
+    config = FakeGatewayConfig(guilds=10, members_per_guild=50, event_rate=100_000)
+
+    async def serve():
+        gateway = FakeGateway(config)
+        async with anyio.create_task_group() as tg:
+            await tg.spawn(gateway.serve)
+            await gateway.wait_started()
+            urls.put(gateway.url)
+
+    anyio.run(serve)
+
+
+async def _run(transport: str, url: str, events: int) -> None:
+    received = 0
+    started = cpu_started = None
+
+    async with open_websocket("fake.token.here", url, transport=transport) as gw:
+        async for name, *params in gw.events():
+            if name != "gateway_dispatch_received" or params[0] != "MESSAGE_CREATE":
+                continue
+
+            if received == 0:
+                started, cpu_started = time.perf_counter(), _cpu_time()
+
+            received += 1
+            if received == events:
+                break
+
+        elapsed, cpu = time.perf_counter() - started, _cpu_time() - cpu_started
+
+    print(
+        f"{transport:>7}: {events / elapsed:8.0f} dispatches/s, "
+        f"{cpu / events * 1e6:6.1f} us CPU per dispatch ({events} dispatches)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--transport", action="append", choices=["lomond", "anyio"])
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    urls = multiprocessing.Queue()
+    server = multiprocessing.Process(target=_serve, args=(urls,), daemon=True)
+    server.start()
+    url = urls.get(timeout=30)
+
+    try:
+        for transport in args.transport or ["lomond", "anyio"]:
+            anyio.run(_run, transport, url, args.events)
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Measures how quickly each installed JSON backend decodes gateway payloads.
+
+The payloads are GUILD_CREATEs and a mix of MESSAGE_CREATE, TYPING_START and PRESENCE_UPDATE
+dispatches from a :class:`.FakeGateway`, encoded as they would arrive over the wire. A gateway
+log recorded with ``gateway_log=`` can be decoded instead with ``--log``.
+
+Usage: ``python benchmarks/json_codec.py [--events N] [--rounds N] [--log PATH]``
+"""
+import argparse
+import json
+import random
+import time
+from typing import List
+
+import anyio
+
+from curious.core.codec import _json_backends
+from curious.core.replay import RecordKind, read_records
+from curious.ext.fake_gateway import FakeGateway, FakeGatewayConfig
+
+
+async def _make_payloads(events: int) -> List[bytes]:
+    config = FakeGatewayConfig(guilds=10, members_per_guild=100, channels_per_guild=10)
+    gateway = FakeGateway(config)
+    guild_ids = gateway.guild_ids_for(0, 1)
+
+    dispatches = [("GUILD_CREATE", gateway.make_guild(guild_id)) for guild_id in guild_ids]
+    for _ in range(events):
+        name = random.choice(["MESSAGE_CREATE", "TYPING_START", "PRESENCE_UPDATE"])
+        dispatches.append((name, gateway.make_event(name, random.choice(guild_ids))))
+
+    return [
+        json.dumps({"op": 0, "s": seq, "t": name, "d": d}, separators=(",", ":")).encode("utf-8")
+        for seq, (name, d) in enumerate(dispatches, start=1)
+    ]
+
+
+def _read_payloads(path: str) -> List[bytes]:
+    return [data for kind, _, data in read_records(path) if kind == RecordKind.PAYLOAD]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--events", type=int, default=20000)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--log", help="A gateway log to take the payloads from.")
+    args = parser.parse_args()
+
+    if args.log:
+        payloads = _read_payloads(args.log)
+    else:
+        payloads = anyio.run(_make_payloads, args.events)
+
+    size = sum(len(payload) for payload in payloads)
+    print(f"{len(payloads)} payloads, {size / 1024 / 1024:.1f} MiB")
+
+    for name, factory in _json_backends.items():
+        try:
+            codec = factory()
+        except ImportError:
+            print(f"{name:>7}: not installed")
+            continue
+
+        best = float("inf")
+        for _ in range(args.rounds):
+            started = time.perf_counter()
+            for payload in payloads:
+                codec.loads(payload)
+            best = min(best, time.perf_counter() - started)
+
+        print(
+            f"{name:>7}: {size / best / 1024 / 1024:7.1f} MiB/s, "
+            f"{best / len(payloads) * 1e6:6.1f} us per payload"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Measures looking up and updating cached messages, with messages from a :class:`.FakeGateway`.
+
+Usage: ``python -O benchmarks/message_cache.py [--messages N] [--lookups N]``
+
+Without ``-O``, the debug-only stack check made whenever a dataclass is created dominates the time
+taken by MESSAGE_UPDATE.
+"""
+import argparse
+import random
+import time
+
+import anyio
+
+from curious.core import _current_client, _current_shard
+from curious.core.client import Client
+from curious.core.state import State
+from curious.ext.fake_gateway import FakeGateway, FakeGatewayConfig
+
+
+async def _drain(events) -> None:
+    async for _ in events:
+        pass
+
+
+async def _run(messages: int, lookups: int) -> None:
+    # enough channels that the default per-channel limit doesn't evict many messages
+    config = FakeGatewayConfig(guilds=1, members_per_guild=100, channels_per_guild=100)
+    gateway = FakeGateway(config)
+    client = Client("fake.token.here")
+    client.state = State(messages)
+    _current_client.set(client)
+    _current_shard.set(0)
+    state = client.state
+
+    guild_id = gateway.guild_ids_for(0, 1)[0]
+    await _drain(state.handle_guild_create(gateway.make_guild(guild_id)))
+
+    payloads = []
+    for i in range(messages):
+        payload = gateway.make_event("MESSAGE_CREATE", guild_id)
+        payload["id"] = str(int(payload["id"]) + i)
+        payloads.append(payload)
+        await _drain(state.handle_message_create(payload))
+
+    cached = [payload for payload in payloads if state.find_message(int(payload["id"]))]
+    targets = [random.choice(cached) for _ in range(lookups)]
+
+    target_ids = [int(payload["id"]) for payload in targets]
+    started = time.perf_counter()
+    for message_id in target_ids:
+        state.find_message(message_id)
+
+    found = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for payload in targets:
+        await _drain(state.handle_message_update(dict(payload, content="edited")))
+
+    updated = time.perf_counter() - started
+    print(
+        f"{len(cached)} cached messages: {found / lookups * 1e6:.2f} us per find_message, "
+        f"{updated / lookups * 1e6:.2f} us per MESSAGE_UPDATE ({lookups} of each)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--lookups", type=int, default=5000)
+    args = parser.parse_args()
+
+    random.seed(0)
+    anyio.run(_run, args.messages, args.lookups)
+
+
+if __name__ == "__main__":
+    main()
@@ -88,7 +88,7 @@ from curious.dataclasses.voice_state import VoiceState
 from curious.dataclasses.webhook import Webhook
 from curious.dataclasses.widget import Widget, WidgetChannel, WidgetGuild, WidgetMember
 
-from curious.core.client import Client, InvalidTokenException
+from curious.core.client import Client, InvalidIntentsException, InvalidTokenException
 from curious.core.httpclient import audit_log_reason
 
 from curious.exc import (
@@ -26,7 +26,7 @@ import sys
 import traceback
 from collections import defaultdict
 from functools import partial
-from typing import Callable, Dict, Iterable, Tuple, Type, Union
+from typing import Callable, Dict, Iterable, Set, Tuple, Type, Union
 
 import anyio
 
@@ -172,7 +172,7 @@ class CommandsManager(object):
         """
         self.client.events.add_event(self.handle_message)
         self.client.events.add_event(self.default_command_error)
-        self.client.events.add_event_hook(self.event_hook)
+        self.client.events.add_event_hook(self.event_hook, events=self._plugin_events())
 
         from curious.commands.decorators import command
 
@@ -221,6 +221,7 @@ class CommandsManager(object):
                 table[alias] = command
 
         self._plugin_command_cache[instance] = table
+        self._update_hook_events()
 
         return instance
 
@@ -247,8 +248,9 @@ class CommandsManager(object):
 
         if plugin is not None:
             await plugin.plugin_unload()
-            self._plugin_command_cache.pop(getattr(plugin, "plugin_name", type(plugin).__name__))
+            self._plugin_command_cache.pop(plugin, None)
 
+        self._update_hook_events()
         return plugin
 
     def lookup_command(self, name: str):
@@ -380,6 +382,25 @@ class CommandsManager(object):
             logger.info(f"Loaded module {mod}")
             await self.load_plugins_from(mod)
 
+    def _plugin_events(self) -> Set[str]:
+        """
+        :return: The names of the events that the loaded plugins have handlers for.
+        """
+        events = set()
+        for (plugin, scope) in self.plugins.values():
+            body = inspect.getmembers(plugin, predicate=lambda v: hasattr(v, "is_event"))
+            for _, handler in body:
+                events.update(handler.events)
+
+        return events
+
+    def _update_hook_events(self) -> None:
+        """
+        Updates the events the event hook is called with, after plugins are loaded or unloaded.
+        """
+        if self.event_hook in self.client.events.event_hooks:
+            self.client.events.update_event_hook(self.event_hook, self._plugin_events())
+
     async def event_hook(self, *args, **kwargs):
         """
         The event hook for the commands manager.
@@ -24,10 +24,16 @@ delegating it to client code.
 .. autosummary::
     :toctree: core
     
+    cache
     client
+    cluster
+    codec
     event
     gateway
     httpclient
+    ratelimit
+    replay
+    session
     state
 """
 import contextvars
@@ -0,0 +1,290 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A pure-Python implementation of the Erlang External Term Format, as used by the Discord gateway.
+
+Terms are decoded into the same shapes the JSON gateway produces, so that the rest of the library
+doesn't need to care which encoding is in use:
+
+ - Binaries become ``str`` (or ``bytes``, if they are not valid UTF-8).
+ - The atoms ``nil``, ``true`` and ``false`` become ``None``, ``True`` and ``False``. Any other
+   atom becomes a ``str``.
+ - Maps become ``dict``, lists and tuples become ``list``.
+ - Integers (including bignums, which Discord uses for snowflakes) become ``int``.
+"""
+import struct
+import zlib
+from typing import Any, Tuple
+
+FORMAT_VERSION = 131
+
+NEW_FLOAT_EXT = 70
+BIT_BINARY_EXT = 77
+COMPRESSED = 80
+SMALL_INTEGER_EXT = 97
+INTEGER_EXT = 98
+FLOAT_EXT = 99
+ATOM_EXT = 100
+SMALL_TUPLE_EXT = 104
+LARGE_TUPLE_EXT = 105
+NIL_EXT = 106
+STRING_EXT = 107
+LIST_EXT = 108
+BINARY_EXT = 109
+SMALL_BIG_EXT = 110
+LARGE_BIG_EXT = 111
+SMALL_ATOM_EXT = 115
+MAP_EXT = 116
+ATOM_UTF8_EXT = 118
+SMALL_ATOM_UTF8_EXT = 119
+
+_ATOMS = {"nil": None, "true": True, "false": False}
+
+_u8 = struct.Struct(">B")
+_u16 = struct.Struct(">H")
+_u32 = struct.Struct(">I")
+_i32 = struct.Struct(">i")
+_f64 = struct.Struct(">d")
+
+
+class ETFDecodeError(ValueError):
+    """
+    Raised when a payload is not valid External Term Format.
+    """
+
+
+def _atom(raw: bytes, encoding: str) -> Any:
+    name = raw.decode(encoding)
+    return _ATOMS.get(name, name)
+
+
+def _decode_term(data: bytes, offset: int) -> Tuple[Any, int]:
+    """
+    Decodes a single term starting at ``offset``.
+
+    :return: A tuple of (term, offset after the term).
+    """
+    tag = data[offset]
+    offset += 1
+
+    if tag == SMALL_INTEGER_EXT:
+        return data[offset], offset + 1
+
+    if tag == INTEGER_EXT:
+        return _i32.unpack_from(data, offset)[0], offset + 4
+
+    if tag == BINARY_EXT:
+        (length,) = _u32.unpack_from(data, offset)
+        offset += 4
+        raw = data[offset : offset + length]
+        try:
+            return raw.decode("utf-8"), offset + length
+        except UnicodeDecodeError:
+            return bytes(raw), offset + length
+
+    if tag == MAP_EXT:
+        (arity,) = _u32.unpack_from(data, offset)
+        offset += 4
+        result = {}
+        for _ in range(arity):
+            key, offset = _decode_term(data, offset)
+            value, offset = _decode_term(data, offset)
+            result[key] = value
+
+        return result, offset
+
+    if tag == LIST_EXT:
+        (length,) = _u32.unpack_from(data, offset)
+        offset += 4
+        result = []
+        for _ in range(length):
+            item, offset = _decode_term(data, offset)
+            result.append(item)
+
+        tail, offset = _decode_term(data, offset)
+        if tail != []:
+            # improper lists don't exist in JSON, so just keep the tail as the last item
+            result.append(tail)
+
+        return result, offset
+
+    if tag == NIL_EXT:
+        return [], offset
+
+    if tag in (SMALL_ATOM_UTF8_EXT, SMALL_ATOM_EXT):
+        length = data[offset]
+        offset += 1
+        encoding = "utf-8" if tag == SMALL_ATOM_UTF8_EXT else "latin-1"
+        return _atom(data[offset : offset + length], encoding), offset + length
+
+    if tag in (ATOM_UTF8_EXT, ATOM_EXT):
+        (length,) = _u16.unpack_from(data, offset)
+        offset += 2
+        encoding = "utf-8" if tag == ATOM_UTF8_EXT else "latin-1"
+        return _atom(data[offset : offset + length], encoding), offset + length
+
+    if tag in (SMALL_BIG_EXT, LARGE_BIG_EXT):
+        if tag == SMALL_BIG_EXT:
+            length = data[offset]
+            offset += 1
+        else:
+            (length,) = _u32.unpack_from(data, offset)
+            offset += 4
+
+        sign = data[offset]
+        offset += 1
+        value = int.from_bytes(data[offset : offset + length], "little")
+        return (-value if sign else value), offset + length
+
+    if tag == STRING_EXT:
+        # erlang encodes lists of small integers this way, so turn it back into a list
+        (length,) = _u16.unpack_from(data, offset)
+        offset += 2
+        return list(data[offset : offset + length]), offset + length
+
+    if tag == NEW_FLOAT_EXT:
+        return _f64.unpack_from(data, offset)[0], offset + 8
+
+    if tag == FLOAT_EXT:
+        raw = data[offset : offset + 31].split(b"\x00", 1)[0]
+        return float(raw), offset + 31
+
+    if tag in (SMALL_TUPLE_EXT, LARGE_TUPLE_EXT):
+        if tag == SMALL_TUPLE_EXT:
+            arity = data[offset]
+            offset += 1
+        else:
+            (arity,) = _u32.unpack_from(data, offset)
+            offset += 4
+
+        result = []
+        for _ in range(arity):
+            item, offset = _decode_term(data, offset)
+            result.append(item)
+
+        return result, offset
+
+    if tag == BIT_BINARY_EXT:
+        (length,) = _u32.unpack_from(data, offset)
+        offset += 5  # skip the number of bits in the last byte
+        return bytes(data[offset : offset + length]), offset + length
+
+    if tag == COMPRESSED:
+        (size,) = _u32.unpack_from(data, offset)
+        offset += 4
+        decompressor = zlib.decompressobj()
+        inner = decompressor.decompress(data[offset:], size)
+        term, _ = _decode_term(inner, 0)
+        return term, len(data) - len(decompressor.unused_data)
+
+    raise ETFDecodeError(f"Unknown term tag {tag}")
+
+
+def decode(data: bytes) -> Any:
+    """
+    Decodes an External Term Format payload.
+
+    :param data: The bytes to decode.
+    :return: The decoded Python object.
+    """
+    if isinstance(data, str):
+        data = data.encode("latin-1")
+
+    if not data or data[0] != FORMAT_VERSION:
+        raise ETFDecodeError("Payload is missing the ETF version header")
+
+    try:
+        term, _ = _decode_term(data, 1)
+    except (IndexError, struct.error) as e:
+        raise ETFDecodeError("Payload was truncated") from e
+
+    return term
+
+
+def _encode_term(obb: Any, buf: bytearray) -> None:
+    """
+    Encodes a single term onto the end of ``buf``.
+    """
+    # bool is a subclass of int, so it must be checked first
+    if obb is None or obb is True or obb is False:
+        name = "nil" if obb is None else ("true" if obb else "false")
+        buf.append(SMALL_ATOM_UTF8_EXT)
+        buf.append(len(name))
+        buf += name.encode("ascii")
+
+    elif isinstance(obb, int):
+        if 0 <= obb <= 255:
+            buf.append(SMALL_INTEGER_EXT)
+            buf.append(obb)
+        elif -(2 ** 31) <= obb < 2 ** 31:
+            buf.append(INTEGER_EXT)
+            buf += _i32.pack(obb)
+        else:
+            magnitude = abs(obb)
+            raw = magnitude.to_bytes((magnitude.bit_length() + 7) // 8, "little")
+            if len(raw) > 255:
+                raise ValueError("Integer is too large to encode")
+
+            buf.append(SMALL_BIG_EXT)
+            buf.append(len(raw))
+            buf.append(1 if obb < 0 else 0)
+            buf += raw
+
+    elif isinstance(obb, float):
+        buf.append(NEW_FLOAT_EXT)
+        buf += _f64.pack(obb)
+
+    elif isinstance(obb, (str, bytes, bytearray)):
+        if isinstance(obb, str):
+            obb = obb.encode("utf-8")
+
+        buf.append(BINARY_EXT)
+        buf += _u32.pack(len(obb))
+        buf += obb
+
+    elif isinstance(obb, dict):
+        buf.append(MAP_EXT)
+        buf += _u32.pack(len(obb))
+        for key, value in obb.items():
+            _encode_term(key, buf)
+            _encode_term(value, buf)
+
+    elif isinstance(obb, (list, tuple)):
+        if not obb:
+            buf.append(NIL_EXT)
+            return
+
+        buf.append(LIST_EXT)
+        buf += _u32.pack(len(obb))
+        for item in obb:
+            _encode_term(item, buf)
+
+        buf.append(NIL_EXT)
+
+    else:
+        raise TypeError(f"Cannot encode object of type {type(obb).__name__} as ETF")
+
+
+def encode(obb: Any) -> bytes:
+    """
+    Encodes an object into an External Term Format payload.
+
+    :param obb: The object to encode.
+    :return: The encoded bytes.
+    """
+    buf = bytearray([FORMAT_VERSION])
+    _encode_term(obb, buf)
+    return bytes(buf)
@@ -0,0 +1,272 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A native anyio websocket wrapper, using wsproto.
+
+Unlike the :class:`.UniversalWrapper`, this runs entirely on the event loop; there is no worker
+thread per shard and no cross-thread handoff per frame.
+"""
+import logging
+import ssl
+from urllib.parse import urlsplit
+
+import anyio
+from anyio.exceptions import ClosedResourceError
+from lomond.errors import WebSocketUnavailable
+from lomond.events import Binary, Closing, Connected, Connecting, Text
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import (
+    AcceptConnection,
+    BytesMessage,
+    CloseConnection,
+    Ping,
+    RejectConnection,
+    Request,
+    TextMessage,
+)
+from wsproto.utilities import LocalProtocolError
+
+from curious import USER_AGENT
+
+logger = logging.getLogger("curious.ws.anyio")
+
+
+class AnyioWrapper:
+    """
+    Represents a websocket wrapper that runs natively on anyio.
+
+    This yields the same event objects as the :class:`.UniversalWrapper`, so it can be used as a
+    drop-in replacement inside the gateway.
+    """
+
+    #: The number of bytes to read off the socket at once.
+    RECEIVE_SIZE = 65536
+
+    #: The maximum number of seconds to wait between reconnects.
+    MAX_BACKOFF = 30
+
+    #: The number of seconds to wait for the server to finish a closing handshake.
+    CLOSE_TIMEOUT = 5
+
+    def __init__(self, url: str, task_group: anyio.TaskGroup):
+        self._url = url
+        self._task_group = task_group
+
+        self._sock: anyio.SocketStream = None
+        self._ws: WSConnection = None
+        self._send_lock = anyio.create_lock()
+        self._disconnected = anyio.create_event()
+
+        self._cancelled = False
+
+    async def _send_event(self, event) -> None:
+        """
+        Serializes a wsproto event and writes it to the socket.
+        """
+        if self._sock is None or self._ws is None:
+            raise WebSocketUnavailable("The websocket is not connected")
+
+        data = self._ws.send(event)
+        async with self._send_lock:
+            await self._sock.send_all(data)
+
+    async def _connect(self) -> None:
+        """
+        Opens the TCP connection and sends the opening handshake.
+        """
+        split = urlsplit(self._url)
+        secure = split.scheme == "wss"
+        port = split.port or (443 if secure else 80)
+        host = split.hostname
+        if port != (443 if secure else 80):
+            host = f"{host}:{port}"
+
+        target = split.path or "/"
+        if split.query:
+            target = f"{target}?{split.query}"
+
+        ssl_context = ssl.create_default_context() if secure else None
+        self._sock = await anyio.connect_tcp(
+            split.hostname, port, ssl_context=ssl_context, autostart_tls=secure
+        )
+        self._ws = WSConnection(ConnectionType.CLIENT)
+        self._disconnected = anyio.create_event()
+        request = Request(
+            host=host,
+            target=target,
+            extra_headers=[(b"user-agent", USER_AGENT.encode("utf-8"))],
+        )
+        await self._send_event(request)
+
+    async def _abort(self) -> None:
+        """
+        Drops the underlying socket without performing a closing handshake.
+        """
+        sock, self._sock = self._sock, None
+        self._ws = None
+        if sock is not None:
+            try:
+                await sock.close()
+            except (OSError, ClosedResourceError):
+                pass
+
+        await self._disconnected.set()
+
+    async def _wait_for_close(self, sock: anyio.SocketStream) -> None:
+        """
+        Waits for the server to finish the closing handshake on a connection, dropping it if the
+        server doesn't answer in time.
+        """
+        disconnected = self._disconnected
+        async with anyio.move_on_after(self.CLOSE_TIMEOUT):
+            await disconnected.wait()
+
+        if not disconnected.is_set() and self._sock is sock:
+            logger.warning("Server did not finish the closing handshake, dropping the connection")
+            await self._abort()
+
+    async def _read_events(self):
+        """
+        Reads events off of the current connection until it closes.
+        """
+        text_parts = []
+        binary_parts = []
+
+        while True:
+            try:
+                data = await self._sock.receive_some(self.RECEIVE_SIZE)
+            except (OSError, ClosedResourceError, AttributeError):
+                # AttributeError happens if we were aborted and the socket is now None
+                yield Closing(1006, "Connection lost")
+                return
+
+            self._ws.receive_data(data or None)
+
+            for event in self._ws.events():
+                if isinstance(event, AcceptConnection):
+                    yield Connected(self._url)
+
+                elif isinstance(event, RejectConnection):
+                    yield Closing(1006, f"Handshake rejected with {event.status_code}")
+                    return
+
+                elif isinstance(event, TextMessage):
+                    text_parts.append(event.data)
+                    if event.message_finished:
+                        yield Text("".join(text_parts))
+                        text_parts.clear()
+
+                elif isinstance(event, BytesMessage):
+                    binary_parts.append(event.data)
+                    if event.message_finished:
+                        yield Binary(b"".join(binary_parts))
+                        binary_parts.clear()
+
+                elif isinstance(event, Ping):
+                    await self._send_event(event.response())
+
+                elif isinstance(event, CloseConnection):
+                    # if we started the close, the handshake is already complete
+                    try:
+                        await self._send_event(event.response())
+                    except (
+                        OSError,
+                        ClosedResourceError,
+                        WebSocketUnavailable,
+                        LocalProtocolError,
+                    ):
+                        pass
+
+                    yield Closing(event.code, event.reason or "")
+                    return
+
+            if not data:
+                yield Closing(1006, "Connection closed without a close frame")
+                return
+
+    async def run(self):
+        """
+        Runs the websocket, reconnecting as appropriate.
+
+        This returns an async generator.
+        """
+        backoff = 1
+
+        while not self._cancelled:
+            yield Connecting(self._url)
+
+            try:
+                await self._connect()
+            except (OSError, ClosedResourceError) as e:
+                logger.warning("Failed to connect to %s: %s", self._url, e)
+            else:
+                backoff = 1
+                async for event in self._read_events():
+                    yield event
+
+            await self._abort()
+            if self._cancelled:
+                break
+
+            logger.info("Reconnecting in %s seconds", backoff)
+            await anyio.sleep(backoff)
+            backoff = min(backoff * 2, self.MAX_BACKOFF)
+
+    async def send_text(self, message: str):
+        """
+        Sends some text down the websocket.
+        """
+        await self._send_event(TextMessage(data=message))
+
+    async def send_binary(self, data: bytes):
+        """
+        Sends some binary data down the websocket.
+        """
+        await self._send_event(BytesMessage(data=data))
+
+    async def close(self, code: int = 1006, reason: str = "No reason", *, kill: bool = False):
+        """
+        Closes the websocket.
+
+        A close code of 1006 drops the connection without a closing handshake, which allows the
+        session to be resumed afterwards. Otherwise, the connection is dropped if the server
+        doesn't finish the closing handshake within :attr:`.CLOSE_TIMEOUT` seconds.
+        """
+        if kill:
+            self._cancelled = True
+
+        if self._sock is None:
+            return
+
+        if code == 1006:
+            await self._abort()
+            return
+
+        sock = self._sock
+        async with anyio.move_on_after(self.CLOSE_TIMEOUT) as scope:
+            try:
+                await self._send_event(CloseConnection(code=code, reason=reason))
+            except (OSError, ClosedResourceError, WebSocketUnavailable, LocalProtocolError):
+                await self._abort()
+                return
+
+        if scope.cancel_called:
+            await self._abort()
+            return
+
+        # the reader finishes the handshake when the server answers; this may be called from the
+        # task that runs the reader, so wait for the answer in the background
+        await self._task_group.spawn(self._wait_for_close, sock)
@@ -81,6 +81,13 @@ class UniversalWrapper:
         if self._ws is not None:
             await anyio.run_in_thread(self._ws.send_text, message)
 
+    async def send_binary(self, data: bytes):
+        """
+        Sends some binary data over the generator.
+        """
+        if self._ws is not None:
+            await anyio.run_in_thread(self._ws.send_binary, data)
+
     async def close(self, code: int = 1006, reason: str = "No reason", *, kill: bool = False):
         """
         Closes the websocket.
@@ -0,0 +1,631 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Bounded caches used by the state.
+
+Messages are cached per channel, so that a busy channel can't push every other channel's messages
+out of the cache. How many messages each channel keeps is decided by a :class:`.RetentionPolicy`:
+
+.. code-block:: python3
+
+    store = client.state.messages
+    # keep 1000 messages in every text channel, but nothing from voice channel text chats
+    store.default_policy = RetentionPolicy(max_messages=1000)
+    store.policies[ChannelType.VOICE] = RetentionPolicy.disabled()
+    # never keep more than 100,000 messages in total
+    store.max_messages = 100_000
+
+.. currentmodule:: curious.core.cache
+"""
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Dict, Generic, Hashable, Iterator, List, Mapping, Optional, TypeVar
+
+from curious.dataclasses.channel import ChannelType
+from curious.dataclasses.message import Message
+
+#: The type of a callback called when a message is evicted from a cache.
+EvictionCallback = Callable[[Message], None]
+
+
+class MessageCache(object):
+    """
+    A bounded cache of messages, indexed by message ID.
+
+    Messages are kept in insertion order; once the cache is full, the oldest message is evicted to
+    make room for a new one. Lookups, inserts and evictions are all O(1).
+    """
+
+    def __init__(self, max_size: Optional[int] = 500, *, ttl: float = None, lru: bool = False):
+        """
+        :param max_size: The maximum number of messages to keep, or None for no limit.
+        :param ttl: The number of seconds a message is kept for, or None to keep it until it is
+            evicted for space.
+        :param lru: If True, looking up a message makes it the newest message again. Otherwise,
+            messages are evicted in the order they were added.
+        """
+        self._max_size = max_size
+        self._ttl = ttl
+        self._lru = lru
+        self._messages: "OrderedDict[int, Message]" = OrderedDict()
+        self._added_at: Dict[int, float] = {}
+        self._eviction_callbacks: List[EvictionCallback] = []
+
+    def __repr__(self) -> str:
+        return f"<MessageCache size={len(self)} max_size={self._max_size}>"
+
+    def __len__(self) -> int:
+        return len(self._messages)
+
+    def __iter__(self) -> Iterator[Message]:
+        """
+        :return: An iterator over the cached messages, from oldest to newest.
+        """
+        return iter(self._messages.values())
+
+    def __reversed__(self) -> Iterator[Message]:
+        return reversed(self._messages.values())
+
+    def __contains__(self, item) -> bool:
+        """
+        :param item: A :class:`.Message`, or a message ID.
+        """
+        if isinstance(item, Message):
+            item = item.id
+
+        return item in self._messages
+
+    def __getitem__(self, message_id: int) -> Message:
+        return self._messages[message_id]
+
+    @property
+    def max_size(self) -> Optional[int]:
+        """
+        :return: The maximum number of messages this cache holds, or None for no limit.
+        """
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, value: Optional[int]) -> None:
+        self._max_size = value
+        self._evict()
+
+    def add_eviction_callback(self, callback: EvictionCallback) -> None:
+        """
+        Adds a callback that is called with every message evicted to stay within the size limit,
+        or because it expired. Messages removed with :meth:`.MessageCache.remove` are not passed
+        to the callback.
+
+        :param callback: The callable to add.
+        """
+        self._eviction_callbacks.append(callback)
+
+    def remove_eviction_callback(self, callback: EvictionCallback) -> None:
+        """
+        Removes an eviction callback.
+
+        :param callback: The callable to remove.
+        """
+        self._eviction_callbacks.remove(callback)
+
+    def _pop_oldest(self) -> None:
+        message_id, message = self._messages.popitem(last=False)
+        self._added_at.pop(message_id, None)
+        for callback in self._eviction_callbacks:
+            callback(message)
+
+    def _evict(self) -> None:
+        if self._ttl is not None:
+            # messages are in the same order as their timestamps, so only the front needs checking
+            deadline = time.monotonic() - self._ttl
+            while self._messages and self._added_at[next(iter(self._messages))] <= deadline:
+                self._pop_oldest()
+
+        if self._max_size is not None:
+            while len(self._messages) > self._max_size:
+                self._pop_oldest()
+
+    def get(self, message_id: int, default=None) -> Optional[Message]:
+        """
+        Gets a message by ID.
+
+        :param message_id: The ID of the message.
+        :param default: The value to return if the message isn't cached.
+        :return: The :class:`.Message`, or the default.
+        """
+        if self._ttl is not None:
+            self._evict()
+
+        message = self._messages.get(message_id, default)
+        if self._lru and message is not default:
+            self._touch(message_id)
+
+        return message
+
+    def _touch(self, message_id: int) -> None:
+        self._messages.move_to_end(message_id)
+        if self._ttl is not None:
+            self._added_at[message_id] = time.monotonic()
+
+    def add(self, message: Message) -> None:
+        """
+        Adds a message to the cache, as the newest message. A cached message with the same ID is
+        replaced.
+
+        :param message: The :class:`.Message` to add.
+        """
+        self._messages[message.id] = message
+        self._touch(message.id)
+        self._evict()
+
+    def remove(self, message_id: int) -> Optional[Message]:
+        """
+        Removes a message from the cache.
+
+        :param message_id: The ID of the message to remove.
+        :return: The removed :class:`.Message`, or None if it wasn't cached.
+        """
+        self._added_at.pop(message_id, None)
+        return self._messages.pop(message_id, None)
+
+    def clear(self) -> None:
+        """
+        Removes every message from the cache.
+        """
+        self._messages.clear()
+        self._added_at.clear()
+
+
+@dataclass
+class RetentionPolicy:
+    """
+    Decides how many messages a channel keeps in the cache, and for how long.
+    """
+
+    #: The maximum number of messages kept for a channel, or None for no per-channel limit.
+    #: A limit of 0 disables caching for the channel.
+    max_messages: Optional[int] = 100
+
+    #: The number of seconds messages are kept for, or None to keep them until they are evicted.
+    ttl: Optional[float] = None
+
+    #: If looking up a message makes it the newest message again (LRU), rather than messages
+    #: being evicted in the order they arrived.
+    lru: bool = True
+
+    @classmethod
+    def disabled(cls) -> "RetentionPolicy":
+        """
+        :return: A :class:`.RetentionPolicy` that doesn't cache anything.
+        """
+        return cls(max_messages=0)
+
+    @property
+    def enabled(self) -> bool:
+        """
+        :return: If this policy caches anything at all.
+        """
+        return self.max_messages != 0
+
+
+@dataclass
+class CacheStats:
+    """
+    Represents the hit and miss counters for a cache.
+    """
+
+    #: The number of lookups that found the item.
+    hits: int = 0
+
+    #: The number of lookups that didn't find the item.
+    misses: int = 0
+
+    #: The number of items evicted for space, or because they expired.
+    evictions: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """
+        :return: The fraction of lookups that were hits.
+        """
+        total = self.hits + self.misses
+        if not total:
+            return 0
+
+        return self.hits / total
+
+
+@dataclass
+class CachePolicy:
+    """
+    Decides which categories of objects the state caches.
+
+    .. code-block:: python3
+
+        # only keep members that have been active in the last 10 minutes, and skip presences
+        policy = CachePolicy(member_ttl=600, presences=False)
+        client = Client(token, cache_policy=policy)
+
+    Roles and channels are always cached, as permissions and message parsing depend on them. The
+    bot's own member is always cached too.
+    """
+
+    #: If guild members are cached at all. Without members, events for uncached members still
+    #: fire with a member built from the event, where possible.
+    members: bool = True
+
+    #: If only online members are cached. Members are cached when they come online, and evicted
+    #: when they go offline. This requires presences to be received.
+    online_members_only: bool = False
+
+    #: If set, members that haven't been seen (e.g. sending a message, or a presence update) for
+    #: this many seconds are evicted.
+    member_ttl: Optional[float] = None
+
+    #: If members from GUILD_CREATE and member chunks are stored as compact records, and only
+    #: turned into :class:`.Member` objects when they are first accessed.
+    lazy_members: bool = False
+
+    #: If member presences are cached.
+    presences: bool = True
+
+    #: If guild emojis are cached.
+    emojis: bool = True
+
+    #: If voice states are cached.
+    voice_states: bool = True
+
+    @classmethod
+    def minimal(cls) -> "CachePolicy":
+        """
+        :return: A :class:`.CachePolicy` that caches as little as possible.
+        """
+        return cls(members=False, presences=False, emojis=False, voice_states=False)
+
+    @property
+    def chunk_members(self) -> bool:
+        """
+        :return: If member chunks should be requested for large guilds.
+        """
+        return self.members and not self.online_members_only
+
+    @property
+    def cache_event_members(self) -> bool:
+        """
+        :return: If uncached members built from events (such as the author of a message) are
+            added to the cache. This is only done when members are evicted by a TTL, so that the
+            cache follows activity instead of growing without bound.
+        """
+        return self.members and not self.online_members_only and self.member_ttl is not None
+
+
+@dataclass
+class UserCacheStats:
+    """
+    Represents the size and churn of the user cache.
+    """
+
+    #: The number of users currently cached.
+    size: int = 0
+
+    #: The number of users added to the cache.
+    created: int = 0
+
+    #: The number of users evicted from the cache, because nothing referenced them anymore.
+    evicted: int = 0
+
+    @property
+    def churn(self) -> int:
+        """
+        :return: The total number of users added to and evicted from the cache.
+        """
+        return self.created + self.evicted
+
+
+T = TypeVar("T")
+
+
+class InternTable(Generic[T]):
+    """
+    A bounded table of shared objects, keyed by the data they were created from.
+
+    Objects that are identical between many members (such as presences and activities) are
+    created once and shared, so they must never be modified once they have been interned. The
+    least recently used objects are dropped once the table is full.
+    """
+
+    def __init__(self, max_size: int = 4096):
+        """
+        :param max_size: The maximum number of objects to keep in the table.
+        """
+        #: The maximum number of objects kept in this table.
+        self.max_size = max_size
+
+        #: The :class:`.CacheStats` for this table.
+        self.stats = CacheStats()
+
+        self._table = OrderedDict()  # type: OrderedDict[Hashable, T]
+
+    def get(self, key: Hashable, factory: Callable[[], T]) -> T:
+        """
+        Gets the shared object for a key, creating it if it isn't in the table.
+
+        :param key: The key derived from the data the object is created from.
+        :param factory: A callable that creates the object.
+        :return: The shared object.
+        """
+        try:
+            obb = self._table[key]
+        except KeyError:
+            self.stats.misses += 1
+        else:
+            self.stats.hits += 1
+            self._table.move_to_end(key)
+            return obb
+
+        obb = self._table[key] = factory()
+        if len(self._table) > self.max_size:
+            self._table.popitem(last=False)
+            self.stats.evictions += 1
+
+        return obb
+
+    def clear(self) -> None:
+        """
+        Removes every object from the table.
+        """
+        self._table.clear()
+
+    def __len__(self) -> int:
+        return len(self._table)
+
+
+class MessageStore(object):
+    """
+    The state's message cache, made up of a :class:`.MessageCache` per channel.
+
+    Each channel's cache is bounded by the :class:`.RetentionPolicy` for that channel, and every
+    channel shares a global limit; once that is reached, the oldest message across every channel is
+    evicted.
+    """
+
+    def __init__(
+        self,
+        max_messages: Optional[int] = 500,
+        *,
+        default_policy: RetentionPolicy = None,
+        policies: Mapping[ChannelType, RetentionPolicy] = None,
+    ):
+        """
+        :param max_messages: The maximum number of messages cached across every channel, or None
+            for no global limit.
+        :param default_policy: The :class:`.RetentionPolicy` for channels without a more specific
+            policy.
+        :param policies: A mapping of :class:`.ChannelType` -> :class:`.RetentionPolicy`.
+        """
+        self._max_messages = max_messages
+
+        #: The :class:`.RetentionPolicy` for channels without a more specific policy.
+        self.default_policy = default_policy or RetentionPolicy()
+
+        #: A mapping of :class:`.ChannelType` -> :class:`.RetentionPolicy`.
+        self.policies: Dict[ChannelType, RetentionPolicy] = dict(policies or {})
+
+        #: A mapping of channel ID -> :class:`.RetentionPolicy`, which takes priority over
+        #: everything else.
+        self.channel_policies: Dict[int, RetentionPolicy] = {}
+
+        #: The :class:`.CacheStats` for message lookups.
+        self.stats = CacheStats()
+
+        self._channels: Dict[int, MessageCache] = {}
+        # every cached message, oldest first, mapped to the channel cache it lives in
+        self._order: "OrderedDict[int, MessageCache]" = OrderedDict()
+        self._eviction_callbacks: List[EvictionCallback] = []
+
+    def __repr__(self) -> str:
+        return (
+            f"<MessageStore size={len(self)} channels={len(self._channels)} "
+            f"max_messages={self._max_messages}>"
+        )
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __iter__(self) -> Iterator[Message]:
+        """
+        :return: An iterator over every cached message, from oldest to newest.
+        """
+        return (cache[message_id] for (message_id, cache) in self._order.items())
+
+    def __reversed__(self) -> Iterator[Message]:
+        return (self._order[message_id][message_id] for message_id in reversed(self._order))
+
+    def __contains__(self, item) -> bool:
+        """
+        :param item: A :class:`.Message`, or a message ID.
+        """
+        if isinstance(item, Message):
+            item = item.id
+
+        return item in self._order
+
+    def __getitem__(self, message_id: int) -> Message:
+        return self._order[message_id][message_id]
+
+    @property
+    def max_messages(self) -> Optional[int]:
+        """
+        :return: The maximum number of messages cached across every channel, or None for no limit.
+        """
+        return self._max_messages
+
+    @max_messages.setter
+    def max_messages(self, value: Optional[int]) -> None:
+        self._max_messages = value
+        self._evict()
+
+    def add_eviction_callback(self, callback: EvictionCallback) -> None:
+        """
+        Adds a callback that is called with every evicted or expired message.
+
+        :param callback: The callable to add.
+        """
+        self._eviction_callbacks.append(callback)
+
+    def remove_eviction_callback(self, callback: EvictionCallback) -> None:
+        """
+        Removes an eviction callback.
+
+        :param callback: The callable to remove.
+        """
+        self._eviction_callbacks.remove(callback)
+
+    def policy_for(self, channel_id: int, channel_type: ChannelType = None) -> RetentionPolicy:
+        """
+        Gets the :class:`.RetentionPolicy` for a channel.
+
+        :param channel_id: The ID of the channel.
+        :param channel_type: The :class:`.ChannelType` of the channel, if known.
+        :return: The :class:`.RetentionPolicy` for the channel.
+        """
+        try:
+            return self.channel_policies[channel_id]
+        except KeyError:
+            return self.policies.get(channel_type, self.default_policy)
+
+    def set_channel_policy(self, channel_id: int, policy: Optional[RetentionPolicy]) -> None:
+        """
+        Overrides the :class:`.RetentionPolicy` for a single channel. The channel's cached
+        messages are dropped, so that the new policy applies from a clean slate.
+
+        :param channel_id: The ID of the channel.
+        :param policy: The :class:`.RetentionPolicy` to use, or None to remove the override.
+        """
+        if policy is None:
+            self.channel_policies.pop(channel_id, None)
+        else:
+            self.channel_policies[channel_id] = policy
+
+        self.drop_channel(channel_id)
+
+    def channel_cache(self, channel_id: int) -> Optional[MessageCache]:
+        """
+        :param channel_id: The ID of the channel.
+        :return: The :class:`.MessageCache` for the channel, or None if nothing is cached for it.
+        """
+        return self._channels.get(channel_id)
+
+    def _on_evict(self, message: Message) -> None:
+        self._order.pop(message.id, None)
+        self.stats.evictions += 1
+        for callback in self._eviction_callbacks:
+            callback(message)
+
+        cache = self._channels.get(message.channel_id)
+        if cache is not None and not len(cache):
+            del self._channels[message.channel_id]
+
+    def _evict(self) -> None:
+        if self._max_messages is None:
+            return
+
+        while len(self._order) > self._max_messages:
+            message_id, cache = next(iter(self._order.items()))
+            message = cache.remove(message_id)
+            self._on_evict(message)
+
+    def get(self, message_id: int, default=None) -> Optional[Message]:
+        """
+        Gets a message by ID, counting the lookup in :attr:`.MessageStore.stats`.
+
+        :param message_id: The ID of the message.
+        :param default: The value to return if the message isn't cached.
+        :return: The :class:`.Message`, or the default.
+        """
+        cache = self._order.get(message_id)
+        message = cache.get(message_id) if cache is not None else None
+        if message is None:
+            self.stats.misses += 1
+            return default
+
+        self.stats.hits += 1
+        if cache._lru:
+            self._order.move_to_end(message_id)
+
+        return message
+
+    def add(self, message: Message, channel_type: ChannelType = None) -> None:
+        """
+        Adds a message to the cache of its channel.
+
+        :param message: The :class:`.Message` to add.
+        :param channel_type: The :class:`.ChannelType` of the message's channel, used to pick the
+            :class:`.RetentionPolicy` if the channel has nothing cached yet.
+        """
+        channel_id = message.channel_id
+        cache = self._channels.get(channel_id)
+        if cache is None:
+            policy = self.policy_for(channel_id, channel_type)
+            if not policy.enabled:
+                return
+
+            cache = MessageCache(policy.max_messages, ttl=policy.ttl, lru=policy.lru)
+            cache.add_eviction_callback(self._on_evict)
+            self._channels[channel_id] = cache
+
+        cache.add(message)
+        self._order[message.id] = cache
+        self._order.move_to_end(message.id)
+        self._evict()
+
+    def remove(self, message_id: int) -> Optional[Message]:
+        """
+        Removes a message from the cache.
+
+        :param message_id: The ID of the message to remove.
+        :return: The removed :class:`.Message`, or None if it wasn't cached.
+        """
+        cache = self._order.pop(message_id, None)
+        if cache is None:
+            return None
+
+        message = cache.remove(message_id)
+        if not len(cache):
+            self._channels.pop(message.channel_id, None)
+
+        return message
+
+    def drop_channel(self, channel_id: int) -> None:
+        """
+        Removes every cached message for a channel.
+
+        :param channel_id: The ID of the channel.
+        """
+        cache = self._channels.pop(channel_id, None)
+        if cache is None:
+            return
+
+        for message in cache:
+            self._order.pop(message.id, None)
+
+    def clear(self) -> None:
+        """
+        Removes every message from the cache.
+        """
+        self._channels.clear()
+        self._order.clear()
@@ -20,6 +20,7 @@ from typing import List, MutableMapping
 from curious import current_event_context
 from curious.core import client as md_client
 from curious.core.event import event
+from curious.core.gateway import GatewayIntent
 from curious.dataclasses import guild as md_guild
 
 logger = logging.getLogger(__name__)
@@ -54,11 +55,20 @@ class Chunker(object):
         event_handler.add_event(self.handle_new_guild)
         event_handler.add_event(self.handle_member_chunk)
         event_handler.add_event(self.unconditionally_chunk_rest)
+        event_handler.add_event(self.handle_resumed)
 
     async def fire_chunks(self, shard_id: int, guilds: "List[md_guild.Guild]"):
         """
         Fires off GUILD_MEMBER_CHUNK requests for the list of guilds.
         """
+        if not self.client.state.intents & GatewayIntent.GUILD_MEMBERS:
+            # discord won't send chunks without the members intent
+            return
+
+        if not self.client.state.cache_policy.chunk_members:
+            # the members wouldn't be cached anyway
+            return
+
         logger.info("Firing a chunk request for %s guilds", len(guilds))
         ids = [guild.id for guild in guilds]
         gateway = self.client._gateways[shard_id]
@@ -152,6 +162,20 @@ class Chunker(object):
         # immediately chunk
         await self.fire_chunks(ctx.shard_id, [guild])
 
+    @event("resumed")
+    async def handle_resumed(self):
+        """
+        Handles a shard resuming a session from a previous process.
+        """
+        ctx = current_event_context()
+        if self._connected[ctx.shard_id]:
+            # regular resume, nothing to do
+            return
+
+        # the state was restored from a snapshot, so the guilds are already chunked
+        self._connected[ctx.shard_id] = True
+        await self._potentially_fire_ready(ctx.shard_id)
+
     # clear any pending guilds
     @event("connect")
     async def unconditionally_chunk_rest(self):
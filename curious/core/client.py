@@ -25,15 +25,20 @@ import enum
 import logging
 from os import PathLike
 from types import MappingProxyType
-from typing import Any, Iterable, Mapping, MutableMapping, Tuple, Union
+from typing import TYPE_CHECKING, Any, Iterable, Mapping, MutableMapping, Optional, Tuple, Union
 
 import anyio
 
-from curious.core import chunker as md_chunker
+from curious.core import _current_client, _current_shard, chunker as md_chunker
+from curious.core.cache import CachePolicy
 from curious.core.event import EventManager, event as ev_dec, scan_events
-from curious.core.gateway import GatewayHandler, open_websocket
+from curious.core.event.policy import DispatchPolicy, DispatchPolicyTable
+from curious.core.gateway import GatewayHandler, GatewayIntent, open_websocket
 from curious.core.httpclient import HTTPClient
-from curious.dataclasses import channel as dt_channel, guild as dt_guild
+from curious.core.ratelimit import IdentifyLimiter
+from curious.core.replay import GatewayRecorder, ReplayStats, open_replay, replay_events
+from curious.core.session import SessionStore
+from curious.dataclasses import channel as dt_channel, guild as dt_guild, member as dt_member
 from curious.dataclasses.appinfo import AppInfo
 from curious.dataclasses.invite import Invite
 from curious.dataclasses.message import CHANNEL_REGEX, EMOJI_REGEX, MENTION_REGEX
@@ -41,9 +46,12 @@ from curious.dataclasses.presence import Status, ActivityType
 from curious.dataclasses.user import BotUser, User
 from curious.dataclasses.webhook import Webhook
 from curious.dataclasses.widget import Widget
-from curious.exc import Unauthorized
+from curious.exc import HTTPException, Unauthorized
 from curious.util import base64ify, coerce_agen, finalise
 
+if TYPE_CHECKING:
+    from curious.core.cluster import ClusterWorker
+
 logger = logging.getLogger("curious.client")
 
 
@@ -81,6 +89,51 @@ class InvalidTokenException(ValueError):
         self.token = token
 
 
+class InvalidIntentsException(ValueError):
+    """
+    Raised when Discord rejects the intents the bot identified with.
+
+    A close code of 4014 means a privileged intent hasn't been enabled for this bot in the
+    developer portal; 4013 means the intents value itself is invalid.
+    """
+
+    def __init__(self, code: int, intents: GatewayIntent = None):
+        #: The close code Discord sent.
+        self.code = code
+
+        #: The intents that were rejected, if known.
+        self.intents = intents
+
+        described = "the intents" if intents is None else f"intents {intents!r}"
+        if code == 4014:
+            msg = (
+                f"Discord rejected {described}, as they include a privileged intent that isn't "
+                f"enabled for this bot in the developer portal."
+            )
+        else:
+            msg = f"Discord rejected {described} as invalid."
+
+        super().__init__(msg)
+
+
+class ShardBootStage(enum.IntEnum):
+    """
+    Represents how far along a shard is in booting.
+    """
+
+    #: The shard has been spawned, but hasn't opened a connection yet.
+    WAITING = 0
+
+    #: The shard is opening its websocket connection.
+    CONNECTING = 1
+
+    #: The shard has received HELLO, and is identifying or resuming.
+    IDENTIFYING = 2
+
+    #: The shard has received READY or RESUMED.
+    READY = 3
+
+
 class ReshardingNeeded(Exception):
     """
     Raised when resharding is needed. This should not be caught.
@@ -118,12 +171,48 @@ class Client(object):
     IGNORE_READY = ["connect", "guild_streamed", "guild_chunk", "guild_available", "guild_sync"]
 
     def __init__(
-        self, token: str, *, state_klass=None, bot_type: int = (BotType.BOT | BotType.ONLY_USER)
+        self,
+        token: str,
+        *,
+        state_klass=None,
+        bot_type: int = (BotType.BOT | BotType.ONLY_USER),
+        gateway_transport: str = "lomond",
+        gateway_encoding: str = "json",
+        intents: GatewayIntent = None,
+        privileged_intents: GatewayIntent = None,
+        derive_intents: bool = False,
+        session_store: SessionStore = None,
+        gateway_record_path: str = None,
+        gateway_record_inflated: bool = False,
+        cache_policy: CachePolicy = None,
     ):
         """
         :param token: The current token for this bot.
         :param state_klass: The class to construct the connection state from.
         :param bot_type: A union of :class:`.BotType` that defines the type of this bot.
+        :param gateway_transport: The websocket transport to use for the gateway. See
+            :func:`.open_websocket`.
+        :param gateway_encoding: The payload encoding to use for the gateway, either ``"json"`` or
+            ``"etf"``.
+        :param intents: The :class:`.GatewayIntent` to identify with. If this is None, and neither
+            ``privileged_intents`` nor ``derive_intents`` are set, no intents are sent and every
+            event is received.
+        :param privileged_intents: The privileged intents (see :meth:`.GatewayIntent.privileged`)
+            to subscribe to alongside every unprivileged intent, or alongside the derived intents.
+            These must be enabled for the bot in the developer portal, so they are never derived
+            from event listeners.
+        :param derive_intents: If the unprivileged intents should be narrowed down to the ones
+            needed by the event listeners registered when the bot starts. Events for intents that
+            aren't subscribed to are never received, so listeners added afterwards (including the
+            temporary listeners used by :meth:`.Client.wait_for`) may never fire.
+        :param session_store: The :class:`.SessionStore` used to persist gateway sessions and a
+            snapshot of the state across restarts, so that shards can RESUME.
+        :param gateway_record_path: If set, incoming gateway traffic is recorded to this path,
+            which is formatted with ``shard_id``. See :mod:`curious.core.replay`.
+        :param gateway_record_inflated: If inflated payloads should be recorded, rather than the
+            raw zlib-stream frames.
+        :param cache_policy: The :class:`.CachePolicy` that decides what the state caches. If
+            this is None, everything is cached.
         """
         #: The mapping of `shard_id -> gateway` objects.
         self._gateways: MutableMapping[int, GatewayHandler] = {}
@@ -131,6 +220,15 @@ class Client(object):
         #: The number of shards this client has.
         self.shard_count = 0
 
+        #: The number of identify buckets this bot has, from ``/gateway/bot``.
+        self.max_concurrency = 1
+
+        #: The :class:`.IdentifyLimiter` shared between all shards.
+        self.identify_limiter = IdentifyLimiter(self.max_concurrency)
+
+        #: The mapping of `shard_id -> boot stage`.
+        self._boot_progress: MutableMapping[int, ShardBootStage] = {}
+
         #: The token for the bot.
         self._token = token
 
@@ -140,13 +238,48 @@ class Client(object):
             state_klass = State
 
         #: The current connection state for the bot.
-        self.state = state_klass()
+        if cache_policy is not None:
+            self.state = state_klass(cache_policy=cache_policy)
+        else:
+            self.state = state_klass()
 
         #: The bot type for this bot.
         self.bot_type = bot_type
 
+        #: The websocket transport used for each shard.
+        self.gateway_transport = gateway_transport
+
+        #: The payload encoding used for each shard.
+        self.gateway_encoding = gateway_encoding
+
+        #: The explicitly set intents for this bot, if any.
+        self._intents: GatewayIntent = intents
+
+        #: The privileged intents added to the unprivileged or derived intents, if any.
+        self.privileged_intents = privileged_intents
+
+        #: If intents are narrowed down to the ones needed by registered event listeners.
+        self.derive_intents = derive_intents
+
+        #: The intents the shards identify with, decided when the shards are started.
+        self._identify_intents: Optional[GatewayIntent] = None
+
+        #: The :class:`.SessionStore` for this bot, if any.
+        self.session_store = session_store
+
+        #: The path template gateway traffic is recorded to, if any.
+        self.gateway_record_path = gateway_record_path
+
+        #: If recordings contain inflated payloads rather than raw frames.
+        self.gateway_record_inflated = gateway_record_inflated
+
         #: The current :class:`.EventManager` for this bot.
         self.events = EventManager()
+
+        #: The :class:`.DispatchPolicyTable` used to decide how much work is done per dispatch.
+        self.dispatch_policies = DispatchPolicyTable(self.events)
+        # only copy "before" objects for events that are going to be fired
+        self.state.event_filter = self._fires_events
         #: The current :class:`.Chunker` for this bot.
         self.chunker = md_chunker.Chunker(self)
         self.chunker.register_events(self.events)
@@ -165,6 +298,9 @@ class Client(object):
         #: The task manager used for this bot.
         self.task_manager: anyio.TaskGroup = None
 
+        #: The :class:`.ClusterWorker` this client is running in, if it is part of a cluster.
+        self.cluster: "ClusterWorker" = None
+
         for (name, event) in scan_events(self):
             self.events.add_event(event)
 
@@ -216,6 +352,56 @@ class Client(object):
 
         return c
 
+    @property
+    def intents(self) -> Optional[GatewayIntent]:
+        """
+        The :class:`.GatewayIntent` this bot identifies with, or None if no intents are sent (and
+        every event is received).
+
+        Unless explicitly set, this is None if neither :attr:`.Client.privileged_intents` nor
+        :attr:`.Client.derive_intents` are set, and otherwise every unprivileged intent plus
+        :attr:`.Client.privileged_intents`. With :attr:`.Client.derive_intents`, the unprivileged
+        intents are derived from the events that currently have listeners instead. Listeners
+        added after a shard has identified (e.g. a temporary listener for an event nothing else
+        listens to) won't change that shard's intents until it re-identifies.
+        """
+        if self._intents is not None:
+            return self._intents
+
+        privileged = self.privileged_intents
+        if not self.derive_intents:
+            if privileged is None:
+                return None
+
+            return GatewayIntent.unprivileged() | privileged
+
+        derived = self._wanted_intents() & ~GatewayIntent.privileged()
+        return derived if privileged is None else derived | privileged
+
+    @intents.setter
+    def intents(self, value: Optional[GatewayIntent]) -> None:
+        self._intents = value
+
+    def _wanted_intents(self) -> GatewayIntent:
+        """
+        :return: The intents needed for every registered listener and hook, including privileged
+            intents.
+        """
+        events = self.events.wanted_events
+        # hooks that don't say which events they want see every event, so give them everything
+        # that doesn't need to be enabled in the developer portal
+        if events is None:
+            return GatewayIntent.unprivileged()
+
+        return GatewayIntent.from_events(events)
+
+    @property
+    def boot_progress(self) -> "Mapping[int, ShardBootStage]":
+        """
+        :return: A read-only view of the :class:`.ShardBootStage` of each shard.
+        """
+        return MappingProxyType(self._boot_progress)
+
     @property
     def gateways(self) -> "Mapping[int, GatewayHandler]":
         """
@@ -247,6 +433,49 @@ class Client(object):
         else:
             return await self.http.get_gateway_url()
 
+    async def _update_gateway_info(self) -> Tuple[str, int]:
+        """
+        Fetches ``/gateway/bot``, and updates the identify concurrency for this bot.
+
+        :return: A tuple of (gateway url, recommended shard count).
+        """
+        data = await self.http.get_gateway_bot()
+        limit = data.get("session_start_limit", {})
+        self.max_concurrency = limit.get("max_concurrency", 1)
+        logger.info(
+            f"Gateway recommends {data['shards']} shards, "
+            f"with an identify concurrency of {self.max_concurrency}."
+        )
+
+        return data["url"], data["shards"]
+
+    def _fires_events(self, dispatch: str, event_name: str) -> bool:
+        """
+        :return: If an event parsed from a dispatch is fired under the dispatch's policy, and
+            something (a listener, or a hook registered for it) listens to it.
+        """
+        if self.dispatch_policies.get(dispatch) != DispatchPolicy.FULL:
+            return False
+
+        events = self.events.wanted_events
+        return events is None or event_name in events
+
+    def _set_boot_stage(self, shard_id: int, stage: ShardBootStage) -> None:
+        """
+        Updates the boot stage for a shard, logging the overall progress.
+        """
+        previous = self._boot_progress.get(shard_id)
+        self._boot_progress[shard_id] = stage
+        if stage == previous:
+            return
+
+        if stage == ShardBootStage.READY:
+            ready = sum(1 for x in self._boot_progress.values() if x == ShardBootStage.READY)
+            total = len(self._boot_progress)
+            logger.info(f"Shard {shard_id} is ready ({ready}/{total} shards ready).")
+        else:
+            logger.debug(f"Shard {shard_id} is now {stage.name.lower()}.")
+
     def guilds_for(self, shard_id: int) -> "Iterable[dt_guild.Guild]":
         """
         Gets the guilds for this shard.
@@ -371,10 +600,17 @@ class Client(object):
         try:
             return self.state._users[user_id]
         except KeyError:
-            u = self.state.make_user(await self.http.get_user(user_id))
-            # decache it if we need to
-            self.state._check_decache_user(u.id)
-            return u
+            pass
+
+        # lazily stored members only cache their user when they're first accessed
+        found = self.state.find_member_or_user(user_id)
+        if isinstance(found, dt_member.Member):
+            return found.user
+
+        u = self.state.make_user(await self.http.get_user(user_id))
+        # decache it if we need to
+        self.state._check_decache_user(u.id)
+        return u
 
     async def get_application(self, application_id: int) -> AppInfo:
         """
@@ -486,57 +722,197 @@ class Client(object):
             "shards_ready", gateway=self._gateways[ctx.shard_id], client=self
         )
 
+    async def handle_gateway_event(self, gw: GatewayHandler, event: tuple) -> None:
+        """
+        Handles a single event produced by a gateway, running it through the state and firing
+        the resulting events.
+
+        :param gw: The :class:`.GatewayHandler` the event came from.
+        :param event: The event tuple, as yielded by :meth:`.GatewayHandler.events`.
+        """
+        shard_id = gw.session.shard_id
+        name, *params = event
+        to_dispatch = [event]
+
+        if name == "websocket_opened":
+            self._set_boot_stage(shard_id, ShardBootStage.CONNECTING)
+
+        elif name == "gateway_hello":
+            self._set_boot_stage(shard_id, ShardBootStage.IDENTIFYING)
+
+        elif name == "websocket_closed":
+            code: int = params[0]
+            reason: str = params[1]
+
+            logger.info(f"Shard {shard_id} closed - {code}: {reason}")
+            if code == 4004:
+                raise InvalidTokenException(self._token)
+            elif code == 4011:
+                raise ReshardingNeeded
+            elif code in (4013, 4014):
+                raise InvalidIntentsException(code, gw.intents)
+            # usually the rest can be handled appropriately
+
+        elif name == "gateway_dispatch_received":
+            if params[0] in ("READY", "RESUMED"):
+                self._set_boot_stage(shard_id, ShardBootStage.READY)
+
+            policy = self.dispatch_policies.get(params[0])
+            evt_name = params[0].lower()
+            if policy != DispatchPolicy.IGNORE:
+                to_dispatch.append([evt_name + "_raw", *params[1:]])
+
+            handler = getattr(self.state, f"handle_{evt_name}", None)
+            if handler is not None and policy <= DispatchPolicy.CACHE_ONLY:
+                subevents = await coerce_agen(handler(*params[1:]))
+                if policy == DispatchPolicy.FULL:
+                    to_dispatch += subevents
+
+        for event in to_dispatch:
+            await self.events.fire_event(event[0], *event[1:], gateway=gw)
+
     async def run_shard(self, shard_id: int) -> None:
         """
         Runs a shard.
         """
+        recorder = None
+        if self.gateway_record_path is not None:
+            path = self.gateway_record_path.format(shard_id=shard_id)
+            recorder = GatewayRecorder(path, inflated=self.gateway_record_inflated)
+
         async with open_websocket(
-            self._token, url=self._gw_url, shard_id=shard_id, shard_count=self.shard_count
+            self._token,
+            url=self._gw_url,
+            shard_id=shard_id,
+            shard_count=self.shard_count,
+            transport=self.gateway_transport,
+            encoding=self.gateway_encoding,
+            identify_limiter=self.identify_limiter,
+            intents=self._identify_intents,
+            session_store=self.session_store,
+            recorder=recorder,
         ) as gw:
             # gw: GatewayHandler
             self._gateways[shard_id] = gw
-            from curious.core import _current_shard
-
             _current_shard.set(shard_id)
 
             async with finalise(gw.events()) as agen:
                 async for event in agen:
-                    name, *params = event
-                    to_dispatch = [event]
+                    await self.handle_gateway_event(gw, event)
+
+    async def replay_shard(
+        self, shard_id: int, path: str, *, realtime: bool = False
+    ) -> ReplayStats:
+        """
+        Replays a gateway log recorded for a shard through this client, without connecting to
+        Discord.
+
+        :param shard_id: The shard ID to replay as.
+        :param path: The path to the log.
+        :param realtime: If the original timing between records should be kept.
+        :return: The :class:`.ReplayStats` for the replay.
+        """
+        stats = ReplayStats()
+        async with open_replay(
+            self._token,
+            shard_id=shard_id,
+            shard_count=self.shard_count,
+            encoding=self.gateway_encoding,
+        ) as gw:
+            self._gateways[shard_id] = gw
+            _current_shard.set(shard_id)
+
+            agen = replay_events(gw, path, realtime=realtime, stats=stats)
+            async with finalise(agen) as agen:
+                async for event in agen:
+                    await self.handle_gateway_event(gw, event)
+
+        return stats
+
+    async def run_replay(
+        self, paths: Mapping[int, str], *, realtime: bool = False
+    ) -> Mapping[int, ReplayStats]:
+        """
+        Replays gateway logs for several shards at once, as if the bot was running.
 
-                    if name == "websocket_closed":
-                        code: int = params[0]
-                        reason: str = params[1]
+        .. code-block:: python3
 
-                        logger.info(f"Shard {shard_id} closed - {code}: {reason}")
-                        if code == 4004:
-                            raise InvalidTokenException(self._token)
-                        elif code == 4011:
-                            raise ReshardingNeeded
-                        # usually the rest can be handled appropriately
+            stats = await client.run_replay({0: "traffic-0.log", 1: "traffic-1.log"})
 
-                    elif name == "gateway_dispatch_received":
-                        evt_name = params[0].lower()
-                        to_dispatch.append([evt_name + "_raw", *params[1:]])
+        :param paths: A mapping of shard ID -> path to the log for that shard.
+        :param realtime: If the original timing between records should be kept.
+        :return: A mapping of shard ID -> :class:`.ReplayStats`.
+        """
+        _current_client.set(self)
+        self.shard_count = max(self.shard_count, max(paths) + 1)
+        for shard_id in paths:
+            self._ready_state[shard_id] = False
 
-                        handler = f"handle_{evt_name}"
-                        handler = getattr(self.state, handler)
-                        subevents = await coerce_agen(handler(*params[1:]))
-                        to_dispatch += subevents
+        results = {}
 
-                    for event in to_dispatch:
-                        await self.events.fire_event(event[0], *event[1:], gateway=gw)
+        async def _replay(shard_id: int, path: str):
+            results[shard_id] = await self.replay_shard(shard_id, path, realtime=realtime)
 
-    async def manage_all_shards(self, shard_count: int) -> None:
+        # put the task managers back afterwards, so they never point at the finished task group
+        previous = self.task_manager, self.events.task_manager
+        try:
+            async with anyio.create_task_group() as main_group:
+                self.task_manager = main_group
+                self.events.task_manager = main_group
+
+                for shard_id, path in paths.items():
+                    await main_group.spawn(_replay, shard_id, path)
+        finally:
+            self.task_manager, self.events.task_manager = previous
+
+        return results
+
+    async def manage_all_shards(self, shard_count: int, shard_ids: Iterable[int] = None) -> None:
         """
         Runs the bot's shards.
+
+        :param shard_count: The total number of shards the bot has.
+        :param shard_ids: The IDs of the shards to run in this process. Defaults to every shard.
         """
+        if shard_ids is None:
+            shard_ids = range(shard_count)
+
+        shard_ids = list(shard_ids)
+
         # update ready state
-        for shard_id in range(shard_count):
+        self._ready_state.clear()
+        self._boot_progress.clear()
+        for shard_id in shard_ids:
             self._ready_state[shard_id] = False
+            self._boot_progress[shard_id] = ShardBootStage.WAITING
+
+        # shards wait on their identify bucket, rather than a fixed delay between spawns
+        # in a cluster, the worker provides a limiter shared with every other process
+        if self.cluster is None:
+            self.identify_limiter = IdentifyLimiter(self.max_concurrency)
+
+        # the state uses this to skip caches for events that we'll never receive
+        intents = self._identify_intents = self.intents
+        if intents is None:
+            self.state.intents = GatewayIntent.all()
+            logger.info("Identifying without intents.")
+        else:
+            self.state.intents = intents
+            logger.info(f"Identifying with intents {intents!r}.")
+
+        if self._intents is None and intents is not None:
+            missing = self._wanted_intents() & GatewayIntent.privileged() & ~intents
+            if missing:
+                logger.warning(
+                    f"Some listeners need the privileged intents {missing!r}, which aren't "
+                    f"subscribed to. Pass them as privileged_intents to enable them."
+                )
 
         # boot up the gateway connections
-        logger.info(f"Loading {shard_count} gateway connections.")
+        logger.info(
+            f"Loading {len(shard_ids)} of {shard_count} gateway connections "
+            f"in {min(self.max_concurrency, shard_count)} identify bucket(s)."
+        )
         async with anyio.create_task_group() as main_group:
             # tg: anyio.TaskGroup
 
@@ -550,44 +926,66 @@ class Client(object):
             ctx = EventContext(shard_id=None, event_name="starting")
             await self.events.fire_event("starting", ctx=ctx)
 
-            for shard in range(0, shard_count):
+            for shard in shard_ids:
                 await main_group.spawn(self.run_shard, shard)
 
-                if shard_count >= 2:
-                    logger.info(f"Sleeping 5 seconds before connecting to shard {shard}")
-                    await anyio.sleep(5)
-
     async def run_bot_in_sharded_mode(
-        self, shard_count: int, *, allow_resharding: bool = True
+        self, shard_count: int, *, allow_resharding: bool = True, shard_ids: Iterable[int] = None
     ) -> None:
         """
         Starts the bot. This is an internal method - you want :meth:`.Client.run_async`.
 
         :param shard_count: The number of shards to boot.
         :param allow_resharding: If the bot can automatically be resharded.
+        :param shard_ids: The IDs of the shards to run in this process. Defaults to every shard.
         """
-        from curious.core import _current_client
-
         _current_client.set(self)
 
-        try:
-            self.application_info = AppInfo(**(await self.http.get_app_info(None)))
-        except Unauthorized:
-            raise InvalidTokenException(self._token) from None
-
-        while True:
+        if self.application_info is None:
             try:
-                await self.manage_all_shards(shard_count)
-            except ReshardingNeeded:
-                if allow_resharding:
-                    shard_count = await self.get_gateway_url(get_shard_count=True)
-                    self.shard_count = shard_count
-                    continue
+                self.application_info = AppInfo(**(await self.http.get_app_info(None)))
+            except Unauthorized:
+                raise InvalidTokenException(self._token) from None
 
-                raise
+        if self.session_store is not None:
+            await self._restore_snapshot()
+
+        try:
+            while True:
+                try:
+                    await self.manage_all_shards(shard_count, shard_ids)
+                except ReshardingNeeded:
+                    if allow_resharding:
+                        self._gw_url, shard_count = await self._update_gateway_info()
+                        self.shard_count = shard_count
+                        shard_ids = None
+                        continue
+
+                    raise
+        finally:
+            if self.session_store is not None:
+                logger.info("Saving state snapshot.")
+                self.session_store.save_snapshot(self.state.snapshot())
+
+    async def _restore_snapshot(self) -> None:
+        """
+        Restores the state snapshot from the session store, if there is one.
+        """
+        snapshot = self.session_store.load_snapshot()
+        if snapshot is not None and await self.state.restore(snapshot):
+            return
+
+        # stored sessions are useless without the cache they were made against
+        logger.info("No usable state snapshot, shards will identify.")
+        self.session_store.clear()
 
     async def run_async(
-        self, *, shard_count: int = 1, autoshard: bool = True, allow_resharding: bool = True
+        self,
+        *,
+        shard_count: int = 1,
+        autoshard: bool = True,
+        allow_resharding: bool = True,
+        gateway_url: str = None,
     ) -> None:
         """
         Runs the client asynchronously.
@@ -596,11 +994,26 @@ class Client(object):
         :param autoshard: If the bot should be autosharded.
         :param allow_resharding: If the bot is allowed to recalculate it's shard count in the \
             event of a 4011 error.
-        """
-        if autoshard:
-            url, shard_count = await self.get_gateway_url(get_shard_count=True)
+        :param gateway_url: The gateway URL to connect to. If this is provided, the gateway isn't
+            looked up over HTTP and autosharding is disabled. This is mostly useful for connecting
+            to a :class:`~curious.ext.fake_gateway.FakeGateway`.
+        """
+        if gateway_url is not None:
+            url = gateway_url
+            autoshard = allow_resharding = False
+        elif autoshard:
+            url, shard_count = await self._update_gateway_info()
+        elif shard_count > 1:
+            # the identify concurrency only matters with more than one shard, and is only exposed
+            # by /gateway/bot
+            try:
+                url, _ = await self._update_gateway_info()
+            except HTTPException:
+                logger.warning("Couldn't get the identify concurrency, assuming 1.", exc_info=True)
+                self.max_concurrency = 1
+                url = await self.get_gateway_url(get_shard_count=False)
         else:
-            url, shard_count = await self.get_gateway_url(get_shard_count=False), shard_count
+            url = await self.get_gateway_url(get_shard_count=False)
 
         self._gw_url = url
         self.shard_count = shard_count
@@ -0,0 +1,735 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Multi-process clustering, which splits a bot's shards across several worker processes.
+
+Each worker process creates its own :class:`.Client` by calling a factory, and runs a contiguous
+range of shards. The parent process supervises the workers, coordinates IDENTIFYs between them,
+collects statistics and restarts workers that crash.
+
+.. code-block:: python3
+
+    def make_client() -> Client:
+        client = Client(TOKEN)
+        client.events.add_event(...)
+        return client
+
+    if __name__ == "__main__":
+        Cluster(TOKEN, make_client, workers=4).run()
+
+The factory is called in the worker process, so it must be importable from there (i.e. defined at
+the top level of a module). Each worker has its own state; objects are never shared between
+processes.
+
+.. currentmodule:: curious.core.cluster
+"""
+import collections
+import enum
+import functools
+import hmac
+import logging
+import multiprocessing
+import os
+import secrets
+import struct
+import sys
+import time
+import uuid
+from dataclasses import asdict, dataclass, field
+from typing import Callable, Dict, List, Mapping, Optional, Sequence
+
+import anyio
+from anyio.exceptions import ClosedResourceError, IncompleteRead
+
+from curious.core.client import (
+    Client,
+    InvalidIntentsException,
+    InvalidTokenException,
+    ReshardingNeeded,
+    ShardBootStage,
+)
+from curious.core.codec import get_json_codec
+from curious.core.httpclient import HTTPClient
+from curious.core.ratelimit import IdentifyLimiter
+from curious.util import Promise
+
+logger = logging.getLogger("curious.cluster")
+
+# length of the JSON body that follows
+_frame_header = struct.Struct(">I")
+
+
+class WorkerExitCode(enum.IntEnum):
+    """
+    Represents the exit code of a worker process.
+    """
+
+    #: The worker's client returned normally.
+    OK = 0
+
+    #: The worker crashed with an unhandled exception.
+    CRASHED = 1
+
+    #: Discord rejected a shard because the bot needs more shards.
+    RESHARD = 3
+
+    #: The bot's token is invalid.
+    INVALID_TOKEN = 4
+
+    #: Discord rejected the intents as invalid (close code 4013).
+    INVALID_INTENTS = 5
+
+    #: Discord rejected the intents as they include a privileged intent that isn't enabled
+    #: (close code 4014).
+    DISALLOWED_INTENTS = 6
+
+
+async def _send_message(sock, data: dict) -> None:
+    body = get_json_codec().dumps(data).encode("utf-8")
+    await sock.send_all(_frame_header.pack(len(body)) + body)
+
+
+async def _receive_message(sock) -> dict:
+    (length,) = _frame_header.unpack(await sock.receive_exactly(_frame_header.size))
+    return get_json_codec().loads(await sock.receive_exactly(length))
+
+
+def shard_ranges(shard_count: int, workers: int) -> List[List[int]]:
+    """
+    Splits shards into contiguous ranges, one per worker.
+
+    :param shard_count: The total number of shards.
+    :param workers: The number of workers.
+    :return: A list of shard ID lists. Workers never get an empty range, so this may be shorter
+        than ``workers``.
+    """
+    workers = max(min(workers, shard_count), 1)
+    per_worker, extra = divmod(shard_count, workers)
+
+    ranges = []
+    start = 0
+    for worker_id in range(workers):
+        end = start + per_worker + (1 if worker_id < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+
+    return ranges
+
+
+@dataclass
+class WorkerStats:
+    """
+    Represents the statistics reported by a single worker process.
+    """
+
+    #: The ID of the worker.
+    worker_id: int
+
+    #: The shard IDs this worker runs.
+    shard_ids: List[int] = field(default_factory=list)
+
+    #: The process ID of the worker, if it is running.
+    pid: Optional[int] = None
+
+    #: The number of times this worker has been restarted.
+    restarts: int = 0
+
+    #: The number of guilds this worker can see.
+    guilds: int = 0
+
+    #: A mapping of dispatch name -> the number of times it was handled by this worker.
+    events_handled: Dict[str, int] = field(default_factory=dict)
+
+    #: A mapping of shard ID -> heartbeat latency, in seconds.
+    latencies: Dict[int, float] = field(default_factory=dict)
+
+    #: A mapping of shard ID -> :class:`.ShardBootStage`.
+    boot_progress: Dict[int, int] = field(default_factory=dict)
+
+    #: The UNIX timestamp of the last report from this worker.
+    updated_at: float = 0
+
+    def to_dict(self) -> dict:
+        """
+        :return: This :class:`.WorkerStats` as a dict that can be sent over IPC.
+        """
+        data = asdict(self)
+        # JSON only allows string keys
+        data["latencies"] = {str(k): v for (k, v) in self.latencies.items()}
+        data["boot_progress"] = {str(k): int(v) for (k, v) in self.boot_progress.items()}
+        return data
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "WorkerStats":
+        """
+        Creates a :class:`.WorkerStats` from a dict received over IPC.
+        """
+        stats = cls(**data)
+        stats.latencies = {int(k): v for (k, v) in stats.latencies.items()}
+        stats.boot_progress = {int(k): v for (k, v) in stats.boot_progress.items()}
+        return stats
+
+
+@dataclass
+class ClusterStats:
+    """
+    Represents the statistics for an entire cluster.
+    """
+
+    #: A mapping of worker ID -> :class:`.WorkerStats`.
+    workers: Dict[int, WorkerStats] = field(default_factory=dict)
+
+    @property
+    def guild_count(self) -> int:
+        """
+        :return: The number of guilds across every worker.
+        """
+        return sum(worker.guilds for worker in self.workers.values())
+
+    @property
+    def events_handled(self) -> collections.Counter:
+        """
+        :return: A :class:`collections.Counter` of the dispatches handled across every worker.
+        """
+        c = collections.Counter()
+        for worker in self.workers.values():
+            c.update(worker.events_handled)
+
+        return c
+
+    @property
+    def latencies(self) -> Mapping[int, float]:
+        """
+        :return: A mapping of shard ID -> heartbeat latency, for every shard in the cluster.
+        """
+        latencies = {}
+        for worker in self.workers.values():
+            latencies.update(worker.latencies)
+
+        return latencies
+
+    @property
+    def boot_progress(self) -> Mapping[int, ShardBootStage]:
+        """
+        :return: A mapping of shard ID -> :class:`.ShardBootStage`, for every shard in the cluster.
+        """
+        progress = {}
+        for worker in self.workers.values():
+            for shard_id, stage in worker.boot_progress.items():
+                progress[shard_id] = ShardBootStage(stage)
+
+        return progress
+
+    def to_dict(self) -> dict:
+        return {str(id): worker.to_dict() for (id, worker) in self.workers.items()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ClusterStats":
+        return cls({int(k): WorkerStats.from_dict(v) for (k, v) in data.items()})
+
+
+class ClusterIdentifyLimiter(IdentifyLimiter):
+    """
+    An :class:`.IdentifyLimiter` that asks the cluster's parent process for permission to identify,
+    so that identify buckets are shared between every worker process.
+    """
+
+    def __init__(self, worker: "ClusterWorker", max_concurrency: int = 1):
+        super().__init__(max_concurrency)
+
+        #: The :class:`.ClusterWorker` used to talk to the parent process.
+        self.worker = worker
+
+    async def acquire(self, shard_id: int) -> None:
+        await self.worker.request("identify", shard_id=shard_id)
+
+    async def identified(self, shard_id: int) -> None:
+        # the parent owns the bucket windows, so it needs to know when the IDENTIFY really went out
+        await self.worker.send("identified", shard_id=shard_id)
+
+
+class ClusterWorker(object):
+    """
+    The worker side of a cluster. This is available as :attr:`.Client.cluster` inside a worker
+    process.
+    """
+
+    #: The number of seconds between statistics reports to the parent process.
+    STATS_INTERVAL = 5.0
+
+    def __init__(
+        self, client: Client, worker_id: int, shard_ids: Sequence[int], sock, *, max_concurrency=1
+    ):
+        """
+        :param client: The :class:`.Client` running in this worker.
+        :param worker_id: The ID of this worker.
+        :param shard_ids: The shard IDs this worker runs.
+        :param sock: The IPC socket connected to the parent process.
+        :param max_concurrency: The number of identify buckets the bot has.
+        """
+        #: The :class:`.Client` running in this worker.
+        self.client = client
+
+        #: The ID of this worker.
+        self.worker_id = worker_id
+
+        #: The shard IDs this worker runs.
+        self.shard_ids = list(shard_ids)
+
+        #: The :class:`.ClusterIdentifyLimiter` used by this worker's shards.
+        self.identify_limiter = ClusterIdentifyLimiter(self, max_concurrency)
+
+        self._sock = sock
+        self._send_lock = anyio.create_lock()
+        self._pending: Dict[str, Promise] = {}
+
+    def collect_stats(self) -> WorkerStats:
+        """
+        :return: The :class:`.WorkerStats` for this worker.
+        """
+        return WorkerStats(
+            worker_id=self.worker_id,
+            shard_ids=self.shard_ids,
+            pid=os.getpid(),
+            guilds=len(self.client.guilds),
+            events_handled=dict(self.client.events_handled),
+            latencies={
+                shard_id: gw.heartbeat_stats.gw_time
+                for (shard_id, gw) in self.client.gateways.items()
+                # a heartbeat that hasn't been acked yet has no latency
+                if gw.heartbeat_stats.gw_time >= 0
+            },
+            boot_progress=dict(self.client.boot_progress),
+            updated_at=time.time(),
+        )
+
+    async def send(self, op: str, **data) -> None:
+        """
+        Sends a message to the parent process.
+        """
+        async with self._send_lock:
+            await _send_message(self._sock, {"op": op, **data})
+
+    async def request(self, op: str, **data) -> dict:
+        """
+        Sends a request to the parent process, and waits for the reply.
+        """
+        nonce = uuid.uuid4().hex
+        promise = self._pending[nonce] = Promise()
+        try:
+            await self.send(op, nonce=nonce, **data)
+            return await promise.wait()
+        finally:
+            self._pending.pop(nonce, None)
+
+    async def fetch_stats(self) -> ClusterStats:
+        """
+        Fetches the statistics for the entire cluster from the parent process.
+
+        :return: The :class:`.ClusterStats` for the cluster.
+        """
+        reply = await self.request("query_stats")
+        return ClusterStats.from_dict(reply["stats"])
+
+    async def _read_messages(self) -> None:
+        while True:
+            try:
+                message = await _receive_message(self._sock)
+            except (IncompleteRead, ClosedResourceError, OSError):
+                return
+
+            promise = self._pending.get(message.get("nonce"))
+            if promise is not None:
+                await promise.set(message)
+
+    async def _report_stats(self) -> None:
+        while True:
+            await self.send("stats", stats=self.collect_stats().to_dict())
+            await anyio.sleep(self.STATS_INTERVAL)
+
+    async def run(self, gateway_url: str, shard_count: int) -> None:
+        """
+        Runs the client's shards until they exit, or the parent process goes away.
+        """
+        client = self.client
+        client.cluster = self
+        client.identify_limiter = self.identify_limiter
+        client.max_concurrency = self.identify_limiter.max_concurrency
+        client._gw_url = gateway_url
+        client.shard_count = shard_count
+
+        async def _run_client():
+            await client.run_bot_in_sharded_mode(
+                shard_count, allow_resharding=False, shard_ids=self.shard_ids
+            )
+            await tg.cancel_scope.cancel()
+
+        async with anyio.create_task_group() as tg:
+            await tg.spawn(self._report_stats)
+            await tg.spawn(_run_client)
+
+            # if the parent dies, there's nobody left to coordinate with, so exit too
+            await self._read_messages()
+            logger.warning("Lost the connection to the cluster parent, exiting.")
+            await tg.cancel_scope.cancel()
+
+
+def _exit_code_for(exc: BaseException) -> WorkerExitCode:
+    # exceptions from several shards at once are wrapped up in a group
+    for inner in getattr(exc, "exceptions", ()):
+        code = _exit_code_for(inner)
+        if code != WorkerExitCode.CRASHED:
+            return code
+
+    if isinstance(exc, ReshardingNeeded):
+        return WorkerExitCode.RESHARD
+    elif isinstance(exc, InvalidTokenException):
+        return WorkerExitCode.INVALID_TOKEN
+    elif isinstance(exc, InvalidIntentsException):
+        if exc.code == 4014:
+            return WorkerExitCode.DISALLOWED_INTENTS
+
+        return WorkerExitCode.INVALID_INTENTS
+
+    return WorkerExitCode.CRASHED
+
+
+async def _run_worker(
+    factory: Callable[[], Client],
+    worker_id: int,
+    shard_ids: List[int],
+    shard_count: int,
+    gateway_url: str,
+    max_concurrency: int,
+    port: int,
+    secret: str,
+) -> None:
+    client = factory()
+    sock = await anyio.connect_tcp("127.0.0.1", port)
+    async with sock:
+        worker = ClusterWorker(client, worker_id, shard_ids, sock, max_concurrency=max_concurrency)
+        await worker.send("hello", worker_id=worker_id, secret=secret)
+        await worker.run(gateway_url, shard_count)
+
+
+def _worker_main(factory: Callable[[], Client], backend: str, *args) -> None:
+    """
+    The entry point of a worker process.
+    """
+    try:
+        anyio.run(functools.partial(_run_worker, factory, *args), backend=backend)
+    except KeyboardInterrupt:
+        pass
+    except BaseException as e:
+        code = _exit_code_for(e)
+        if code == WorkerExitCode.CRASHED:
+            logger.exception("Worker crashed!")
+
+        sys.exit(code)
+
+
+class _WorkerHandle(object):
+    """
+    The parent's handle to a single worker process.
+    """
+
+    def __init__(self, worker_id: int, shard_ids: List[int]):
+        self.worker_id = worker_id
+        self.shard_ids = shard_ids
+        self.process: multiprocessing.Process = None
+        self.started_at = 0.0
+        self.stats = WorkerStats(worker_id=worker_id, shard_ids=shard_ids)
+
+    #: The number of seconds a worker is given to exit after being terminated, before it's killed.
+    TERMINATE_TIMEOUT = 5.0
+
+    #: The number of seconds between checks on a terminating worker.
+    TERMINATE_POLL_INTERVAL = 0.1
+
+    async def _wait_for_exit(self) -> None:
+        while self.process.is_alive():
+            await anyio.sleep(self.TERMINATE_POLL_INTERVAL)
+
+    async def terminate(self) -> None:
+        """
+        Terminates the worker process, killing it if it doesn't exit in time.
+
+        This polls the process rather than joining it, so that it doesn't block the event loop
+        while the other workers are running.
+        """
+        if self.process is None or not self.process.is_alive():
+            return
+
+        self.process.terminate()
+        async with anyio.move_on_after(self.TERMINATE_TIMEOUT):
+            await self._wait_for_exit()
+
+        if self.process.is_alive():
+            self.process.kill()
+            await self._wait_for_exit()
+
+        # the process has exited, so this only reaps it
+        self.process.join()
+
+
+class Cluster(object):
+    """
+    Runs a bot's shards across several worker processes.
+    """
+
+    #: The number of seconds between checks on worker processes.
+    POLL_INTERVAL = 1.0
+
+    #: The maximum number of seconds to wait before restarting a crashed worker.
+    MAX_RESTART_DELAY = 60.0
+
+    #: The number of seconds a worker must run for before its restart delay is reset.
+    HEALTHY_UPTIME = 60.0
+
+    def __init__(
+        self,
+        token: str,
+        factory: Callable[[], Client],
+        *,
+        workers: int = None,
+        shard_count: int = None,
+        gateway_url: str = None,
+        backend: str = "trio",
+    ):
+        """
+        :param token: The bot's token, used to fetch the gateway information.
+        :param factory: A callable that creates the :class:`.Client` for a worker. This is called
+            once in every worker process, and must be picklable.
+        :param workers: The number of worker processes. Defaults to the number of CPUs.
+        :param shard_count: The number of shards to run. Defaults to Discord's recommendation.
+        :param gateway_url: The gateway URL to connect to. If this is provided, the gateway isn't
+            looked up over HTTP, and ``shard_count`` defaults to 1.
+        :param backend: The anyio backend used in every process.
+        """
+        self._token = token
+
+        #: The factory used to create the client in each worker.
+        self.factory = factory
+
+        #: The number of worker processes.
+        self.worker_count = workers or os.cpu_count() or 1
+
+        #: The number of shards the cluster runs.
+        self.shard_count = shard_count
+
+        #: The gateway URL the cluster's shards connect to.
+        self.gateway_url = gateway_url
+
+        #: The anyio backend used in every process.
+        self.backend = backend
+
+        #: The :class:`.IdentifyLimiter` shared between every worker.
+        self.identify_limiter = IdentifyLimiter()
+
+        self._workers: Dict[int, _WorkerHandle] = {}
+        self._secret = secrets.token_hex(16)
+        self._task_group: anyio.TaskGroup = None
+        self._reshard = False
+
+    @property
+    def stats(self) -> ClusterStats:
+        """
+        :return: The latest :class:`.ClusterStats` reported by the workers.
+        """
+        return ClusterStats({id: worker.stats for (id, worker) in self._workers.items()})
+
+    async def _update_gateway_info(self, reshard: bool = False) -> None:
+        """
+        Fetches ``/gateway/bot``, and updates the shard count and identify concurrency.
+        """
+        if self.gateway_url is not None and not reshard:
+            self.shard_count = self.shard_count or 1
+            return
+
+        http = HTTPClient(self._token)
+        data = await http.get_gateway_bot()
+        limit = data.get("session_start_limit", {})
+        self.identify_limiter = IdentifyLimiter(limit.get("max_concurrency", 1))
+        self.gateway_url = data["url"]
+        if self.shard_count is None or reshard:
+            self.shard_count = data["shards"]
+
+    async def _reply(self, sock, lock, data: dict) -> None:
+        try:
+            async with lock:
+                await _send_message(sock, data)
+        except (ClosedResourceError, OSError):
+            # the worker died while we were waiting, it'll ask again once it's restarted
+            pass
+
+    async def _handle_identify(self, worker: _WorkerHandle, sock, lock, message: dict) -> None:
+        shard_id = message["shard_id"]
+        await self.identify_limiter.acquire(shard_id)
+        logger.debug(f"Allowing shard {shard_id} on worker {worker.worker_id} to identify.")
+        await self._reply(sock, lock, {"nonce": message["nonce"]})
+
+    async def _handle_connection(self, sock) -> None:
+        """
+        Handles an IPC connection from a worker.
+        """
+        async with sock:
+            try:
+                hello = await _receive_message(sock)
+            except (IncompleteRead, ClosedResourceError, OSError, ValueError):
+                return
+
+            worker = self._workers.get(hello.get("worker_id"))
+            if worker is None or not hmac.compare_digest(hello.get("secret", ""), self._secret):
+                logger.warning("Rejecting an IPC connection with a bad handshake.")
+                return
+
+            lock = anyio.create_lock()
+            while True:
+                try:
+                    message = await _receive_message(sock)
+                except (IncompleteRead, ClosedResourceError, OSError):
+                    return
+
+                op = message.get("op")
+                if op == "identify":
+                    await self._task_group.spawn(self._handle_identify, worker, sock, lock, message)
+                elif op == "identified":
+                    await self.identify_limiter.identified(message["shard_id"])
+                elif op == "stats":
+                    stats = WorkerStats.from_dict(message["stats"])
+                    stats.restarts = worker.stats.restarts
+                    worker.stats = stats
+                elif op == "query_stats":
+                    data = {"nonce": message["nonce"], "stats": self.stats.to_dict()}
+                    await self._reply(sock, lock, data)
+                else:
+                    logger.warning(f"Unknown IPC op {op!r} from worker {worker.worker_id}")
+
+    async def _serve(self, server) -> None:
+        async for sock in server.accept_connections():
+            await self._task_group.spawn(self._handle_connection, sock)
+
+    def _start_worker(self, worker: _WorkerHandle, port: int) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        args = (
+            worker.worker_id,
+            worker.shard_ids,
+            self.shard_count,
+            self.gateway_url,
+            self.identify_limiter.max_concurrency,
+            port,
+            self._secret,
+        )
+        worker.process = ctx.Process(
+            target=_worker_main,
+            args=(self.factory, self.backend, *args),
+            name=f"curious-worker-{worker.worker_id}",
+        )
+        worker.process.start()
+        worker.started_at = time.monotonic()
+        worker.stats.pid = worker.process.pid
+        logger.info(
+            f"Started worker {worker.worker_id} (pid {worker.process.pid}) "
+            f"with shards {worker.shard_ids[0]}-{worker.shard_ids[-1]}."
+        )
+
+    async def _supervise(self, worker: _WorkerHandle, port: int) -> None:
+        """
+        Runs a worker process, restarting it if it crashes.
+        """
+        delay = 1.0
+        try:
+            while True:
+                self._start_worker(worker, port)
+                while worker.process.is_alive():
+                    await anyio.sleep(self.POLL_INTERVAL)
+
+                code = worker.process.exitcode
+                worker.stats.pid = None
+                if code == WorkerExitCode.OK:
+                    logger.info(f"Worker {worker.worker_id} exited.")
+                    return
+                elif code == WorkerExitCode.INVALID_TOKEN:
+                    raise InvalidTokenException(self._token)
+                elif code == WorkerExitCode.INVALID_INTENTS:
+                    raise InvalidIntentsException(4013)
+                elif code == WorkerExitCode.DISALLOWED_INTENTS:
+                    raise InvalidIntentsException(4014)
+                elif code == WorkerExitCode.RESHARD:
+                    logger.warning(f"Worker {worker.worker_id} needs resharding.")
+                    self._reshard = True
+                    await self._task_group.cancel_scope.cancel()
+                    return
+
+                # the other workers keep running while this one is restarted
+                if time.monotonic() - worker.started_at >= self.HEALTHY_UPTIME:
+                    delay = 1.0
+
+                worker.stats.restarts += 1
+                logger.error(
+                    f"Worker {worker.worker_id} died with exit code {code}, "
+                    f"restarting in {delay:.0f} seconds."
+                )
+                await anyio.sleep(delay)
+                delay = min(delay * 2, self.MAX_RESTART_DELAY)
+        finally:
+            # this runs when the cluster is cancelled, so shield it to make sure the worker exits
+            async with anyio.open_cancel_scope(shield=True):
+                await worker.terminate()
+
+    async def _run_workers(self) -> None:
+        ranges = shard_ranges(self.shard_count, self.worker_count)
+        self._workers = {
+            worker_id: _WorkerHandle(worker_id, shard_ids)
+            for (worker_id, shard_ids) in enumerate(ranges)
+        }
+        logger.info(
+            f"Running {self.shard_count} shards across {len(ranges)} workers, "
+            f"in {self.identify_limiter.max_concurrency} identify bucket(s)."
+        )
+
+        async with await anyio.create_tcp_server(interface="127.0.0.1") as server:
+            async with anyio.create_task_group() as tg:
+                self._task_group = tg
+                await tg.spawn(self._serve, server)
+
+                async with anyio.create_task_group() as workers:
+                    for worker in self._workers.values():
+                        await workers.spawn(self._supervise, worker, server.port)
+
+                # every worker exited cleanly
+                await tg.cancel_scope.cancel()
+
+    async def run_async(self) -> None:
+        """
+        Runs the cluster asynchronously.
+        """
+        await self._update_gateway_info()
+
+        while True:
+            self._reshard = False
+            await self._run_workers()
+            if not self._reshard:
+                return
+
+            await self._update_gateway_info(reshard=True)
+            logger.info(f"Resharding the cluster to {self.shard_count} shards.")
+
+    def run(self) -> None:
+        """
+        Runs the cluster, blocking until it exits.
+        """
+        anyio.run(self.run_async, backend=self.backend)
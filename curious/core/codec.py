@@ -0,0 +1,253 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Pluggable codecs used for gateway, HTTP and IPC payloads.
+
+By default, the fastest installed JSON library is used (``orjson``, then ``ujson``), falling back
+to the standard library :mod:`json` module.
+
+The gateway can also use the Erlang External Term Format (ETF), which uses ``erlpack`` if it is
+installed and a pure-Python implementation otherwise.
+
+.. currentmodule:: curious.core.codec
+"""
+import json
+from typing import Any, Callable, Union
+
+
+class JSONCodec(object):
+    """
+    Represents a JSON backend.
+    """
+
+    #: If this codec produces binary (``bytes``) payloads rather than text.
+    binary = False
+
+    def __init__(
+        self,
+        name: str,
+        loads: Callable[[Union[str, bytes]], Any],
+        dumps: Callable[[Any], str],
+    ):
+        """
+        :param name: The name of this backend.
+        :param loads: A callable that decodes ``str`` or ``bytes`` into Python objects.
+        :param dumps: A callable that encodes Python objects into a compact ``str``.
+        """
+        #: The name of this backend.
+        self.name = name
+
+        self._loads = loads
+        self._dumps = dumps
+
+    def __repr__(self) -> str:
+        return f"<JSONCodec name={self.name!r}>"
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        """
+        Decodes some JSON.
+
+        :param data: The ``str`` or UTF-8 encoded ``bytes`` to decode.
+        """
+        return self._loads(data)
+
+    def dumps(self, obb: Any) -> str:
+        """
+        Encodes an object into compact JSON.
+
+        :param obb: The object to encode.
+        """
+        return self._dumps(obb)
+
+
+def _make_stdlib_codec() -> JSONCodec:
+    def dumps(obb: Any) -> str:
+        return json.dumps(obb, separators=(",", ":"))
+
+    return JSONCodec("json", json.loads, dumps)
+
+
+def _make_orjson_codec() -> JSONCodec:
+    import orjson
+
+    def dumps(obb: Any) -> str:
+        return orjson.dumps(obb).decode("utf-8")
+
+    return JSONCodec("orjson", orjson.loads, dumps)
+
+
+def _make_ujson_codec() -> JSONCodec:
+    import ujson
+
+    return JSONCodec("ujson", ujson.loads, ujson.dumps)
+
+
+_json_backends = {
+    "orjson": _make_orjson_codec,
+    "ujson": _make_ujson_codec,
+    "json": _make_stdlib_codec,
+}
+
+
+def _find_default_codec() -> JSONCodec:
+    for factory in _json_backends.values():
+        try:
+            return factory()
+        except ImportError:
+            continue
+
+
+_current_json_codec = _find_default_codec()
+
+
+def get_json_codec() -> JSONCodec:
+    """
+    :return: The :class:`.JSONCodec` currently in use.
+    """
+    return _current_json_codec
+
+
+def set_json_codec(codec: Union[str, JSONCodec]) -> JSONCodec:
+    """
+    Changes the JSON codec used by the library.
+
+    This should be called before the client is started, as gateways bind their codec on creation.
+
+    :param codec: Either the name of a built-in backend (``orjson``, ``ujson`` or ``json``), or a
+        custom :class:`.JSONCodec`.
+    :return: The :class:`.JSONCodec` now in use.
+    """
+    global _current_json_codec
+
+    if isinstance(codec, str):
+        try:
+            factory = _json_backends[codec]
+        except KeyError:
+            raise ValueError(f"Unknown JSON backend {codec!r}") from None
+
+        codec = factory()
+
+    _current_json_codec = codec
+    return codec
+
+
+class ETFCodec(object):
+    """
+    Represents an External Term Format backend, used for ``encoding=etf`` gateway connections.
+    """
+
+    #: If this codec produces binary (``bytes``) payloads rather than text.
+    binary = True
+
+    def __init__(self, name: str, loads: Callable[[bytes], Any], dumps: Callable[[Any], bytes]):
+        """
+        :param name: The name of this backend.
+        :param loads: A callable that decodes ETF ``bytes`` into Python objects.
+        :param dumps: A callable that encodes Python objects into ETF ``bytes``.
+        """
+        #: The name of this backend.
+        self.name = name
+
+        self._loads = loads
+        self._dumps = dumps
+
+    def __repr__(self) -> str:
+        return f"<ETFCodec name={self.name!r}>"
+
+    def loads(self, data: bytes) -> Any:
+        """
+        Decodes an ETF payload.
+
+        :param data: The ``bytes`` to decode.
+        """
+        return self._loads(data)
+
+    def dumps(self, obb: Any) -> bytes:
+        """
+        Encodes an object into an ETF payload.
+
+        :param obb: The object to encode.
+        """
+        return self._dumps(obb)
+
+
+def _make_etf_codec() -> ETFCodec:
+    try:
+        # try and load the C impl first
+        import erlpack
+    except ImportError:
+        from curious.core import _etf
+
+        return ETFCodec("etf", _etf.decode, _etf.encode)
+
+    try:
+        # erlpack turns the nil, true and false atoms into None, True and False itself, which are
+        # the only atoms Discord sends
+        decoder = erlpack.ErlangTermDecoder(encoding="utf-8", encode_binary_ext=True)
+        return ETFCodec("erlpack", decoder.loads, erlpack.pack)
+    except TypeError:
+        # older releases don't take encode_binary_ext
+        decoder = erlpack.ErlangTermDecoder(encoding="utf-8")
+
+    # most of these still decode binaries to str once given an encoding, so check once rather
+    # than walking every payload in Python, which would cancel out most of the C decoder's speedup
+    expected = {"s": "s", "t": True, "n": None}
+    probe = decoder.loads(erlpack.pack(expected))
+    if probe == expected and all(type(i) is str for i in (*probe, probe["s"])):
+        return ETFCodec("erlpack", decoder.loads, erlpack.pack)
+
+    from curious.core._etf import _ATOMS
+
+    atom_type = erlpack.Atom
+
+    def normalise(obb: Any) -> Any:
+        # turn binaries and atoms into plain values, so the result matches the pure-Python decoder
+        # (and the JSON codec)
+        if isinstance(obb, dict):
+            return {normalise(k): normalise(v) for k, v in obb.items()}
+
+        if isinstance(obb, list):
+            return [normalise(i) for i in obb]
+
+        if isinstance(obb, atom_type):
+            name = str(obb)
+            return _ATOMS.get(name, name)
+
+        if isinstance(obb, bytes):
+            return obb.decode("utf-8")
+
+        return obb
+
+    def loads(data: bytes) -> Any:
+        return normalise(decoder.loads(data))
+
+    return ETFCodec("erlpack", loads, erlpack.pack)
+
+
+def get_gateway_codec(encoding: str) -> Union[JSONCodec, ETFCodec]:
+    """
+    Gets the codec to use for a gateway encoding.
+
+    :param encoding: The gateway encoding, either ``json`` or ``etf``.
+    :return: The codec for the specified encoding.
+    """
+    if encoding == "json":
+        return get_json_codec()
+
+    if encoding == "etf":
+        return _make_etf_codec()
+
+    raise ValueError(f"Unknown gateway encoding {encoding!r}")
@@ -15,7 +15,7 @@
 import functools
 import inspect
 import logging
-from typing import Any, AsyncContextManager
+from typing import Any, AsyncContextManager, Dict, FrozenSet, Iterable, Optional, Set
 
 import anyio
 import outcome
@@ -72,12 +72,23 @@ class EventManager(object):
         #: A list of event hooks.
         self.event_hooks = set()
 
+        #: A mapping of event hook -> the names of the events it is called with. Hooks that aren't
+        #: in here are called with every event.
+        self.hook_events: Dict[Any, FrozenSet[str]] = {}
+
         #: A MultiDict of event listeners.
         self.event_listeners = MultiDict()
 
         #: A MultiDict of temporary listeners.
         self.temporary_listeners = MultiDict()
 
+        #: A counter that is incremented every time a listener or hook is added or removed.
+        #: This is used to invalidate anything computed from the registry.
+        self.version = 0
+
+        self._wanted_events: Optional[FrozenSet[str]] = None
+        self._wanted_version = None
+
     # add or removal functions
     # Events
     def add_event(self, func, name: str = None):
@@ -99,6 +110,8 @@ class EventManager(object):
             logger.debug("Registered event `{}` handling `{}`".format(func, ev_name))
             self.event_listeners.add(ev_name, func)
 
+        self.version += 1
+
     def remove_event(self, name: str, func):
         """
         Removes a function event.
@@ -107,6 +120,47 @@ class EventManager(object):
         :param func: The function to remove.
         """
         self.event_listeners = remove_from_multidict(self.event_listeners, key=name, item=func)
+        self.version += 1
+
+    @property
+    def registered_events(self) -> Set[str]:
+        """
+        :return: The set of event names that have a listener or temporary listener registered.
+        """
+        return set(self.event_listeners.keys()) | set(self.temporary_listeners.keys())
+
+    @property
+    def hooked_events(self) -> Optional[Set[str]]:
+        """
+        :return: The set of event names that event hooks are called with, or None if any hook is
+            called with every event.
+        """
+        events = set()
+        for hook in self.event_hooks:
+            try:
+                events |= self.hook_events[hook]
+            except KeyError:
+                return None
+
+        return events
+
+    @property
+    def wanted_events(self) -> Optional[FrozenSet[str]]:
+        """
+        :return: The set of event names that something (a listener, temporary listener or event
+            hook) wants, or None if an event hook wants every event.
+        """
+        # this is checked for every dispatch, so only recompute it when the registry changes
+        if self._wanted_version != self.version:
+            hooked = self.hooked_events
+            if hooked is None:
+                self._wanted_events = None
+            else:
+                self._wanted_events = frozenset(self.registered_events | hooked)
+
+            self._wanted_version = self.version
+
+        return self._wanted_events
 
     # listeners
     def add_temporary_listener(self, name: str, listener):
@@ -120,6 +174,7 @@ class EventManager(object):
         :param listener: The listener function.
         """
         self.temporary_listeners.add(name, listener)
+        self.version += 1
 
     def remove_listener_early(self, name: str, listener):
         """
@@ -128,22 +183,48 @@ class EventManager(object):
         :param name: The name of the event the listener is registered under.
         :param listener: The listener function.
         """
-        self.event_listeners = remove_from_multidict(self.event_listeners, key=name, item=listener)
+        self.temporary_listeners = remove_from_multidict(
+            self.temporary_listeners, key=name, item=listener
+        )
+        self.version += 1
 
-    def add_event_hook(self, listener):
+    def add_event_hook(self, listener, events: Iterable[str] = None):
         """
         Adds an event hook.
 
         :param listener: The event hook callable to use.
+        :param events: The names of the events this hook is called with. If this is None, the hook
+            is called with every event; this means no dispatch can be skipped and every
+            unprivileged intent is subscribed to, so pass this if possible.
         """
         logger.warning("Adding event hook '%s'", listener)
         self.event_hooks.add(listener)
+        self.update_event_hook(listener, events)
+
+    def update_event_hook(self, listener, events: Optional[Iterable[str]]):
+        """
+        Changes the events an event hook is called with.
+
+        :param listener: The event hook to update.
+        :param events: The new event names, or None to call the hook with every event.
+        """
+        if listener not in self.event_hooks:
+            raise ValueError(f"{listener!r} is not an event hook")
+
+        if events is not None:
+            self.hook_events[listener] = frozenset(events)
+        else:
+            self.hook_events.pop(listener, None)
+
+        self.version += 1
 
     def remove_event_hook(self, listener):
         """
         Removes an event hook.
         """
         self.event_hooks.remove(listener)
+        self.hook_events.pop(listener, None)
+        self.version += 1
 
     # wrapper functions
     async def _safety_wrapper(self, func, *args, **kwargs):
@@ -164,11 +245,13 @@ class EventManager(object):
         except ListenerExit:
             # remove the function
             self.temporary_listeners = remove_from_multidict(self.temporary_listeners, key, func)
+            self.version += 1
         except Exception:
             logger.exception(
                 "Unhandled exception in listener {}!".format(func.__name__), exc_info=True
             )
             self.temporary_listeners = remove_from_multidict(self.temporary_listeners, key, func)
+            self.version += 1
 
     async def wait_for(self, event_name: str, predicate=None):
         """
@@ -272,6 +355,10 @@ class EventManager(object):
 
         # always ensure hooks are ran first
         for hook in self.event_hooks:
+            events = self.hook_events.get(hook)
+            if events is not None and event_name not in events:
+                continue
+
             cofunc = functools.partial(hook, *args, **kwargs)
             await self.spawn(cofunc)
 
@@ -0,0 +1,192 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Dispatch policies, which decide how much work is done for each incoming gateway dispatch.
+
+.. currentmodule:: curious.core.event.policy
+"""
+import enum
+from typing import Dict, Mapping, Optional
+
+from curious.core.event.manager import EventManager
+
+
+class DispatchPolicy(enum.IntEnum):
+    """
+    Represents how a gateway dispatch is processed.
+    """
+
+    #: The state handler is ran, and both the raw event and the parsed events are fired.
+    FULL = 0
+
+    #: The state handler is ran to keep the cache consistent, but only the raw event is fired.
+    CACHE_ONLY = 1
+
+    #: The state handler is skipped entirely, and only the raw event is fired.
+    RAW_ONLY = 2
+
+    #: The dispatch is dropped.
+    IGNORE = 3
+
+
+#: A mapping of dispatch name -> the events the state handler for it can produce.
+DISPATCH_EVENTS = {
+    "READY": {"connect"},
+    "RESUMED": {"resumed"},
+    "USER_UPDATE": {"user_update"},
+    "PRESENCE_UPDATE": {"presence_update"},
+    "PRESENCES_REPLACE": {"presences_replace"},
+    "GUILD_MEMBERS_CHUNK": {"guild_chunk"},
+    "GUILD_CREATE": {"guild_available", "guild_join", "guild_streamed", "guild_chunk"},
+    "GUILD_UPDATE": {"guild_update"},
+    "GUILD_DELETE": {"guild_unavailable", "guild_leave"},
+    "GUILD_EMOJIS_UPDATE": {"guild_emojis_update"},
+    "MESSAGE_CREATE": {"message_create", "message_mentioned"},
+    "MESSAGE_UPDATE": {"message_update", "message_update_uncached", "message_edit"},
+    "MESSAGE_DELETE": {"message_delete", "message_delete_uncached"},
+    "MESSAGE_DELETE_BULK": {"message_delete_bulk", "message_delete_bulk_uncached"},
+    "MESSAGE_REACTION_ADD": {"message_reaction_add"},
+    "MESSAGE_REACTION_REMOVE": {"message_reaction_remove"},
+    "MESSAGE_REACTION_REMOVE_ALL": {"message_reaction_remove_all"},
+    "GUILD_MEMBER_ADD": {"guild_member_add"},
+    "GUILD_MEMBER_REMOVE": {"guild_member_remove"},
+    "GUILD_MEMBER_UPDATE": {"guild_member_update"},
+    "GUILD_BAN_ADD": {"guild_member_ban", "user_ban"},
+    "GUILD_BAN_REMOVE": {"user_unban"},
+    "CHANNEL_CREATE": {"channel_create"},
+    "CHANNEL_UPDATE": {"channel_update"},
+    "CHANNEL_DELETE": {"channel_delete"},
+    "CHANNEL_PINS_UPDATE": {"channel_pins_update"},
+    "CHANNEL_RECIPIENT_ADD": {"group_user_add"},
+    "CHANNEL_RECIPIENT_REMOVE": {"group_user_remove"},
+    "GUILD_ROLE_CREATE": {"guild_role_create"},
+    "GUILD_ROLE_UPDATE": {"guild_role_update"},
+    "GUILD_ROLE_DELETE": {"guild_role_delete"},
+    "TYPING_START": {"guild_member_typing", "user_typing"},
+    "VOICE_STATE_UPDATE": {"voice_state_update"},
+    "WEBHOOKS_UPDATE": {"webhooks_update"},
+}
+
+#: The dispatches whose state handlers don't modify the cache, and only build objects for events.
+#: These can be skipped entirely if nothing listens to them.
+STATELESS_DISPATCHES = frozenset(
+    {
+        "TYPING_START",
+        "PRESENCES_REPLACE",
+        "GUILD_BAN_ADD",
+        "GUILD_BAN_REMOVE",
+        "CHANNEL_PINS_UPDATE",
+        "WEBHOOKS_UPDATE",
+    }
+)
+
+
+class DispatchPolicyTable(object):
+    """
+    Decides the :class:`.DispatchPolicy` for each gateway dispatch, based on what is registered
+    in an :class:`.EventManager`. Event hooks count for the events they were registered with; a
+    hook registered without any events makes every dispatch :attr:`.DispatchPolicy.FULL`.
+
+    Policies are computed lazily and cached until the registry changes. Dispatches can also be
+    explicitly overridden:
+
+    .. code-block:: python3
+
+        # keep the presence cache, but never fire presence events
+        client.dispatch_policies.set_policy("PRESENCE_UPDATE", DispatchPolicy.CACHE_ONLY)
+    """
+
+    def __init__(self, manager: EventManager):
+        """
+        :param manager: The :class:`.EventManager` to compute policies from.
+        """
+        #: The :class:`.EventManager` policies are computed from.
+        self.manager = manager
+
+        #: A mapping of dispatch name -> explicitly set policy.
+        self.overrides: Dict[str, DispatchPolicy] = {}
+
+        self._policies: Dict[str, DispatchPolicy] = {}
+        self._version = None
+
+    def set_policy(self, dispatch: str, policy: Optional[DispatchPolicy]) -> None:
+        """
+        Overrides the policy for a dispatch.
+
+        :param dispatch: The name of the dispatch, e.g. ``TYPING_START``.
+        :param policy: The :class:`.DispatchPolicy` to use, or None to remove the override.
+        """
+        if policy is None:
+            self.overrides.pop(dispatch, None)
+        else:
+            self.overrides[dispatch] = policy
+
+        self._policies.pop(dispatch, None)
+
+    def compute(self, dispatch: str) -> DispatchPolicy:
+        """
+        Computes the policy for a dispatch, ignoring the cache.
+
+        :param dispatch: The name of the dispatch.
+        :return: The :class:`.DispatchPolicy` for the dispatch.
+        """
+        try:
+            return self.overrides[dispatch]
+        except KeyError:
+            pass
+
+        registered = self.manager.wanted_events
+        # a hook that didn't declare its events sees everything, so we can't skip anything
+        if registered is None:
+            return DispatchPolicy.FULL
+
+        events = DISPATCH_EVENTS.get(dispatch)
+
+        # unknown dispatches get the full treatment, as we can't know what they produce
+        if events is None or not events.isdisjoint(registered):
+            return DispatchPolicy.FULL
+
+        if dispatch not in STATELESS_DISPATCHES:
+            return DispatchPolicy.CACHE_ONLY
+
+        if f"{dispatch.lower()}_raw" in registered:
+            return DispatchPolicy.RAW_ONLY
+
+        return DispatchPolicy.IGNORE
+
+    def get(self, dispatch: str) -> DispatchPolicy:
+        """
+        Gets the policy for a dispatch.
+
+        :param dispatch: The name of the dispatch.
+        :return: The :class:`.DispatchPolicy` for the dispatch.
+        """
+        if self._version != self.manager.version:
+            self._policies.clear()
+            self._version = self.manager.version
+
+        try:
+            return self._policies[dispatch]
+        except KeyError:
+            policy = self._policies[dispatch] = self.compute(dispatch)
+            return policy
+
+    def snapshot(self) -> Mapping[str, DispatchPolicy]:
+        """
+        :return: A mapping of dispatch name -> policy for every known dispatch.
+        """
+        names = set(DISPATCH_EVENTS) | set(self.overrides)
+        return {name: self.get(name) for name in sorted(names)}
@@ -19,14 +19,13 @@ Websocket gateway code.
 .. currentmodule:: curious.core.gateway
 """
 import enum
-import json
 import logging
 import sys
 import time
 import zlib
 from collections import Counter
 from dataclasses import dataclass
-from typing import Any, AsyncContextManager, AsyncGenerator, List, Union
+from typing import Any, AsyncContextManager, AsyncGenerator, Iterable, List, Optional, Union
 
 import anyio
 from anyio import TaskGroup
@@ -35,6 +34,9 @@ from lomond.errors import WebSocketClosed, WebSocketClosing, WebSocketUnavailabl
 from lomond.events import Binary, Closing, Connected, Connecting, Text
 
 from curious.core._ws_wrapper.universal_wrapper import UniversalWrapper
+from curious.core.codec import ETFCodec, JSONCodec, get_gateway_codec
+from curious.core.ratelimit import GatewayRatelimiter, IdentifyLimiter, SendPriority
+from curious.core.session import SessionStore, StoredSession
 from curious.util import finalise, safe_generator
 
 
@@ -58,6 +60,128 @@ class GatewayOp(enum.IntEnum):
     GUILD_SYNC = 12
 
 
+class GatewayIntent(enum.IntFlag):
+    """
+    Represents the intents a shard subscribes to. Events belonging to intents that aren't
+    subscribed to are never sent by Discord.
+    """
+
+    GUILDS = 1 << 0
+    #: This intent is privileged.
+    GUILD_MEMBERS = 1 << 1
+    GUILD_BANS = 1 << 2
+    GUILD_EMOJIS = 1 << 3
+    GUILD_INTEGRATIONS = 1 << 4
+    GUILD_WEBHOOKS = 1 << 5
+    GUILD_INVITES = 1 << 6
+    GUILD_VOICE_STATES = 1 << 7
+    #: This intent is privileged.
+    GUILD_PRESENCES = 1 << 8
+    GUILD_MESSAGES = 1 << 9
+    GUILD_MESSAGE_REACTIONS = 1 << 10
+    GUILD_MESSAGE_TYPING = 1 << 11
+    DIRECT_MESSAGES = 1 << 12
+    DIRECT_MESSAGE_REACTIONS = 1 << 13
+    DIRECT_MESSAGE_TYPING = 1 << 14
+
+    @classmethod
+    def all(cls) -> "GatewayIntent":
+        """
+        :return: Every intent, including privileged intents.
+        """
+        value = cls(0)
+        for intent in cls:
+            value |= intent
+
+        return value
+
+    @classmethod
+    def privileged(cls) -> "GatewayIntent":
+        """
+        :return: The privileged intents. These must be enabled for the bot in the developer
+            portal, otherwise Discord closes the connection with a 4014.
+        """
+        return cls.GUILD_MEMBERS | cls.GUILD_PRESENCES
+
+    @classmethod
+    def unprivileged(cls) -> "GatewayIntent":
+        """
+        :return: Every intent that isn't privileged.
+        """
+        return cls.all() & ~cls.privileged()
+
+    @classmethod
+    def default(cls) -> "GatewayIntent":
+        """
+        :return: The intents that are always subscribed to when intents are derived from event
+            listeners. These are required to keep the guild and emoji caches up to date.
+        """
+        return cls.GUILDS | cls.GUILD_EMOJIS
+
+    @classmethod
+    def from_events(cls, event_names: Iterable[str]) -> "GatewayIntent":
+        """
+        Derives the intents needed to receive the specified events.
+
+        This accepts both the library event names (e.g. ``message_create``), and the raw
+        dispatch names (e.g. ``typing_start_raw``).
+
+        :param event_names: An iterable of event names that have listeners.
+        :return: The :class:`.GatewayIntent` required to receive all of those events. This may
+            include privileged intents.
+        """
+        value = cls.default()
+        for name in event_names:
+            if name.endswith("_raw"):
+                name = name[:-4]
+
+            value |= _EVENT_INTENTS.get(name, cls(0))
+
+        return value
+
+
+_MESSAGE_INTENTS = GatewayIntent.GUILD_MESSAGES | GatewayIntent.DIRECT_MESSAGES
+_REACTION_INTENTS = (
+    GatewayIntent.GUILD_MESSAGE_REACTIONS | GatewayIntent.DIRECT_MESSAGE_REACTIONS
+)
+
+#: A mapping of event name -> the intents that are needed to receive it.
+_EVENT_INTENTS = {
+    # library event names
+    "message_create": _MESSAGE_INTENTS,
+    "message_update": _MESSAGE_INTENTS,
+    "message_update_uncached": _MESSAGE_INTENTS,
+    "message_edit": _MESSAGE_INTENTS,
+    "message_mentioned": _MESSAGE_INTENTS,
+    "message_delete": _MESSAGE_INTENTS,
+    "message_delete_uncached": _MESSAGE_INTENTS,
+    "message_delete_bulk": GatewayIntent.GUILD_MESSAGES,
+    "message_delete_bulk_uncached": GatewayIntent.GUILD_MESSAGES,
+    "message_reaction_add": _REACTION_INTENTS,
+    "message_reaction_remove": _REACTION_INTENTS,
+    "message_reaction_remove_all": _REACTION_INTENTS,
+    "guild_member_typing": GatewayIntent.GUILD_MESSAGE_TYPING,
+    "user_typing": GatewayIntent.DIRECT_MESSAGE_TYPING,
+    "guild_member_add": GatewayIntent.GUILD_MEMBERS,
+    "guild_member_remove": GatewayIntent.GUILD_MEMBERS,
+    "guild_member_update": GatewayIntent.GUILD_MEMBERS,
+    "presence_update": GatewayIntent.GUILD_PRESENCES,
+    "presences_replace": GatewayIntent.GUILD_PRESENCES,
+    "voice_state_update": GatewayIntent.GUILD_VOICE_STATES,
+    "guild_member_ban": GatewayIntent.GUILD_BANS,
+    "user_ban": GatewayIntent.GUILD_BANS,
+    "user_unban": GatewayIntent.GUILD_BANS,
+    "webhooks_update": GatewayIntent.GUILD_WEBHOOKS,
+    # dispatch names that don't match a library event name
+    "typing_start": GatewayIntent.GUILD_MESSAGE_TYPING | GatewayIntent.DIRECT_MESSAGE_TYPING,
+    "guild_ban_add": GatewayIntent.GUILD_BANS,
+    "guild_ban_remove": GatewayIntent.GUILD_BANS,
+    "guild_integrations_update": GatewayIntent.GUILD_INTEGRATIONS,
+    "invite_create": GatewayIntent.GUILD_INVITES,
+    "invite_delete": GatewayIntent.GUILD_INVITES,
+}
+
+
 @dataclass
 class _GatewayState:
     """
@@ -112,6 +236,123 @@ class HeartbeatStats:
         return self.last_ack_time - self.last_heartbeat_time
 
 
+@dataclass
+class InflateStats:
+    """
+    Represents the statistics for the gateway's zlib-stream inflater.
+    """
+
+    #: The number of binary frames received.
+    frames: int = 0
+
+    #: The number of complete messages inflated.
+    messages: int = 0
+
+    #: The total number of compressed bytes received.
+    compressed_bytes: int = 0
+
+    #: The total number of bytes produced by inflating.
+    inflated_bytes: int = 0
+
+    #: The size of the largest inflated message, in bytes.
+    largest_message: int = 0
+
+    #: The size of the largest message that had to be buffered across multiple frames, in bytes.
+    largest_buffered: int = 0
+
+    #: The total time spent inflating, in seconds.
+    inflate_time: float = 0
+
+    #: The time spent inflating the most recent message, in seconds.
+    last_inflate_time: float = 0
+
+    @property
+    def average_inflate_time(self) -> float:
+        """
+        :return: The average time spent inflating a message, in seconds.
+        """
+        if not self.messages:
+            return 0
+
+        return self.inflate_time / self.messages
+
+    @property
+    def compression_ratio(self) -> float:
+        """
+        :return: The ratio of inflated bytes to compressed bytes.
+        """
+        if not self.compressed_bytes:
+            return 0
+
+        return self.inflated_bytes / self.compressed_bytes
+
+
+class ZlibStreamInflater(object):
+    """
+    Inflates a ``zlib-stream`` compressed gateway connection.
+
+    Messages that arrive in a single frame (the usual case) are fed to the decompressor directly,
+    without being copied into the reassembly buffer first. Only messages split across multiple
+    frames are buffered.
+    """
+
+    ZLIB_FLUSH_SUFFIX = b"\x00\x00\xff\xff"
+
+    def __init__(self):
+        self._decompressor = zlib.decompressobj()
+        self._buffer = bytearray()
+
+        #: The :class:`.InflateStats` for this inflater.
+        self.stats = InflateStats()
+
+    def reset(self) -> None:
+        """
+        Resets this inflater. This must be called whenever a new connection is made.
+        """
+        self._decompressor = zlib.decompressobj()
+        self._buffer.clear()
+
+    def feed(self, data: bytes) -> Optional[bytes]:
+        """
+        Feeds a binary frame into this inflater.
+
+        :param data: The frame data.
+        :return: The inflated message, or None if the message is not yet complete.
+        """
+        stats = self.stats
+        stats.frames += 1
+        stats.compressed_bytes += len(data)
+
+        complete = data.endswith(self.ZLIB_FLUSH_SUFFIX)
+        if not self._buffer and complete:
+            view = memoryview(data)
+        else:
+            self._buffer += data
+            if not complete:
+                return None
+
+            stats.largest_buffered = max(stats.largest_buffered, len(self._buffer))
+            view = memoryview(self._buffer)
+
+        before = time.perf_counter()
+        try:
+            inflated = self._decompressor.decompress(view)
+        finally:
+            # the view must be released before the buffer can be resized
+            view.release()
+            self._buffer.clear()
+
+        elapsed = time.perf_counter() - before
+
+        stats.messages += 1
+        stats.inflated_bytes += len(inflated)
+        stats.largest_message = max(stats.largest_message, len(inflated))
+        stats.inflate_time += elapsed
+        stats.last_inflate_time = elapsed
+
+        return inflated
+
+
 class GatewayHandler(object):
     """
     Represents a gateway handler - something that is connected to Discord's websocket and handles
@@ -128,28 +369,57 @@ class GatewayHandler(object):
     """
 
     GATEWAY_VERSION = 6
-    ZLIB_FLUSH_SUFFIX = b"\x00\x00\xff\xff"
+    ZLIB_FLUSH_SUFFIX = ZlibStreamInflater.ZLIB_FLUSH_SUFFIX
+
+    #: The websocket transports that can be used for the gateway.
+    TRANSPORTS = ("lomond", "anyio")
+
+    def __init__(
+        self, session: _GatewayState, *, transport: str = "lomond", encoding: str = "json"
+    ):
+        if transport not in self.TRANSPORTS:
+            raise ValueError(f"Unknown transport {transport!r}, must be one of {self.TRANSPORTS}")
 
-    def __init__(self, session: _GatewayState):
         #: The current session being used for this gateway.
         self.session = session
 
+        #: The name of the websocket transport used for this gateway.
+        self.transport = transport
+
         #: The current heartbeat stats being used for this gateway.
         self.heartbeat_stats = HeartbeatStats()
 
-        #: The current :class:`.BasicWebsocketWrapper` connected to Discord.
+        #: The :class:`.GatewayRatelimiter` used for outbound commands.
+        self.ratelimiter = GatewayRatelimiter()
+
+        #: The :class:`.IdentifyLimiter` shared between shards, if any.
+        self.identify_limiter: Optional[IdentifyLimiter] = None
+
+        #: The :class:`.GatewayIntent` to identify with, or None to not send intents.
+        self.intents: Optional[GatewayIntent] = None
+
+        #: The :class:`.GatewayRecorder` that incoming traffic is recorded to, if any.
+        self.recorder = None
+
+        #: The current websocket wrapper connected to Discord.
         self.websocket: UniversalWrapper = None
 
         #: The current task group for this gateway.
         self.task_group: TaskGroup = None
 
+        #: The payload encoding used for this gateway.
+        self.encoding = encoding
+
+        #: The codec used to encode and decode payloads.
+        self.codec: Union[JSONCodec, ETFCodec] = get_gateway_codec(encoding)
+
         self._logger = None
+        self._identify_acquired = False
         self._stop_heartbeating = anyio.create_event()
         self._dispatches_handled = Counter()
 
-        # used for zlib-streaming
-        self._databuffer = bytearray()
-        self._decompressor = zlib.decompressobj()
+        #: The :class:`.ZlibStreamInflater` used for zlib-streaming.
+        self.inflater = ZlibStreamInflater()
 
     @property
     def logger(self) -> logging.Logger:
@@ -194,17 +464,38 @@ class GatewayHandler(object):
             self.heartbeat_stats.heartbeat_acks = 0
 
     # send commands
-    async def send(self, data: dict) -> None:
+    async def send(self, data: dict, *, priority: SendPriority = SendPriority.NORMAL) -> None:
         """
         Sends data down the websocket.
+
+        This will wait if the shard's outbound command budget is exhausted.
+
+        :param data: The payload to send.
+        :param priority: The :class:`.SendPriority` of this payload.
         """
-        dumped = json.dumps(data)
+        await self.ratelimiter.acquire(priority)
+        dumped = self.codec.dumps(data)
+        if self.codec.binary:
+            return await self.websocket.send_binary(dumped)
+
         return await self.websocket.send_text(dumped)
 
     async def send_identify(self) -> None:
         """
         Sends an IDENTIFY to Discord.
+
+        If this gateway has an :attr:`.GatewayHandler.identify_limiter`, this will wait for this
+        shard's identify bucket to become free first.
         """
+        if self.identify_limiter is not None:
+            if self._identify_acquired:
+                # open_websocket already waited for the slot before connecting
+                self._identify_acquired = False
+            else:
+                await self.identify_limiter.acquire(self.session.shard_id)
+
+            await self.identify_limiter.identified(self.session.shard_id)
+
         payload = {
             "op": GatewayOp.IDENTIFY,
             "d": {
@@ -221,7 +512,15 @@ class GatewayHandler(object):
                 "shard": [self.session.shard_id, self.session.shard_count],
             },
         }
-        return await self.send(payload)
+
+        if self.intents is not None:
+            payload["d"]["intents"] = int(self.intents)
+            # presence and typing events are the only thing guild subscriptions control
+            payload["d"]["guild_subscriptions"] = bool(
+                self.intents & (GatewayIntent.GUILD_PRESENCES | GatewayIntent.GUILD_MESSAGE_TYPING)
+            )
+
+        return await self.send(payload, priority=SendPriority.SESSION)
 
     async def send_heartbeat(self) -> None:
         """
@@ -252,7 +551,7 @@ class GatewayHandler(object):
 
         self.logger.debug("Heartbeating with sequence {}".format(self.session.sequence))
         payload = {"op": GatewayOp.HEARTBEAT, "d": self.session.sequence}
-        return await self.send(payload)
+        return await self.send(payload, priority=SendPriority.HEARTBEAT)
 
     async def send_resume(self) -> None:
         """
@@ -266,7 +565,7 @@ class GatewayHandler(object):
                 "seq": self.session.sequence,
             },
         }
-        return await self.send(payload)
+        return await self.send(payload, priority=SendPriority.SESSION)
 
     async def send_guild_chunks(self, guild_ids: List[int]) -> None:
         """
@@ -317,13 +616,18 @@ class GatewayHandler(object):
 
             This only opens the websocket.
         """
-        self.logger.info("Using universal wrapper for the gateway")
-
         # new websocket means zlib starts from scratch
-        self._databuffer.clear()
-        self._decompressor = zlib.decompressobj()
+        self.inflater.reset()
+
+        if self.transport == "anyio":
+            # optional dependency, so only import it when asked for
+            from curious.core._ws_wrapper.anyio_wrapper import AnyioWrapper
 
-        self.websocket = UniversalWrapper(self.session.gateway_url, self.task_group)
+            self.logger.info("Using native anyio wrapper for the gateway")
+            self.websocket = AnyioWrapper(self.session.gateway_url, self.task_group)
+        else:
+            self.logger.info("Using universal wrapper for the gateway")
+            self.websocket = UniversalWrapper(self.session.gateway_url, self.task_group)
 
     async def events(self) -> AsyncGenerator[None, Any]:
         """
@@ -338,9 +642,10 @@ class GatewayHandler(object):
 
                 elif isinstance(event, Connecting):
                     self.logger.info("The websocket is opening...")
-                    # we need to reset the data buffer and zlib inflater
-                    self._databuffer.clear()
-                    self._decompressor = zlib.decompressobj()
+                    # we need to reset the zlib inflater
+                    self.inflater.reset()
+                    if self.recorder is not None:
+                        self.recorder.record_connect()
                     yield "websocket_opened", event.url
 
                 elif isinstance(event, Connected):
@@ -393,13 +698,15 @@ class GatewayHandler(object):
         """
         Handles a data event.
         """
+        recorder = self.recorder
+        if recorder is not None and not recorder.inflated:
+            recorder.record_frame(evt)
+
         if evt.name == "binary":
-            self._databuffer.extend(evt.data)
-            if not evt.data.endswith(self.ZLIB_FLUSH_SUFFIX):
+            # the codecs all take bytes, so there's no need to decode into a str first
+            data = self.inflater.feed(evt.data)
+            if data is None:
                 return
-            else:
-                data = self._decompressor.decompress(self._databuffer).decode("utf-8")
-                self._databuffer.clear()
         else:
             data = evt.text
 
@@ -407,7 +714,20 @@ class GatewayHandler(object):
         if not data:
             return
 
-        decoded = json.loads(data)
+        if recorder is not None and recorder.inflated:
+            recorder.record_payload(data)
+
+        async with finalise(self.handle_payload(data)) as agen:
+            async for i in agen:
+                yield i
+
+    async def handle_payload(self, data: Union[str, bytes]):
+        """
+        Handles a single complete (inflated) payload.
+
+        :param data: The encoded payload.
+        """
+        decoded = self.codec.loads(data)
         opcode = decoded.get("op")
         sequence = decoded.get("s")
         event_data = decoded.get("d", {})
@@ -507,7 +827,17 @@ class GatewayHandler(object):
 @asynccontextmanager
 @safe_generator
 async def open_websocket(
-    token: str, url: str, *, shard_id: int = 0, shard_count: int = 1
+    token: str,
+    url: str,
+    *,
+    shard_id: int = 0,
+    shard_count: int = 1,
+    transport: str = "lomond",
+    encoding: str = "json",
+    identify_limiter: IdentifyLimiter = None,
+    intents: GatewayIntent = None,
+    session_store: SessionStore = None,
+    recorder=None,
 ) -> AsyncContextManager[GatewayHandler]:
     """
     Opens a new connection to Discord.
@@ -530,23 +860,69 @@ async def open_websocket(
     :param url: The gateway URL to connect with.
     :param shard_id: The shard ID to connect with. Defaults to 0.
     :param shard_count: The number of shards to boot with.
+    :param transport: The websocket transport to use. ``"lomond"`` runs lomond in a worker
+        thread; ``"anyio"`` runs natively on the event loop (requires ``wsproto``).
+    :param encoding: The payload encoding to use, either ``"json"`` or ``"etf"``.
+    :param identify_limiter: The :class:`.IdentifyLimiter` to wait on before identifying. This
+        should be shared between every shard of a bot. Unless a session is being resumed, the
+        slot is acquired before the connection is opened.
+    :param intents: The :class:`.GatewayIntent` to identify with. If this is None, no intents
+        are sent and Discord's defaults are used.
+    :param session_store: The :class:`.SessionStore` to load a session to RESUME from, and to save
+        the session to when the connection is closed.
+    :param recorder: The :class:`.GatewayRecorder` to record incoming traffic to, if any. It is
+        closed when the connection is closed.
     :return: An async context manager that yields a :class:`.GatewayHandler`.
     """
-    params = f"/?v={GatewayHandler.GATEWAY_VERSION}&encoding=json&compress=zlib-stream"
+    params = f"/?v={GatewayHandler.GATEWAY_VERSION}&encoding={encoding}&compress=zlib-stream"
     url = url + params
     state = _GatewayState(token=token, gateway_url=url, shard_id=shard_id, shard_count=shard_count)
-    gw = GatewayHandler(session=state)
+    gw = GatewayHandler(session=state, transport=transport, encoding=encoding)
+    gw.identify_limiter = identify_limiter
+    gw.intents = intents
+    gw.recorder = recorder
 
     logger = logging.getLogger(f"curious.gateway:shard-{shard_id}")
 
+    if session_store is not None:
+        stored = session_store.load_session(shard_id, shard_count)
+        if stored is not None:
+            logger.info("Loaded stored session %s, will attempt to RESUME", stored.session_id)
+            state.session_id = stored.session_id
+            state.sequence = stored.sequence
+
     async with anyio.create_task_group() as tg:
         gw.task_group = tg
         try:
+            # wait for our identify slot before connecting, rather than sitting on an idle
+            # connection until it's free
+            if identify_limiter is not None and state.session_id is None:
+                await identify_limiter.acquire(shard_id)
+                gw._identify_acquired = True
+
             logger.info("Opening gateway connection to %s", url)
             await gw.open()
             yield gw
         finally:
+            # save before anything else, as the awaits below may be cancelled
+            if session_store is not None:
+                stored = None
+                if state.session_id is not None:
+                    stored = StoredSession(session_id=state.session_id, sequence=state.sequence)
+
+                session_store.save_session(shard_id, shard_count, stored)
+
             # make sure we don't die on closing the task group
             await gw._stop_heartbeating.set()
-            await gw.close(code=1000, reason="Closing bot", reconnect=False)
+            if session_store is not None and state.session_id is not None:
+                # closing with 1000 or 1001 invalidates the session, so use anything else
+                await gw.close(
+                    code=4000, reason="Restarting", reconnect=False, clear_session_id=False
+                )
+            else:
+                await gw.close(code=1000, reason="Closing bot", reconnect=False)
+
+            if recorder is not None:
+                recorder.close()
+
             await tg.cancel_scope.cancel()
@@ -51,6 +51,7 @@ except ImportError:
 
     lru = py_lru
 
+from curious.core.codec import get_json_codec
 from curious.exc import Forbidden, HTTPException, NotFound, Unauthorized
 
 logger = logging.getLogger("curious.http")
@@ -302,7 +303,7 @@ class HTTPClient(object):
         :param response: The response to use.
         """
         if response.headers.get("Content-Type", None) == "application/json":
-            return response.json()
+            return get_json_codec().loads(response.content)
 
         return response.content
 
@@ -543,13 +544,25 @@ class HTTPClient(object):
         data = await self.get(Endpoints.GATEWAY, "gateway")
         return data["url"]
 
+    async def get_gateway_bot(self) -> dict:
+        """
+        Gets the gateway information for this bot.
+
+        This includes the gateway URL, the recommended number of shards, and the
+        ``session_start_limit`` (which contains the ``max_concurrency`` for identifies).
+
+        :return: The raw gateway bot dictionary.
+        """
+        data = await self.get(Endpoints.GATEWAY_BOT, "gateway")
+        return data
+
     async def get_gateway_url_bot(self) -> Tuple[str, int]:
         """
         Gets the gateway URL, and the recommended number of shards for this bot.
 
         :return: The recommended number of shards for this bot.
         """
-        data = await self.get(Endpoints.GATEWAY_BOT, "gateway")
+        data = await self.get_gateway_bot()
         return data["url"], data["shards"]
 
     async def get_this_user(self):
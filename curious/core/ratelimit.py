@@ -0,0 +1,278 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Ratelimiting for outbound gateway commands.
+
+.. currentmodule:: curious.core.ratelimit
+"""
+import collections
+import enum
+import heapq
+import itertools
+import time
+from dataclasses import dataclass
+
+import anyio
+
+
+class SendPriority(enum.IntEnum):
+    """
+    Represents the priority of an outbound gateway command. Lower values are sent first.
+    """
+
+    #: Used for heartbeats. These must never be starved, or the connection will zombie.
+    HEARTBEAT = 0
+
+    #: Used for IDENTIFY and RESUME.
+    SESSION = 1
+
+    #: Used for everything else (presence updates, member chunk requests, etc).
+    NORMAL = 2
+
+
+@dataclass
+class SendStats:
+    """
+    Represents the statistics for a :class:`.GatewayRatelimiter`.
+    """
+
+    #: The number of commands that have been let through.
+    commands_sent: int = 0
+
+    #: The number of commands that had to wait for the window to free up.
+    commands_delayed: int = 0
+
+    #: The total time commands have spent waiting, in seconds.
+    total_wait_time: float = 0
+
+    #: The longest time a single command has waited, in seconds.
+    max_wait_time: float = 0
+
+    #: The time the most recent command waited, in seconds.
+    last_wait_time: float = 0
+
+    @property
+    def average_wait_time(self) -> float:
+        """
+        :return: The average time a command has waited, in seconds.
+        """
+        if not self.commands_sent:
+            return 0
+
+        return self.total_wait_time / self.commands_sent
+
+
+class GatewayRatelimiter(object):
+    """
+    A per-shard scheduler for outbound gateway commands.
+
+    Discord allows 120 commands per 60 seconds on each connection; going over this gets the shard
+    disconnected. Commands are let through in priority order (see :class:`.SendPriority`), and a
+    few slots in every window are reserved for heartbeats and session commands so that a burst of
+    chunk requests or presence changes can never starve them.
+    """
+
+    #: The longest a queued command will sleep before re-checking its position, in seconds.
+    POLL_INTERVAL = 0.5
+
+    def __init__(self, limit: int = 120, per: float = 60.0, *, reserved: int = 3):
+        """
+        :param limit: The number of commands allowed per window.
+        :param per: The length of the window, in seconds.
+        :param reserved: The number of commands per window only usable by heartbeats and session
+            commands.
+        """
+        #: The number of commands allowed per window.
+        self.limit = limit
+
+        #: The length of the window, in seconds.
+        self.per = per
+
+        #: The number of commands per window reserved for high priority commands.
+        self.reserved = reserved
+
+        #: The :class:`.SendStats` for this ratelimiter.
+        self.stats = SendStats()
+
+        self._sent = collections.deque()
+        self._waiters = []
+        self._counter = itertools.count()
+        self._wakeup = anyio.create_event()
+
+    @property
+    def queue_depth(self) -> int:
+        """
+        :return: The number of commands currently waiting to be sent.
+        """
+        return len(self._waiters)
+
+    @property
+    def remaining(self) -> int:
+        """
+        :return: The number of commands that can be sent in the current window.
+        """
+        self._expire(time.monotonic())
+        return max(self.limit - len(self._sent), 0)
+
+    def _expire(self, now: float) -> None:
+        """
+        Drops any send timestamps that have fallen out of the window.
+        """
+        while self._sent and now - self._sent[0] >= self.per:
+            self._sent.popleft()
+
+    def _delay(self, priority: SendPriority, now: float) -> float:
+        """
+        Calculates how long a command of the specified priority has to wait.
+        """
+        self._expire(now)
+
+        limit = self.limit
+        if priority > SendPriority.SESSION:
+            limit -= self.reserved
+
+        if len(self._sent) < limit:
+            return 0
+
+        # wait until enough of the oldest sends expire to get under the limit
+        return self._sent[len(self._sent) - limit] + self.per - now
+
+    async def _notify(self) -> None:
+        """
+        Wakes up every waiter, so they can re-check their position in the queue.
+        """
+        event, self._wakeup = self._wakeup, anyio.create_event()
+        await event.set()
+
+    async def acquire(self, priority: SendPriority = SendPriority.NORMAL) -> None:
+        """
+        Waits until a command of the specified priority can be sent.
+
+        :param priority: The :class:`.SendPriority` of the command.
+        """
+        started = time.monotonic()
+        entry = (priority, next(self._counter))
+        heapq.heappush(self._waiters, entry)
+
+        try:
+            # wake up the current head, in case we've just jumped in front of it
+            if self._waiters[0] == entry and len(self._waiters) > 1:
+                await self._notify()
+
+            while True:
+                wakeup = self._wakeup
+                timeout = self.POLL_INTERVAL
+
+                if self._waiters[0] == entry:
+                    now = time.monotonic()
+                    delay = self._delay(priority, now)
+                    if delay <= 0:
+                        heapq.heappop(self._waiters)
+                        self._sent.append(now)
+                        break
+
+                    timeout = min(delay, timeout)
+
+                # non-head waiters also time out, in case the head was cancelled without
+                # notifying anyone
+                async with anyio.move_on_after(timeout):
+                    await wakeup.wait()
+        except BaseException:
+            if entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+
+            raise
+
+        if self._waiters:
+            await self._notify()
+
+        waited = time.monotonic() - started
+        stats = self.stats
+        stats.commands_sent += 1
+        stats.last_wait_time = waited
+        stats.total_wait_time += waited
+        stats.max_wait_time = max(stats.max_wait_time, waited)
+        if waited > 0.001:
+            stats.commands_delayed += 1
+
+
+class IdentifyLimiter(object):
+    """
+    Coordinates IDENTIFY payloads across every shard of a client.
+
+    Discord splits shards into ``max_concurrency`` buckets (``shard_id % max_concurrency``), and
+    allows one IDENTIFY per bucket every five seconds. Shards in different buckets may identify at
+    the same time.
+    """
+
+    #: The number of seconds between identifies in the same bucket.
+    IDENTIFY_WINDOW = 5.0
+
+    def __init__(self, max_concurrency: int = 1):
+        """
+        :param max_concurrency: The ``max_concurrency`` value from ``/gateway/bot``.
+        """
+        #: The number of identify buckets.
+        self.max_concurrency = max(max_concurrency, 1)
+
+        self._locks = {}
+        self._last_identify = {}
+
+    def bucket_for(self, shard_id: int) -> int:
+        """
+        :param shard_id: The shard ID to get the bucket for.
+        :return: The identify bucket the specified shard belongs to.
+        """
+        return shard_id % self.max_concurrency
+
+    async def acquire(self, shard_id: int) -> None:
+        """
+        Waits until the specified shard is allowed to IDENTIFY.
+
+        :param shard_id: The ID of the shard that is about to identify.
+        """
+        bucket = self.bucket_for(shard_id)
+        try:
+            lock = self._locks[bucket]
+        except KeyError:
+            lock = self._locks[bucket] = anyio.create_lock()
+
+        async with lock:
+            # the last identify may be pushed back while we sleep, by identified()
+            while True:
+                last = self._last_identify.get(bucket)
+                if last is None:
+                    break
+
+                delay = last + self.IDENTIFY_WINDOW - time.monotonic()
+                if delay <= 0:
+                    break
+
+                await anyio.sleep(delay)
+
+            self._last_identify[bucket] = time.monotonic()
+
+    async def identified(self, shard_id: int) -> None:
+        """
+        Records that the specified shard has actually sent its IDENTIFY.
+
+        Shards acquire their slot before connecting, so the IDENTIFY itself goes out a little later;
+        this moves the start of the bucket's window to match.
+
+        :param shard_id: The ID of the shard that identified.
+        """
+        self._last_identify[self.bucket_for(shard_id)] = time.monotonic()
@@ -0,0 +1,284 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Recording and replaying of gateway traffic.
+
+Traffic is recorded per shard into a compact log of length-prefixed records:
+
+.. code-block:: python3
+
+    client = Client(token, gateway_record_path="traffic-{shard_id}.log")
+
+The log can then be replayed offline through the gateway, the client's dispatch and the state,
+with no network involved:
+
+.. code-block:: python3
+
+    stats = await client.run_replay({0: "traffic-0.log"})
+
+.. currentmodule:: curious.core.replay
+"""
+import enum
+import logging
+import struct
+import time
+from dataclasses import dataclass
+from typing import AsyncContextManager, AsyncGenerator, Iterator, Tuple, Union
+
+import anyio
+from async_generator import asynccontextmanager
+from lomond.events import Binary, Text
+
+from curious.core.gateway import GatewayHandler, _GatewayState
+from curious.util import finalise, safe_generator
+
+#: The header at the start of every log file.
+MAGIC = b"CGWR\x01"
+
+# kind, seconds since the recording started, length
+_record_header = struct.Struct(">BdI")
+
+logger = logging.getLogger("curious.replay")
+
+
+class RecordKind(enum.IntEnum):
+    """
+    Represents the kind of a record in a gateway log.
+    """
+
+    #: The websocket (re)connected, so the zlib stream was reset.
+    CONNECT = 0
+
+    #: A text frame, as received.
+    TEXT = 1
+
+    #: A binary frame, as received (i.e. still zlib-stream compressed).
+    BINARY = 2
+
+    #: A complete, inflated payload.
+    PAYLOAD = 3
+
+
+class GatewayRecorder(object):
+    """
+    Records the incoming traffic of a single gateway connection to a log file.
+    """
+
+    def __init__(self, path: str, *, inflated: bool = False):
+        """
+        :param path: The path to write the log to.
+        :param inflated: If True, complete inflated payloads are recorded instead of the raw
+            frames. This makes replays skip zlib entirely, at the cost of a larger log.
+        """
+        #: The path the log is written to.
+        self.path = path
+
+        #: If this recorder records inflated payloads rather than raw frames.
+        self.inflated = inflated
+
+        #: The number of records written.
+        self.records = 0
+
+        self._started = time.monotonic()
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+
+    def _write(self, kind: RecordKind, data: bytes) -> None:
+        offset = time.monotonic() - self._started
+        self._file.write(_record_header.pack(kind, offset, len(data)))
+        self._file.write(data)
+        self.records += 1
+
+    def record_connect(self) -> None:
+        """
+        Records that the websocket has (re)connected.
+        """
+        self._write(RecordKind.CONNECT, b"")
+
+    def record_frame(self, evt: Union[Text, Binary]) -> None:
+        """
+        Records a raw websocket frame.
+        """
+        if evt.name == "binary":
+            self._write(RecordKind.BINARY, evt.data)
+        else:
+            self._write(RecordKind.TEXT, evt.text.encode("utf-8"))
+
+    def record_payload(self, data: Union[str, bytes]) -> None:
+        """
+        Records a complete, inflated payload.
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        self._write(RecordKind.PAYLOAD, bytes(data))
+
+    def close(self) -> None:
+        """
+        Flushes and closes the log file.
+        """
+        self._file.close()
+
+
+def read_records(path: str) -> Iterator[Tuple[RecordKind, float, bytes]]:
+    """
+    Reads the records from a gateway log.
+
+    :param path: The path to the log.
+    :return: An iterator of (kind, seconds since the recording started, data).
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path} is not a gateway log")
+
+        while True:
+            header = f.read(_record_header.size)
+            if len(header) < _record_header.size:
+                return
+
+            kind, offset, length = _record_header.unpack(header)
+            yield RecordKind(kind), offset, f.read(length)
+
+
+class NullWebsocket(object):
+    """
+    A websocket that discards everything sent to it, used for replays.
+    """
+
+    def __init__(self):
+        #: The number of messages that would have been sent.
+        self.sent = 0
+
+    async def send_text(self, message: str) -> None:
+        self.sent += 1
+
+    async def send_binary(self, data: bytes) -> None:
+        self.sent += 1
+
+    async def close(self, code: int = 1000, reason: str = "", *, kill: bool = False) -> None:
+        pass
+
+
+@dataclass
+class ReplayStats:
+    """
+    Represents the statistics for a single replay.
+    """
+
+    #: The number of records replayed.
+    records: int = 0
+
+    #: The number of events produced by the gateway.
+    events: int = 0
+
+    #: The number of seconds the replay took.
+    elapsed: float = 0
+
+    @property
+    def events_per_second(self) -> float:
+        """
+        :return: The number of events produced per second.
+        """
+        if not self.elapsed:
+            return 0
+
+        return self.events / self.elapsed
+
+
+@asynccontextmanager
+@safe_generator
+async def open_replay(
+    token: str = "replay",
+    *,
+    shard_id: int = 0,
+    shard_count: int = 1,
+    encoding: str = "json",
+) -> AsyncContextManager[GatewayHandler]:
+    """
+    Opens a gateway handler that is connected to a :class:`.NullWebsocket`, for replaying logs
+    into with :func:`.replay_events`.
+
+    :param token: The token to use in any IDENTIFYs sent (these are discarded).
+    :param shard_id: The shard ID of the replayed shard.
+    :param shard_count: The shard count of the replayed shard.
+    :param encoding: The payload encoding the log was recorded with.
+    :return: An async context manager that yields a :class:`.GatewayHandler`.
+    """
+    state = _GatewayState(
+        token=token, gateway_url="replay://", shard_id=shard_id, shard_count=shard_count
+    )
+    gw = GatewayHandler(session=state, encoding=encoding)
+    gw.websocket = NullWebsocket()
+
+    async with anyio.create_task_group() as tg:
+        gw.task_group = tg
+        try:
+            yield gw
+        finally:
+            await gw._stop_heartbeating.set()
+            await tg.cancel_scope.cancel()
+
+
+async def replay_events(
+    gw: GatewayHandler, path: str, *, realtime: bool = False, stats: ReplayStats = None
+) -> AsyncGenerator[tuple, None]:
+    """
+    Replays a gateway log through a gateway handler, yielding the same events that
+    :meth:`.GatewayHandler.events` would.
+
+    :param gw: The :class:`.GatewayHandler` to replay through, from :func:`.open_replay`.
+    :param path: The path to the log.
+    :param realtime: If True, the original timing between records is kept. Otherwise, the log is
+        replayed as fast as possible.
+    :param stats: The :class:`.ReplayStats` to update, if any.
+    """
+    if stats is None:
+        stats = ReplayStats()
+
+    started = time.monotonic()
+    for kind, offset, data in read_records(path):
+        if realtime:
+            delay = offset - (time.monotonic() - started)
+            if delay > 0:
+                await anyio.sleep(delay)
+
+        stats.records += 1
+        if kind == RecordKind.CONNECT:
+            gw.inflater.reset()
+            stats.events += 1
+            yield "websocket_opened", gw.session.gateway_url
+            continue
+
+        if kind == RecordKind.PAYLOAD:
+            gen = gw.handle_payload(data)
+        elif kind == RecordKind.BINARY:
+            gen = gw.handle_data_event(Binary(data))
+        else:
+            gen = gw.handle_data_event(Text(data.decode("utf-8")))
+
+        async with finalise(gen) as agen:
+            async for event in agen:
+                stats.events += 1
+                yield event
+
+        # give other tasks (e.g. spawned event handlers) a chance to run
+        await anyio.sleep(0)
+
+    stats.elapsed = time.monotonic() - started
+    logger.info(
+        f"Replayed {stats.records} records from {path} in {stats.elapsed:.2f}s "
+        f"({stats.events_per_second:.0f} events/s)"
+    )
@@ -0,0 +1,302 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Session stores, used to persist gateway sessions (and a snapshot of the state) across restarts so
+that shards can RESUME instead of identifying again.
+
+.. code-block:: python3
+
+    store = FileSessionStore("sessions.json")
+    client = Client(token, session_store=store)
+
+Stored sessions are only valid for a short time, so this is only useful for quick restarts (for
+example, deploying a new version of the bot).
+
+.. currentmodule:: curious.core.session
+"""
+import abc
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import ContextManager, Optional
+
+
+@dataclass
+class StoredSession:
+    """
+    Represents a persisted gateway session for a single shard.
+    """
+
+    #: The session ID.
+    session_id: str
+
+    #: The last sequence received.
+    sequence: int
+
+    #: The UNIX timestamp this session was saved at.
+    saved_at: float = 0
+
+
+class SessionStore(abc.ABC):
+    """
+    The base class for a session store.
+
+    The methods on this class are synchronous, as they are called during shutdown when the event
+    loop may already be cancelled.
+    """
+
+    def __init__(self, max_age: float = 120):
+        """
+        :param max_age: The number of seconds a stored session or state snapshot is valid for.
+            Discord only keeps sessions around for a short time, so anything older than this is
+            discarded.
+        """
+        #: The number of seconds stored data is valid for.
+        self.max_age = max_age
+
+    def _is_fresh(self, saved_at: float) -> bool:
+        return time.time() - saved_at <= self.max_age
+
+    @abc.abstractmethod
+    def load_session(self, shard_id: int, shard_count: int) -> Optional[StoredSession]:
+        """
+        Loads the stored session for a shard.
+
+        :param shard_id: The shard ID.
+        :param shard_count: The shard count. Sessions saved with a different count are ignored.
+        :return: The :class:`.StoredSession`, or None if there is no valid session.
+        """
+
+    @abc.abstractmethod
+    def save_session(
+        self, shard_id: int, shard_count: int, session: Optional[StoredSession]
+    ) -> None:
+        """
+        Saves (or clears) the stored session for a shard.
+
+        :param shard_id: The shard ID.
+        :param shard_count: The shard count.
+        :param session: The :class:`.StoredSession` to save, or None to clear it.
+        """
+
+    @abc.abstractmethod
+    def load_snapshot(self) -> Optional[bytes]:
+        """
+        Loads and removes the stored state snapshot.
+
+        Snapshots are single use; a snapshot that has been loaded once must not be loaded again,
+        as the cache will have moved on from it.
+
+        :return: The snapshot data, or None if there is no valid snapshot.
+        """
+
+    @abc.abstractmethod
+    def save_snapshot(self, data: bytes) -> None:
+        """
+        Saves a state snapshot.
+
+        :param data: The snapshot data, produced by :meth:`.State.snapshot`.
+        """
+
+    @abc.abstractmethod
+    def clear(self) -> None:
+        """
+        Clears every stored session and snapshot.
+        """
+
+
+class FileSessionStore(SessionStore):
+    """
+    A session store that uses a JSON file for sessions, and a sibling ``.state`` file for the state
+    snapshot.
+    """
+
+    def __init__(self, path: str, *, max_age: float = 120):
+        """
+        :param path: The path to the session file.
+        """
+        super().__init__(max_age=max_age)
+
+        #: The path to the session file.
+        self.path = path
+
+        #: The path to the state snapshot file.
+        self.snapshot_path = path + ".state"
+
+        self._lock = threading.Lock()
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _write(self, data: dict) -> None:
+        # write to a temporary file and rename, so a crash never leaves a half-written file
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+
+        os.replace(tmp, self.path)
+
+    def load_session(self, shard_id: int, shard_count: int) -> Optional[StoredSession]:
+        with self._lock:
+            data = self._read().get(f"{shard_id}/{shard_count}")
+
+        if data is None:
+            return None
+
+        session = StoredSession(**data)
+        if not self._is_fresh(session.saved_at):
+            return None
+
+        return session
+
+    def save_session(
+        self, shard_id: int, shard_count: int, session: Optional[StoredSession]
+    ) -> None:
+        key = f"{shard_id}/{shard_count}"
+        with self._lock:
+            data = self._read()
+            if session is None:
+                data.pop(key, None)
+            else:
+                session.saved_at = time.time()
+                data[key] = asdict(session)
+
+            self._write(data)
+
+    def load_snapshot(self) -> Optional[bytes]:
+        try:
+            saved_at = os.path.getmtime(self.snapshot_path)
+            with open(self.snapshot_path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        os.remove(self.snapshot_path)
+        if not self._is_fresh(saved_at):
+            return None
+
+        return data
+
+    def save_snapshot(self, data: bytes) -> None:
+        tmp = self.snapshot_path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+
+        os.replace(tmp, self.snapshot_path)
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in (self.path, self.snapshot_path):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    A session store that uses a SQLite database.
+    """
+
+    def __init__(self, path: str, *, max_age: float = 120):
+        """
+        :param path: The path to the SQLite database.
+        """
+        super().__init__(max_age=max_age)
+
+        #: The path to the SQLite database.
+        self.path = path
+
+        self._lock = threading.Lock()
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "shard_id INTEGER, shard_count INTEGER, session_id TEXT, sequence INTEGER, "
+                "saved_at REAL, PRIMARY KEY (shard_id, shard_count))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                "id INTEGER PRIMARY KEY, data BLOB, saved_at REAL)"
+            )
+
+    @contextmanager
+    def _connect(self) -> ContextManager[sqlite3.Connection]:
+        # connections can't be shared between threads, so open one per operation
+        conn = sqlite3.connect(self.path)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def load_session(self, shard_id: int, shard_count: int) -> Optional[StoredSession]:
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT session_id, sequence, saved_at FROM sessions "
+                "WHERE shard_id = ? AND shard_count = ?",
+                (shard_id, shard_count),
+            ).fetchone()
+
+        if row is None or not self._is_fresh(row[2]):
+            return None
+
+        return StoredSession(*row)
+
+    def save_session(
+        self, shard_id: int, shard_count: int, session: Optional[StoredSession]
+    ) -> None:
+        with self._lock, self._connect() as conn:
+            if session is None:
+                conn.execute(
+                    "DELETE FROM sessions WHERE shard_id = ? AND shard_count = ?",
+                    (shard_id, shard_count),
+                )
+                return
+
+            session.saved_at = time.time()
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions VALUES (?, ?, ?, ?, ?)",
+                (shard_id, shard_count, session.session_id, session.sequence, session.saved_at),
+            )
+
+    def load_snapshot(self) -> Optional[bytes]:
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT data, saved_at FROM snapshots WHERE id = 0").fetchone()
+            conn.execute("DELETE FROM snapshots")
+
+        if row is None or not self._is_fresh(row[1]):
+            return None
+
+        return bytes(row[0])
+
+    def save_snapshot(self, data: bytes) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO snapshots VALUES (0, ?, ?)", (data, time.time()),
+            )
+
+    def clear(self) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM sessions")
+            conn.execute("DELETE FROM snapshots")
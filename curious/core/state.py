@@ -21,11 +21,43 @@ Defines :class:`.State`.
 
 import collections
 import copy
+import datetime
+import functools
+import hashlib
+import importlib
+import io
 import logging
+import pickle
+import pkgutil
+import time
 from types import MappingProxyType
-from typing import Any, Dict, Generator, Mapping, Optional, Type, TypeVar, Union
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Generator,
+    Hashable,
+    Iterable,
+    Mapping,
+    Optional,
+    Set,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
+
+import anyio
 
 from curious.core import _current_shard
+from curious.core.cache import (
+    CachePolicy,
+    CacheStats,
+    InternTable,
+    MessageStore,
+    UserCacheStats,
+)
+from curious.core.gateway import GatewayIntent
 from curious.dataclasses.channel import Channel, ChannelType
 from curious.dataclasses.embed import Embed
 from curious.dataclasses.emoji import Emoji, PartialEmoji
@@ -39,7 +71,7 @@ from curious.dataclasses.guild import (
 from curious.dataclasses.member import Member
 from curious.dataclasses.message import Message
 from curious.dataclasses.permissions import Permissions
-from curious.dataclasses.presence import Presence
+from curious.dataclasses.presence import BasicActivity, Presence, RichActivity, Status
 from curious.dataclasses.reaction import Reaction
 from curious.dataclasses.role import Role
 from curious.dataclasses.user import BotUser, User
@@ -60,6 +92,112 @@ def int_or_none(val, default: Any) -> Optional[int]:
     return int(val)
 
 
+class _SnapshotPickler(pickle.Pickler):
+    """
+    A pickler that swaps out objects bound to the running event loop.
+    """
+
+    def __init__(self, file, *, event_type: type, dropped: set):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self._event_type = event_type
+        self._dropped = dropped
+
+    def persistent_id(self, obj: Any):
+        if isinstance(obj, self._event_type):
+            return "event", obj.is_set()
+
+        if id(obj) in self._dropped:
+            return ("none",)
+
+        return None
+
+
+#: The modules that snapshots may load classes from.
+_SNAPSHOT_PACKAGE = "curious.dataclasses"
+
+#: The classes outside of :mod:`curious.dataclasses` that snapshots may load.
+_SNAPSHOT_EXTRA_CLASSES = {
+    ("datetime", "datetime"): datetime.datetime,
+    ("datetime", "timedelta"): datetime.timedelta,
+    ("datetime", "timezone"): datetime.timezone,
+    ("collections", "deque"): collections.deque,
+    ("collections", "OrderedDict"): collections.OrderedDict,
+}
+
+
+def _snapshot_modules():
+    """
+    Imports and yields every module of :mod:`curious.dataclasses`.
+    """
+    package = importlib.import_module(_SNAPSHOT_PACKAGE)
+    for info in pkgutil.iter_modules(package.__path__):
+        yield importlib.import_module(f"{_SNAPSHOT_PACKAGE}.{info.name}")
+
+
+@functools.lru_cache(maxsize=None)
+def _snapshot_layout() -> str:
+    """
+    :return: A fingerprint of the slots of every dataclass, so that snapshots taken before a
+        dataclass changed are ignored rather than restored into the wrong attributes.
+    """
+    layout = []
+    for module in _snapshot_modules():
+        for name, obb in sorted(vars(module).items()):
+            if not isinstance(obb, type) or obb.__module__ != module.__name__:
+                continue
+
+            slots = []
+            for klass in obb.__mro__:
+                klass_slots = klass.__dict__.get("__slots__", ())
+                if isinstance(klass_slots, str):
+                    klass_slots = (klass_slots,)
+
+                slots.append((klass.__qualname__, tuple(klass_slots)))
+
+            layout.append((module.__name__, name, tuple(slots)))
+
+    return hashlib.sha1(repr(layout).encode("utf-8")).hexdigest()
+
+
+class _SnapshotUnpickler(pickle.Unpickler):
+    """
+    The inverse of :class:`._SnapshotPickler`.
+
+    Only dataclasses, their enums and a few plain standard library types can be loaded, so that a
+    tampered snapshot can't call anything else.
+    """
+
+    def __init__(self, file):
+        super().__init__(file)
+
+        #: The events that were set when the snapshot was taken.
+        self.set_events = []
+
+    def persistent_load(self, pid):
+        if pid[0] == "event":
+            event = anyio.create_event()
+            if pid[1]:
+                self.set_events.append(event)
+
+            return event
+
+        return None
+
+    def find_class(self, module: str, name: str):
+        try:
+            return _SNAPSHOT_EXTRA_CLASSES[module, name]
+        except KeyError:
+            pass
+
+        if module.startswith(f"{_SNAPSHOT_PACKAGE}.") and "." not in name:
+            obb = getattr(importlib.import_module(module), name, None)
+            # only classes defined in that module, rather than anything it imported
+            if isinstance(obb, type) and obb.__module__ == module:
+                return obb
+
+        raise pickle.UnpicklingError(f"Refusing to load {module}.{name} from a state snapshot")
+
+
 class State(object):
     """
     This represents the state of the Client - in other libraries, the cache.
@@ -67,7 +205,10 @@ class State(object):
     The other main purpose for this class is to parse events from the Discord websocket.
     """
 
-    def __init__(self, max_messages: int = 500):
+    def __init__(self, max_messages: int = 500, *, cache_policy: CachePolicy = None):
+        #: The :class:`.CachePolicy` that decides what is cached.
+        self.cache_policy = cache_policy or CachePolicy()
+
         #: The current user of this bot.
         #: This is automatically set after login.
         self._user = None  # type: BotUser
@@ -75,18 +216,129 @@ class State(object):
         #: The private channel cache.
         self._private_channels = {}
 
+        #: A mapping of channel ID -> :class:`.Channel` for every guild channel, so that channels
+        #: can be found without searching every guild.
+        self._channels = {}  # type: Dict[int, Channel]
+
+        #: A mapping of user ID -> the IDs of the guilds that user is a cached member of.
+        self._user_guilds = {}  # type: Dict[int, Set[int]]
+
         #: The guilds the bot can see.
         self._guilds = {}  # type: Dict[int, Guild]
 
         #: The current user cache.
         self._users = {}
 
-        #: The deque of messages.
+        #: A mapping of user ID -> the number of members and private channels referencing that
+        #: user. Users are evicted from the cache once this reaches zero.
+        self._user_refs = collections.Counter()
+
+        self._user_stats = UserCacheStats()
+
+        #: The interned :class:`.Presence` objects, shared between members with the same presence.
+        self._presences = InternTable()  # type: InternTable[Presence]
+
+        #: The interned activity objects, shared between presences with the same activity.
+        self._activities = InternTable()  # type: InternTable[BasicActivity]
+
+        #: A mapping of (guild ID, member ID) -> the time that member was last seen, oldest first.
+        #: This is only used if the cache policy has a member TTL.
+        self._member_seen = collections.OrderedDict()  # type: Dict[Tuple[int, int], float]
+
+        #: The :class:`.MessageStore` of messages, cached per channel.
         #: This is bounded to prevent the message cache from growing infinitely.
-        self.messages = collections.deque(maxlen=max_messages)
+        self.messages = MessageStore(max_messages)
+
+        #: The :class:`.GatewayIntent` the shards are subscribed to.
+        #: Caches for events that aren't subscribed to are not populated, as they would go stale.
+        self.intents = GatewayIntent.all()
+
+        #: A callable of (dispatch name, event name) -> if that event will be fired and has
+        #: something listening to it. Handlers don't copy the "before" objects for other events.
+        self.event_filter = None  # type: Optional[Callable[[str, str], bool]]
 
         self.__shards_is_ready = collections.defaultdict(lambda: False)
 
+    #: The version of the snapshot format. Snapshots with a different version are ignored.
+    #: Changes to the dataclasses' slots are detected without bumping this.
+    SNAPSHOT_VERSION = 2
+
+    def snapshot(self) -> bytes:
+        """
+        Takes a snapshot of the cache, to be restored with :meth:`.State.restore`.
+
+        This must be called from inside the event loop.
+
+        :return: The serialized snapshot.
+        """
+        # voice clients can't survive a restart
+        dropped = {id(g.voice_client) for g in self._guilds.values() if g.voice_client is not None}
+
+        data = {
+            "version": self.SNAPSHOT_VERSION,
+            "layout": _snapshot_layout(),
+            "user": self._user,
+            "users": self._users,
+            "guilds": self._guilds,
+            "private_channels": self._private_channels,
+            "messages": list(self.messages),
+        }
+
+        buf = io.BytesIO()
+        pickler = _SnapshotPickler(buf, event_type=type(anyio.create_event()), dropped=dropped)
+        pickler.dump(data)
+        return buf.getvalue()
+
+    async def restore(self, snapshot: bytes) -> bool:
+        """
+        Restores the cache from a snapshot made by :meth:`.State.snapshot`.
+
+        :param snapshot: The serialized snapshot.
+        :return: True if the snapshot was restored, False if it couldn't be used.
+        """
+        unpickler = _SnapshotUnpickler(io.BytesIO(snapshot))
+        try:
+            data = unpickler.load()
+        except Exception:
+            logger.exception("Failed to load state snapshot")
+            return False
+
+        if (
+            not isinstance(data, dict)
+            or data.get("version") != self.SNAPSHOT_VERSION
+            or data.get("layout") != _snapshot_layout()
+        ):
+            logger.warning("Ignoring state snapshot with an old version")
+            return False
+
+        self._user = data["user"]
+        self._users = data["users"]
+        self._guilds = data["guilds"]
+        self._private_channels = data["private_channels"]
+
+        # the indexes aren't stored, as they can be rebuilt from the guilds
+        self._channels = {}
+        self._user_guilds = {}
+        self._user_refs = collections.Counter()
+        self._member_seen.clear()
+        for guild in self._guilds.values():
+            self._index_guild_channels(guild)
+            self._index_members(guild, guild._members)
+
+        for channel in self._private_channels.values():
+            for user_id in channel._recipients:
+                self._ref_user(user_id)
+
+        self.messages.clear()
+        for message in data["messages"]:
+            self._cache_message(message)
+
+        for event in unpickler.set_events:
+            await event.set()
+
+        logger.info(f"Restored state snapshot with {len(self._guilds)} guilds")
+        return True
+
     def is_ready(self, shard_id: int) -> bool:
         """
         Checks if a shard is ready.
@@ -105,6 +357,35 @@ class State(object):
         for guild in self.guilds_for_shard(shard_id):
             guild._finished_chunking.clear()
 
+    @property
+    def user_cache_stats(self) -> UserCacheStats:
+        """
+        :return: The :class:`.UserCacheStats` for the user cache.
+        """
+        self._user_stats.size = len(self._users)
+        return self._user_stats
+
+    @property
+    def presence_intern_stats(self) -> CacheStats:
+        """
+        :return: The :class:`.CacheStats` for the presence intern table.
+        """
+        return self._presences.stats
+
+    @property
+    def activity_intern_stats(self) -> CacheStats:
+        """
+        :return: The :class:`.CacheStats` for the activity intern table.
+        """
+        return self._activities.stats
+
+    @property
+    def message_cache_stats(self) -> CacheStats:
+        """
+        :return: The :class:`.CacheStats` for message lookups, e.g. for edits and deletes.
+        """
+        return self.messages.stats
+
     @property
     def guilds(self) -> Mapping[int, Guild]:
         """
@@ -127,6 +408,250 @@ class State(object):
             if guild.shard_id == shard_id and guild.unavailable is False
         )
 
+    def _fires(self, dispatch: str, event_name: str) -> bool:
+        """
+        :return: If an event parsed from a dispatch is fired, according to the event filter.
+        """
+        return self.event_filter is None or self.event_filter(dispatch, event_name)
+
+    def _filter_guild_create(self, event_data: dict) -> dict:
+        """
+        Removes the parts of a GUILD_CREATE that we won't get updates for, with the current
+        intents, or that the cache policy doesn't cache.
+        """
+        policy = self.cache_policy
+        skipped = []
+        if not self.intents & GatewayIntent.GUILD_PRESENCES or not policy.presences:
+            skipped.append("presences")
+
+        if not self.intents & GatewayIntent.GUILD_VOICE_STATES or not policy.voice_states:
+            skipped.append("voice_states")
+
+        if not self.intents & GatewayIntent.GUILD_EMOJIS or not policy.emojis:
+            skipped.append("emojis")
+
+        filter_members = "members" in event_data and not policy.chunk_members
+        if not skipped and not filter_members:
+            return event_data
+
+        # copy, so that the raw event still gets the full data
+        filtered = {k: v for (k, v) in event_data.items() if k not in skipped}
+        if filter_members:
+            filtered["members"] = self._filter_members(
+                event_data["members"], event_data.get("presences", [])
+            )
+
+        return filtered
+
+    def _filter_members(self, members: list, presences: list) -> list:
+        """
+        Removes the members that the cache policy doesn't cache from a list of member data.
+
+        :param members: The list of member data dictionaries.
+        :param presences: The list of presence data dictionaries for these members.
+        """
+        policy = self.cache_policy
+        if policy.chunk_members:
+            return members
+
+        keep = set()
+        if policy.members:
+            # online members only
+            for presence in presences:
+                if presence.get("status", Status.OFFLINE.value) != Status.OFFLINE.value:
+                    keep.add(int(presence["user"]["id"]))
+
+        # always cache ourselves
+        if self._user is not None:
+            keep.add(self._user.id)
+
+        return [member for member in members if int(member["user"]["id"]) in keep]
+
+    def _index_guild_channels(self, guild: Guild) -> None:
+        """
+        Adds every channel in a guild to the channel index.
+        """
+        self._channels.update(guild._channels)
+
+    def _unindex_guild_channels(self, guild: Guild) -> None:
+        """
+        Removes every channel in a guild from the channel index.
+        """
+        for channel_id in guild._channels:
+            self._channels.pop(channel_id, None)
+
+    def _index_members(self, guild: Guild, member_ids: Iterable[int]) -> None:
+        """
+        Records that the specified users are members of a guild.
+        """
+        track = self.cache_policy.member_ttl is not None
+        now = time.monotonic()
+        for member_id in member_ids:
+            # evicting here would change the guild's members while they are being iterated over
+            if track:
+                self._mark_member_seen(guild, member_id, now)
+
+            guild_ids = self._user_guilds.get(member_id)
+            if guild_ids is None:
+                guild_ids = self._user_guilds[member_id] = set()
+            elif guild.id in guild_ids:
+                continue
+
+            guild_ids.add(guild.id)
+            self._ref_user(member_id)
+
+        if track:
+            self._evict_expired_members(now)
+
+    def _unindex_member(self, guild: Guild, member_id: int) -> None:
+        """
+        Records that the specified user is no longer a member of a guild.
+        """
+        guild_ids = self._user_guilds.get(member_id)
+        if guild_ids is None or guild.id not in guild_ids:
+            return
+
+        guild_ids.discard(guild.id)
+        if not guild_ids:
+            del self._user_guilds[member_id]
+
+        self._unref_user(member_id)
+
+    def _remove_cached_member(self, guild: Guild, member_id: int) -> Optional[Member]:
+        """
+        Removes a member from the cache of a guild.
+
+        :return: The :class:`.Member` removed, if it was cached.
+        """
+        member = guild._members.pop(member_id, None)
+        self._unindex_member(guild, member_id)
+        self._member_seen.pop((guild.id, member_id), None)
+        return member
+
+    def _touch_member(self, guild: Guild, member_id: int) -> None:
+        """
+        Marks a cached member as recently seen, and evicts the members that haven't been seen for
+        longer than the member TTL of the cache policy.
+        """
+        if self.cache_policy.member_ttl is None:
+            return
+
+        now = time.monotonic()
+        self._mark_member_seen(guild, member_id, now)
+        self._evict_expired_members(now)
+
+    def _mark_member_seen(self, guild: Guild, member_id: int, now: float) -> None:
+        """
+        Marks a cached member as seen at the specified time, for the member TTL.
+        """
+        # we never evict ourselves
+        if member_id in guild._members and member_id != self._user.id:
+            key = (guild.id, member_id)
+            self._member_seen[key] = now
+            self._member_seen.move_to_end(key)
+
+    def _evict_expired_members(self, now: float) -> None:
+        """
+        Evicts the members that haven't been seen for longer than the member TTL.
+        """
+        ttl = self.cache_policy.member_ttl
+        seen = self._member_seen
+        while seen:
+            key, last_seen = next(iter(seen.items()))
+            if now - last_seen < ttl:
+                break
+
+            del seen[key]
+            expired_guild = self._guilds.get(key[0])
+            if expired_guild is not None:
+                self._remove_cached_member(expired_guild, key[1])
+
+    def _get_or_make_member(
+        self, guild: Guild, member_id: int, member_data: Optional[dict]
+    ) -> Optional[Member]:
+        """
+        Gets a member of a guild, creating it from the member data in an event if it isn't cached.
+
+        Created members are only cached if :attr:`.CachePolicy.cache_event_members` is set;
+        otherwise, they are only used for the event.
+
+        :param guild: The :class:`.Guild` the member is in.
+        :param member_id: The ID of the member.
+        :param member_data: The member data from the event, including the user data.
+        :return: The :class:`.Member`, or None if it wasn't cached and couldn't be created.
+        """
+        member = guild._members.get(member_id)
+        if member is not None:
+            self._touch_member(guild, member_id)
+            return member
+
+        if not member_data or "user" not in member_data:
+            return None
+
+        member = Member(**member_data)
+        member.guild_id = guild.id
+
+        # online members are cached by presence updates, as we don't know the status here
+        if self.cache_policy.cache_event_members:
+            guild._members[member_id] = member
+            self._index_members(guild, (member_id,))
+        else:
+            # the user was only cached for the temporary member
+            self._check_decache_user(member_id)
+
+        return member
+
+    def _reindex_member_names(self, user_id: int) -> None:
+        """
+        Updates the member name index of every guild a user is a member of, after their username
+        or nickname changed.
+        """
+        for guild_id in self._user_guilds.get(user_id, ()):
+            self._guilds[guild_id]._members.reindex(user_id)
+
+    def _ref_user(self, user_id: int) -> None:
+        """
+        Adds a reference to a cached user.
+        """
+        self._user_refs[user_id] += 1
+
+    def _unref_user(self, user_id: int) -> None:
+        """
+        Removes a reference to a cached user, evicting the user if nothing references it anymore.
+        """
+        refs = self._user_refs[user_id] - 1
+        if refs > 0:
+            self._user_refs[user_id] = refs
+            return
+
+        self._user_refs.pop(user_id, None)
+        self._check_decache_user(user_id)
+
+    def _add_private_channel(self, channel: Channel) -> None:
+        """
+        Caches a private channel, referencing its recipients.
+        """
+        old_channel = self._private_channels.get(channel.id)
+        self._private_channels[channel.id] = channel
+        for user_id in channel._recipients:
+            self._ref_user(user_id)
+
+        # dereference afterwards, so shared recipients aren't evicted in between
+        if old_channel is not None and old_channel is not channel:
+            for user_id in old_channel._recipients:
+                self._unref_user(user_id)
+
+    def _remove_private_channel(self, channel_id: int) -> None:
+        """
+        Removes a private channel from the cache, dereferencing its recipients.
+        """
+        channel = self._private_channels.pop(channel_id, None)
+        if channel is None:
+            return
+
+        for user_id in channel._recipients:
+            self._unref_user(user_id)
+
     def guilds_for_shard(self, shard_id: int):
         """
         Gets all the guilds for a particular shard.
@@ -165,12 +690,16 @@ class State(object):
         :param user_id: The user ID to find.
         :return: The :class:`.Member` or :class:`.User` found, if any.
         """
-        for guild in self.guilds.values():
-            try:
-                return guild.members[user_id]
-            except KeyError:
+        # the index should match the guilds, but a stale entry mustn't break event handlers
+        for guild_id in self._user_guilds.get(user_id, ()):
+            guild = self._guilds.get(guild_id)
+            if guild is None:
                 continue
 
+            member = guild._members.get(user_id)
+            if member is not None:
+                return member
+
         return self._users.get(user_id)
 
     def find_channel(self, channel_id: int) -> Optional[Channel]:
@@ -181,20 +710,10 @@ class State(object):
         :param channel_id: The ID of the channel to find.
         :return: A :class:`.Channel` that represents the channel, or None if no channel was found.
         """
-        # default channel_id == guild id
-        # for old guilds with a default channel
-        if channel_id in self._guilds:
-            try:
-                return self._guilds[channel_id].channels[channel_id]
-            except KeyError:
-                return None
-
-        if channel_id in self._private_channels:
-            return self._private_channels[channel_id]
-
-        for guild in self._guilds.values():
-            if channel_id in guild._channels:
-                return guild._channels[channel_id]
+        try:
+            return self._channels[channel_id]
+        except KeyError:
+            return self._private_channels.get(channel_id)
 
     def find_message(self, message_id: int) -> Message:
         """
@@ -203,36 +722,24 @@ class State(object):
         :param message_id: The message ID to find.
         :return: A :class:`.Message` to find, or None if it was not cached.
         """
-        for message in reversed(self.messages):
-            if message.id == message_id:
-                return message
+        return self.messages.get(message_id)
 
     def _check_decache_user(self, id: int):
         """
         Checks if we should decache a user.
 
-        This will check if there is any guild with a reference to the user.
+        Users that aren't referenced by any member or private channel are evicted from the cache.
         """
-        # don't check if its not there
-        if id not in self._users:
+        # still referenced
+        if self._user_refs[id] > 0:
             return
 
         # don't decache ourself
-        if self._users[id] == self._user:
+        if self._user is not None and id == self._user.id:
             return
 
-        # check if its in a private channel
-        for channel in self._private_channels.values():
-            if id in channel.recipients:
-                return
-
-        # check if it's any guilds
-        for guild in self._guilds.values():
-            if id in guild.members:
-                return
-
-        # didn't return, so no references
-        self._users.pop(id, None)
+        if self._users.pop(id, None) is not None:
+            self._user_stats.evicted += 1
 
     # make_ methods
     def make_webhook(self, event_data: dict) -> Webhook:
@@ -288,10 +795,107 @@ class State(object):
         :return: A new :class:`.Channel`.
         """
         channel = Channel(**channel_data)
-        self._private_channels[channel.id] = channel
+        self._add_private_channel(channel)
 
         return channel
 
+    @staticmethod
+    def _activity_key(activity_data: dict) -> Hashable:
+        """
+        :return: The intern key for an activity, made of the fields the activity is created from.
+        """
+        emoji = activity_data.get("emoji") or {}
+        key = (
+            activity_data.get("type", 0),
+            activity_data.get("name"),
+            activity_data.get("url"),
+            activity_data.get("state"),
+            emoji.get("id"),
+            emoji.get("name"),
+            emoji.get("animated", False),
+        )
+        if "application_id" not in activity_data:
+            return key
+
+        timestamps = activity_data.get("timestamps") or {}
+        party = activity_data.get("party") or {}
+        assets = activity_data.get("assets") or {}
+        secrets = activity_data.get("secrets") or {}
+        size = party.get("size")
+        return key + (
+            activity_data["application_id"],
+            activity_data.get("details"),
+            activity_data.get("instanced", False),
+            timestamps.get("start"),
+            timestamps.get("end"),
+            party.get("id"),
+            tuple(size) if size is not None else None,
+            assets.get("large_image"),
+            assets.get("large_text"),
+            assets.get("small_image"),
+            assets.get("small_text"),
+            secrets.get("join"),
+            secrets.get("spectate"),
+            secrets.get("match"),
+        )
+
+    def _make_activity(self, activity_data: dict) -> Union[BasicActivity, RichActivity]:
+        """
+        Creates an activity, shared with other presences that have the same activity.
+        """
+
+        def factory():
+            if "application_id" in activity_data:
+                return RichActivity(**activity_data)
+
+            return BasicActivity(**activity_data)
+
+        try:
+            key = self._activity_key(activity_data)
+            hash(key)
+        except (AttributeError, TypeError):
+            # malformed (e.g. an unhashable field), so it can't be interned
+            return factory()
+
+        return self._activities.get(key, factory)
+
+    def make_presence(self, presence_data: dict) -> Presence:
+        """
+        Creates a presence, shared with other members that have the same presence.
+
+        The presence returned must not be modified.
+
+        :param presence_data: The presence data to use, e.g. a PRESENCE_UPDATE.
+        :return: A :class:`.Presence` for the presence data.
+        """
+        status = presence_data.get("status", Status.OFFLINE.value)
+        game = presence_data.get("game")
+        client_status = presence_data.get("client_status") or {}
+        activities = presence_data.get("activities") or []
+
+        def factory():
+            presence = Presence(status=status, client_status=client_status)
+            if game:
+                presence.game = self._make_activity(game)
+
+            presence.activities = [self._make_activity(activity) for activity in activities]
+            return presence
+
+        try:
+            key = (
+                status,
+                self._activity_key(game) if game else None,
+                client_status.get("desktop"),
+                client_status.get("mobile"),
+                client_status.get("web"),
+                tuple(self._activity_key(activity) for activity in activities),
+            )
+            hash(key)
+        except (AttributeError, TypeError):
+            return factory()
+
+        return self._presences.get(key, factory)
+
     def make_user(
         self, user_data: dict, *, user_klass: Type[UserType] = User, override_cache: bool = False
     ) -> UserType:
@@ -308,6 +912,9 @@ class State(object):
             return self._users[id]
 
         user = user_klass(**user_data)
+        if user.id not in self._users:
+            self._user_stats.created += 1
+
         self._users[user.id] = user
 
         return user
@@ -320,12 +927,14 @@ class State(object):
         :param cache: Should this message be cached?
         :return: A new :class:`.Message` object for the message.
         """
-        message = Message(**event_data)
-
-        if message in self.messages and cache is True:
+        if cache is True:
             # don't bother re-caching
-            i = self.messages.index(message)
-            return self.messages[i]
+            # (this doesn't go through get(), as new messages would all count as misses)
+            message_id = int(event_data.get("id", 0))
+            if message_id in self.messages:
+                return self.messages[message_id]
+
+        message = Message(**event_data)
 
         # discord won't give us the Guild id
         # so we have to search it from the channels
@@ -353,7 +962,11 @@ class State(object):
             if event_data.get("webhook_id") is not None:
                 message.author = self.make_webhook(event_data)
             else:
-                message.author = message.guild.members.get(author_id)
+                member_data = event_data.get("member")
+                if member_data is not None and "author" in event_data:
+                    member_data = {**member_data, "user": event_data["author"]}
+
+                message.author = self._get_or_make_member(message.guild, author_id, member_data)
 
         for reaction_data in event_data.get("reactions", []):
             emoji = reaction_data.get("emoji", {})
@@ -369,11 +982,18 @@ class State(object):
             reaction.emoji = emoji_obb
             message.reactions.append(reaction)
 
-        if cache and message not in self.messages:
-            self.messages.append(message)
+        if cache:
+            self.messages.add(message, channel.type)
 
         return message
 
+    def _cache_message(self, message: Message) -> None:
+        """
+        Adds a message to the message cache, using the retention policy for its channel.
+        """
+        channel = self.find_channel(message.channel_id)
+        self.messages.add(message, channel.type if channel is not None else None)
+
     # ==============================================================================================
     # Event handlers.
     # These parse the events and deconstruct them.
@@ -401,6 +1021,8 @@ class State(object):
             self._guilds[new_guild.id] = new_guild
             new_guild.from_guild_create(**guild)
             new_guild.shard_id = shard_id
+            self._index_guild_channels(new_guild)
+            self._index_members(new_guild, new_guild._members)
 
         logger.info(
             "Ready processed for shard {}. Delaying until all guilds are chunked.".format(shard_id)
@@ -427,6 +1049,7 @@ class State(object):
         self._user.username = event_data.get("username", self._user.username)
         self._user.discriminator = event_data.get("discriminator", self._user.discriminator)
         self._user.avatar_hash = event_data.get("avatar", self._user.avatar_hash)
+        self._reindex_member_names(self._user.id)
 
         yield "user_update",
 
@@ -464,46 +1087,55 @@ class State(object):
             member = Member(user=event_data["user"])
             member.guild_id = guild.id
             old_member = None
-        else:
+        elif self._fires("PRESENCE_UPDATE", "presence_update"):
             old_member = member._copy()
-
-        # Update the member's presence
-        member.presence = Presence(
-            status=event_data.get("status"),
-            game=event_data.get("game", {}),
-            client_status=event_data.get("client_status", {}),
-        )
-
-        # copy the roles if it exists
-        if old_member is not None:
-            fallback = old_member.role_ids
         else:
-            fallback = None
+            # nothing will see the old member
+            old_member = None
+
+        presence = self.make_presence(event_data)
 
-        roles = event_data.get("roles", fallback)
+        roles = event_data.get("roles")
         if roles:
             # clear roles
             member.role_ids = [int(rid) for rid in roles]
 
         # update the nickname
-        if old_member is not None:
-            fallback = old_member.nickname.value
-        else:
-            fallback = None
-
-        member.nickname = event_data.get("nick", fallback)
+        member.nickname = event_data.get("nick", member.nickname.value)
         # recreate the user object, so the user is properly cached
         if "username" in event_data["user"]:
-            self.make_user(event_data["user"], override_cache=True)
+            member._user = self.make_user(event_data["user"], override_cache=True)
+
+        self._reindex_member_names(user_id)
 
         # Note: Usually, when a member has a change that we need to cache, we get sent a
         # GUILD_MEMBER_UPDATE packet.
         # However, sometimes Discord might not send it to us. So we always update.
         # We might get PRESENCE_UPDATE events for members that recently left the guild though,
-        # so we must ensure we only update, not add a member
+        # so we must ensure we only update, not add a member, unless we only cache online members
+        policy = self.cache_policy
+        online = presence.status not in (None, Status.OFFLINE)
         if user_id in guild._members:
+            if policy.online_members_only and not online and user_id != self._user.id:
+                self._remove_cached_member(guild, user_id)
+            else:
+                guild._members[user_id] = member
+                self._touch_member(guild, user_id)
+        elif policy.online_members_only and online:
             guild._members[user_id] = member
+            self._index_members(guild, (user_id,))
+        else:
+            # the user was only cached for the temporary member
+            self._check_decache_user(user_id)
 
+        if not policy.presences and user_id in guild._members:
+            if not self._fires("PRESENCE_UPDATE", "presence_update"):
+                return
+
+            # only the member passed to the event gets the presence
+            member = member._copy()
+
+        member.presence = presence
         yield "presence_update", old_member, member,
 
     async def handle_presences_replace(self, event_data: dict):
@@ -527,7 +1159,9 @@ class State(object):
             "on shard {}".format(len(members), guild.name or guild.id, guild.shard_id)
         )
 
-        guild._handle_member_chunk(event_data.get("members"))
+        members = self._filter_members(members, event_data.get("presences", []))
+        guild._handle_member_chunk(members)
+        self._index_members(guild, (int(member["user"]["id"]) for member in members))
         yield "guild_chunk", guild, len(members),
 
         if guild._chunks_left <= 0:
@@ -540,9 +1174,12 @@ class State(object):
         """
         id = int(event_data.get("id", 0))
         guild = self._guilds.get(id)
+        event_data = self._filter_guild_create(event_data)
 
         had_guild = True
         if guild:
+            # the new payload replaces the channels, so drop the old ones from the index
+            self._unindex_guild_channels(guild)
             guild.from_guild_create(**event_data)
         else:
             had_guild = False
@@ -550,8 +1187,17 @@ class State(object):
             self._guilds[guild.id] = guild
             guild.from_guild_create(**event_data)
 
+        self._index_guild_channels(guild)
+        self._index_members(guild, guild._members)
+
         current_shard = _current_shard.get()
         guild.shard_id = current_shard
+
+        if guild.large and (
+            not self.intents & GatewayIntent.GUILD_MEMBERS or not self.cache_policy.chunk_members
+        ):
+            # we can't (or won't) request members, so don't make the chunker wait on them
+            await guild._finished_chunking.set()
         # TODO: Need to do this
         # try:
         #    guild.me.presence.game = gw.game
@@ -569,6 +1215,7 @@ class State(object):
                 # Hence, we fire a `guild_join` event.
                 # Parse the guild.
                 guild.from_guild_create(**event_data)
+                self._index_guild_channels(guild)
                 yield "guild_join", guild,
 
                 logger.info(
@@ -596,8 +1243,7 @@ class State(object):
         if not guild:
             return
 
-        # disable dataclass checking temporarily
-        old_guild = copy.copy(guild)
+        old_guild = copy.copy(guild) if self._fires("GUILD_UPDATE", "guild_update") else None
 
         guild.unavailable = event_data.get("unavailable", False)
         guild.name = event_data.get("name", guild.name)
@@ -650,10 +1296,14 @@ class State(object):
             # We've left this guild - clear it from our dictionary of guilds.
             guild = self._guilds.pop(guild_id, None)
             if guild:
+                self._unindex_guild_channels(guild)
+                for channel_id in guild._channels:
+                    self.messages.drop_channel(channel_id)
+
+                for member_id in guild._members:
+                    self._unindex_member(guild, member_id)
+
                 yield "guild_leave", guild,
-                for member in guild._members.values():
-                    # use member.id to avoid user lookup
-                    self._check_decache_user(member.id)
 
     async def handle_guild_emojis_update(self, event_data: dict):
         """
@@ -665,9 +1315,14 @@ class State(object):
         if not guild:
             return
 
-        old_guild = guild._copy()
-        emojis = event_data.get("emojis", [])
-        guild._handle_emojis(emojis)
+        if self._fires("GUILD_EMOJIS_UPDATE", "guild_emojis_update"):
+            old_guild = guild._copy()
+        else:
+            old_guild = None
+
+        if self.cache_policy.emojis:
+            emojis = event_data.get("emojis", [])
+            guild._handle_emojis(emojis)
 
         yield "guild_emojis_update", old_guild, guild,
 
@@ -712,8 +1367,7 @@ class State(object):
         new_message._mentions = event_data.get("mentions", old_message._mentions)
         new_message._role_mentions = event_data.get("mention_roles", old_message._role_mentions)
 
-        self.messages.remove(old_message)
-        self.messages.append(new_message)
+        self._cache_message(new_message)
 
         if old_message.content != new_message.content:
             # Fire a message_edit, as well as a message_update, because the content differs.
@@ -885,7 +1539,13 @@ class State(object):
         member = Member(**event_data)
         member.guild_id = guild.id
 
-        guild._members[member.id] = member
+        if self.cache_policy.chunk_members:
+            guild._members[member.id] = member
+            self._index_members(guild, (member.id,))
+        else:
+            # the user was only cached for the temporary member
+            self._check_decache_user(member.id)
+
         guild.member_count += 1
         yield "guild_member_add", member,
 
@@ -900,7 +1560,7 @@ class State(object):
             return
 
         member_id = int(event_data["user"]["id"])
-        member = guild._members.pop(member_id, None)
+        member = self._remove_cached_member(guild, member_id)
 
         guild.member_count -= 1
         if not member:
@@ -925,15 +1585,20 @@ class State(object):
         if not member:
             return
 
+        self._touch_member(guild, member_id)
         # Make a copy of the member for the old previous reference.
-        old_member = member._copy()
+        if self._fires("GUILD_MEMBER_UPDATE", "guild_member_update"):
+            old_member = member._copy()
+        else:
+            old_member = None
+
         # Re-create the user object.
         # self.make_user(event_data["user"], override_cache=True)
         # self._users[member.user.id] = member.user
         user = event_data.get("user")
         if user:
             # remake user object
-            self.make_user(user, override_cache=True)
+            member._user = self.make_user(user, override_cache=True)
             self._check_decache_user(member_id)
 
         # Overwrite roles, we want to get rid of any roles that are stale.
@@ -942,6 +1607,7 @@ class State(object):
 
         guild._members[member.id] = member
         member.nickname = event_data.get("nick", member.nickname.value)
+        self._reindex_member_names(member_id)
 
         yield "guild_member_update", old_member, member,
 
@@ -961,6 +1627,7 @@ class State(object):
         if not member:
             # Dispatch to `user_ban` instead of `member_ban`.
             user = self.make_user(event_data["user"])
+            self._check_decache_user(user.id)
             yield "user_ban", guild, user,
             return
 
@@ -977,6 +1644,7 @@ class State(object):
             return
 
         user = self.make_user(event_data["user"])
+        self._check_decache_user(user.id)
         yield "user_unban", guild, user,
 
     async def handle_channel_create(self, event_data: dict):
@@ -988,7 +1656,7 @@ class State(object):
 
         channel = Channel(**event_data)
         if channel.private:
-            self._private_channels[channel.id] = channel
+            self._add_private_channel(channel)
         else:
             channel.guild_id = guild.id
             channel._update_overwrites((event_data.get("permission_overwrites", [])))
@@ -997,6 +1665,8 @@ class State(object):
             else:
                 channel = guild._channels[channel.id]
 
+            self._channels[channel.id] = channel
+
         yield "channel_create", channel,
 
     async def handle_channel_update(self, event_data: dict):
@@ -1009,7 +1679,7 @@ class State(object):
         if not channel:
             return
 
-        old_channel = channel._copy()
+        old_channel = channel._copy() if self._fires("CHANNEL_UPDATE", "channel_update") else None
 
         channel.name = event_data.get("name", channel.name)
         channel.position = event_data.get("position", channel.position)
@@ -1034,9 +1704,12 @@ class State(object):
             return
 
         if channel.private:
-            del self._private_channels[channel.id]
+            self._remove_private_channel(channel.id)
         else:
             del channel.guild._channels[channel.id]
+            self._channels.pop(channel.id, None)
+
+        self.messages.drop_channel(channel.id)
 
         yield "channel_delete", channel,
 
@@ -1062,6 +1735,7 @@ class State(object):
             role = Role(**role_data)
             role.guild_id = guild.id
             guild._roles[role_id] = role
+            guild._roles_changed()
         else:
             # thinking
             role = guild._roles[role_id]
@@ -1090,7 +1764,7 @@ class State(object):
         if not role:
             return
 
-        old_role = role._copy()
+        old_role = role._copy() if self._fires("GUILD_ROLE_UPDATE", "guild_role_update") else None
 
         # Update all the fields on the role.
         event_data = event_data.get("role", {})
@@ -1101,6 +1775,7 @@ class State(object):
         role.mentionable = event_data.get("mentionable")
         role.managed = event_data.get("managed")
         role.permissions = Permissions(event_data.get("permissions", 0))
+        guild._roles_changed()
 
         yield "guild_role_update", old_role, role,
 
@@ -1118,12 +1793,10 @@ class State(object):
         if not role:
             return
 
+        guild._roles_changed()
+
         # Remove the role from all members.
-        for member in guild.members.values():
-            try:
-                member.role_ids.remove(role.id)
-            except ValueError:
-                continue
+        guild._members.remove_role(role.id)
 
         yield "guild_role_delete", role,
 
@@ -1139,7 +1812,7 @@ class State(object):
             return
 
         if not channel.private:
-            member = channel.guild.members.get(user_id)
+            member = self._get_or_make_member(channel.guild, user_id, event_data.get("member"))
             if not member:
                 return
             yield "guild_member_typing", channel, member,
@@ -1166,7 +1839,7 @@ class State(object):
         if not guild:
             return
 
-        member = guild.members.get(user_id)
+        member = self._get_or_make_member(guild, user_id, event_data.get("member"))
         if not member:
             return
 
@@ -1180,7 +1853,7 @@ class State(object):
 
         # copy the voice states
         old_voice_state = guild._voice_states.pop(user_id, None)
-        if new_voice_state is not None:
+        if new_voice_state is not None and self.cache_policy.voice_states:
             guild._voice_states[new_voice_state.user_id] = new_voice_state
 
         yield "voice_state_update", member, old_voice_state, new_voice_state,
@@ -1201,16 +1874,17 @@ class State(object):
         """
         Called when a recipient is added to a channel.
         """
-        user = event_data.get("user", {})
         id = int(event_data.get("channel_id", 0))
-
-        user = self._users.get(int(user.get("id", 0)))
+        user = self.make_user(event_data.get("user", {}))
 
         channel = self.find_channel(channel_id=id)
         if channel is None:
+            self._check_decache_user(user.id)
             return
 
-        channel._recipients[user.id] = user
+        if user.id not in channel._recipients:
+            channel._recipients[user.id] = user
+            self._ref_user(user.id)
 
         yield "group_user_add", channel, user,
 
@@ -1218,14 +1892,14 @@ class State(object):
         """
         Called when a recipient is removed a channel.
         """
-        user = event_data.get("user", {})
+        user_id = int(event_data.get("user", {}).get("id", 0))
         id = int(event_data.get("channel_id", 0))
 
-        user = self._users.get(int(user.get("id", 0)))
         channel = self.find_channel(channel_id=id)
         if channel is None:
             return
 
-        if user in channel.recipients.values():
-            channel._recipients.pop(user.id, None)
+        user = channel._recipients.pop(user_id, None)
+        if user is not None:
+            self._unref_user(user_id)
             yield "group_user_remove", channel, user,
@@ -37,6 +37,7 @@ from typing import (
     List,
     Mapping,
     Optional,
+    Tuple,
     Union,
 )
 
@@ -676,6 +677,11 @@ class Channel(Dataclass):
         #: The internal overwrites for this channel.
         self._overwrites: Dict[int, dt_permissions.Overwrite] = {}
 
+        # role IDs -> the permissions bitfield before member overwrites, or None for admins
+        self._permissions_cache: Dict[Tuple[int, ...], Optional[int]] = {}
+        # the role version of the guild the permissions cache was filled at
+        self._permissions_version: Optional[int] = None
+
     def __repr__(self) -> str:
         return (
             f"<Channel id={self.id} name={self.name} type={self.type.name} "
@@ -694,6 +700,7 @@ class Channel(Dataclass):
             raise CuriousError("A channel without a guild cannot have overwrites")
 
         self._overwrites = {}
+        self._permissions_cache.clear()
 
         for overwrite in overwrites:
             id_ = int(overwrite["id"])
@@ -854,42 +861,73 @@ class Channel(Dataclass):
         """
         return MappingProxyType(self._overwrites)
 
-    def effective_permissions(self, member: "dt_member.Member") -> "dt_permissions.Permissions":
-        """
-        Gets the effective permissions for the given member.
-        """
-        if not self.guild:
-            return dt_permissions.Permissions(515136)
+    #: The maximum number of distinct role ID combinations that have their permissions cached.
+    MAX_PERMISSIONS_CACHE = 4096
 
-        permissions = dt_permissions.Permissions(self.guild.default_role.permissions.bitfield)
-
-        for role in member.roles:
-            permissions.bitfield |= role.permissions.bitfield
+    def _role_permissions(
+        self, guild: "dt_guild.Guild", role_ids: Tuple[int, ...]
+    ) -> Optional[int]:
+        """
+        Calculates the permissions granted by some role IDs in this channel, including the role
+        overwrites.
 
+        :return: The permissions bitfield, or None if the roles grant administrator.
+        """
+        permissions = dt_permissions.Permissions(guild._get_role_permissions(role_ids))
         if permissions.administrator:
-            return dt_permissions.Permissions.all()
+            return None
 
-        overwrites_everyone = self._overwrites.get(self.guild.default_role.id)
+        bitfield = permissions.bitfield
+        overwrites_everyone = self._overwrites.get(guild.default_role.id)
         if overwrites_everyone:
-            permissions.bitfield &= ~overwrites_everyone.deny.bitfield
-            permissions.bitfield |= overwrites_everyone.allow.bitfield
+            bitfield &= ~overwrites_everyone.deny.bitfield
+            bitfield |= overwrites_everyone.allow.bitfield
 
         allow = deny = 0
-        for role in member.roles:
+        for role in guild._get_sorted_roles(role_ids):
             overwrite = self._overwrites.get(role.id)
             if overwrite:
                 allow |= overwrite.allow.bitfield
                 deny |= overwrite.deny.bitfield
 
-        permissions.bitfield &= ~deny
-        permissions.bitfield |= allow
+        bitfield &= ~deny
+        bitfield |= allow
+        return bitfield
+
+    def effective_permissions(self, member: "dt_member.Member") -> "dt_permissions.Permissions":
+        """
+        Gets the effective permissions for the given member.
+
+        The permissions granted by the member's roles are cached until the roles of the guild
+        or the overwrites of this channel change.
+        """
+        guild = self.guild
+        if not guild:
+            return dt_permissions.Permissions(515136)
+
+        if self._permissions_version != guild._role_version:
+            self._permissions_cache.clear()
+            self._permissions_version = guild._role_version
+
+        role_ids = member.role_ids
+        try:
+            bitfield = self._permissions_cache[role_ids]
+        except KeyError:
+            bitfield = self._role_permissions(guild, role_ids)
+            if len(self._permissions_cache) >= self.MAX_PERMISSIONS_CACHE:
+                self._permissions_cache.clear()
+
+            self._permissions_cache[role_ids] = bitfield
+
+        if bitfield is None:
+            return dt_permissions.Permissions.all()
 
         overwrite_member = self._overwrites.get(member.id)
         if overwrite_member:
-            permissions.bitfield &= ~overwrite_member.deny.bitfield
-            permissions.bitfield |= overwrite_member.allow.bitfield
+            bitfield &= ~overwrite_member.deny.bitfield
+            bitfield |= overwrite_member.allow.bitfield
 
-        return permissions
+        return dt_permissions.Permissions(bitfield)
 
     def permissions(
         self, obb: "Optional[Union[dt_member.Member, dt_role.Role]]"
@@ -940,6 +978,7 @@ class Channel(Dataclass):
         obb = copy.copy(self)
         obb._messages = ChannelMessageWrapper(obb)
         obb._overwrites = self._overwrites.copy()
+        obb._permissions_cache = {}
         return obb
 
     @deprecated(since="0.7.0", see_instead="Channel.messages.get_history", removal="0.9.0")
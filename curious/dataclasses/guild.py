@@ -60,7 +60,7 @@ from curious.dataclasses import (
     webhook as dt_webhook,
 )
 from curious.dataclasses.bases import Dataclass
-from curious.dataclasses.presence import Presence, Status
+from curious.dataclasses.presence import Status
 from curious.exc import CuriousError, HTTPException, HierarchyError, PermissionsError
 from curious.util import AsyncIteratorWrapper, base64ify, deprecated
 
@@ -463,6 +463,7 @@ class GuildRoleWrapper(_WrapperBase):
 
         role_obb = dt_role.Role(**(await get_current_client().http.create_role(self._guild.id)))
         self._guild._roles[role_obb.id] = role_obb
+        self._guild._roles_changed()
         role_obb.guild_id = self._guild.id
         return await role_obb.edit(**kwargs)
 
@@ -710,6 +711,9 @@ class Guild(Dataclass):
         "features",
         "shard_id",
         "_roles",
+        "_role_version",
+        "_sorted_roles",
+        "_role_permissions",
         "_members",
         "_channels",
         "_emojis",
@@ -794,8 +798,14 @@ class Guild(Dataclass):
 
         #: The roles that this guild has.
         self._roles = {}
+        #: A counter bumped every time a role is created, updated or deleted.
+        self._role_version = 0
+        # role IDs -> the sorted roles, for members with those role IDs
+        self._sorted_roles = {}  # type: Dict[Tuple[int, ...], Tuple[dt_role.Role, ...]]
+        # role IDs -> the guild permissions bitfield, for members with those role IDs
+        self._role_permissions = {}  # type: Dict[Tuple[int, ...], int]
         #: The members of this guild.
-        self._members = {}
+        self._members = dt_member.MemberMap(self.id)
         #: The channels of this guild.
         self._channels = {}
         #: The emojis that this guild has.
@@ -840,6 +850,8 @@ class Guild(Dataclass):
         obb.bans = GuildRoleWrapper(obb)
         obb._channels = self._channels.copy()
         obb._roles = self._roles.copy()
+        obb._sorted_roles = {}
+        obb._role_permissions = {}
         obb._emojis = self._roles.copy()
         obb._members = self._members.copy()
         obb._voice_states = self._voice_states.copy()
@@ -998,6 +1010,9 @@ class Guild(Dataclass):
             Using a username and discriminator pair is most accurate when finding a user; a
             nickname pair or not providing one of the arguments might not find the right member.
 
+        If several members match the name, a member whose username matches is returned over a
+        member whose nickname matches, and otherwise the member with the lowest ID is returned.
+
         :return: A :class:`.Member` that matched, or None if no matches were found.
         """
         if full_name is not None:
@@ -1012,16 +1027,35 @@ class Guild(Dataclass):
         if isinstance(discriminator, int):
             discriminator = "{:04d}".format(discriminator)
 
-        for member in self._members.values():
-            # ensure discrim matches first
-            if discriminator is not None and discriminator != member.user.discriminator:
-                continue
+        if name is None:
+            # no name to look up, so only the discriminator (and lack of nickname) can match
+            for member in self._members.values():
+                if discriminator is not None and discriminator != member.user.discriminator:
+                    continue
+
+                if member.nickname == name:
+                    return member
 
+            return None
+
+        found = self._members.find_by_name(name, discriminator)
+        # prefer username matches over nickname matches
+        for member in found:
             if member.user.username == name:
                 return member
 
-            if member.nickname == name:
-                return member
+        return next(iter(found), None)
+
+    def search_members(self, prefix: str, *, limit: int = None) -> "List[dt_member.Member]":
+        """
+        Searches for members with a username or nickname starting with a prefix.
+        The search is case-insensitive.
+
+        :param prefix: The start of the username or nickname to search for.
+        :param limit: The maximum number of members to return.
+        :return: A list of :class:`.Member` that matched.
+        """
+        return self._members.find_by_prefix(prefix, limit=limit)
 
     @deprecated(since="0.7.0", see_instead=search_for_member, removal="0.9.0")
     def find_member(self, search_str: str) -> "dt_member.Member":
@@ -1038,16 +1072,68 @@ class Guild(Dataclass):
         sp = search_str.rsplit("#", 1)
         if len(sp) == 1:
             # Member name only :(
-            predicate = lambda member: member.user.name == sp[0] or member.nickname == sp[0]
-        else:
-            # Discriminator too!
-            # Don't check nicknames for this.
-            predicate = (
-                lambda member: member.user.name == sp[0] and member.user.discriminator == sp[1]
-            )
+            return next(iter(self._members.find_by_name(sp[0])), None)
+
+        # Discriminator too!
+        # Don't check nicknames for this.
+        found = self._members.find_by_name(sp[0], discriminator=sp[1])
+        return next((member for member in found if member.user.name == sp[0]), None)
+
+    #: The maximum number of distinct role ID combinations that have their sorted roles cached.
+    MAX_SORTED_ROLES = 4096
+
+    def _roles_changed(self) -> None:
+        """
+        Marks that the roles of this guild changed, invalidating the sorted role cache.
+        """
+        self._role_version += 1
+        self._sorted_roles.clear()
+        self._role_permissions.clear()
+
+    def _get_sorted_roles(self, role_ids: Tuple[int, ...]) -> "Tuple[dt_role.Role, ...]":
+        """
+        Gets the roles for some role IDs, sorted from highest to lowest.
+
+        The result is cached until the roles of this guild change.
+
+        :param role_ids: The tuple of role IDs, e.g. :attr:`.Member.role_ids`.
+        """
+        try:
+            return self._sorted_roles[role_ids]
+        except KeyError:
+            pass
+
+        roles = filter(lambda r: r is not None, map(self._roles.get, role_ids))
+        sorted_roles = tuple(sorted(roles, reverse=True))
+
+        if len(self._sorted_roles) >= self.MAX_SORTED_ROLES:
+            self._sorted_roles.clear()
+
+        self._sorted_roles[role_ids] = sorted_roles
+        return sorted_roles
+
+    def _get_role_permissions(self, role_ids: Tuple[int, ...]) -> int:
+        """
+        Gets the guild permissions bitfield granted by some role IDs, and the default role.
+
+        The result is cached until the roles of this guild change.
+
+        :param role_ids: The tuple of role IDs, e.g. :attr:`.Member.role_ids`.
+        """
+        try:
+            return self._role_permissions[role_ids]
+        except KeyError:
+            pass
 
-        filtered = filter(predicate, self.members.values())
-        return next(filtered, None)
+        bitfield = self.default_role.permissions.bitfield
+        for role in self._get_sorted_roles(role_ids):
+            bitfield |= role.permissions.bitfield
+
+        if len(self._role_permissions) >= self.MAX_SORTED_ROLES:
+            self._role_permissions.clear()
+
+        self._role_permissions[role_ids] = bitfield
+        return bitfield
 
     # creation methods
     def start_chunking(self) -> None:
@@ -1077,6 +1163,12 @@ class Guild(Dataclass):
             # We have a new chunk, so decrement the number left.
             self._chunks_left -= 1
 
+        if get_current_client().state.cache_policy.lazy_members:
+            for member_data in members:
+                self._members.add_record(member_data)
+
+            return
+
         for member_data in members:
             member_id = int(member_data["user"]["id"])
             if member_id in self._members:
@@ -1087,6 +1179,7 @@ class Guild(Dataclass):
 
             member_obj.nickname = member_data.get("nick", member_obj.nickname)
             member_obj.guild_id = self.id
+            self._members.reindex(member_id)
 
     def from_guild_create(self, **data: dict) -> "Guild":
         """
@@ -1131,19 +1224,24 @@ class Guild(Dataclass):
             role_obj.guild_id = self.id
             self._roles[role_obj.id] = role_obj
 
+        self._roles_changed()
+
         # Create all the Member objects for the server.
         self._handle_member_chunk(data.get("members", []))
 
+        state = get_current_client().state
         for presence in data.get("presences", []):
             member_id = int(presence["user"]["id"])
-            member_obj = self._members.get(member_id)
-
-            if not member_obj:
+            if member_id not in self._members:
                 continue
 
-            member_obj.presence = Presence(**presence)
+            self._members.set_presence(member_id, state.make_presence(presence))
 
         # Create all of the channel objects.
+        # This replaces the old channels, as some may have been deleted whilst we were away.
+        if "channels" in data:
+            self._channels.clear()
+
         for channel_data in data.get("channels", []):
             channel_obj = dt_channel.Channel(**channel_data)
             self._channels[channel_obj.id] = channel_obj
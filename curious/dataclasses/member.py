@@ -18,10 +18,11 @@ Wrappers for Member objects (Users with guilds).
 
 .. currentmodule:: curious.dataclasses.member
 """
+import bisect
 import collections
 import copy
 import datetime
-from typing import List, Optional, Union
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
 
 from curious.core import get_current_client
 from curious.dataclasses import (
@@ -36,6 +37,34 @@ from curious.dataclasses.presence import BasicActivity, Presence, RichActivity,
 from curious.exc import HierarchyError, PermissionsError
 from curious.util import to_datetime
 
+#: The maximum number of distinct role ID tuples that are interned.
+MAX_INTERNED_ROLE_IDS = 65536
+
+# role ID tuple -> the shared instance of that tuple
+_interned_role_ids = {}  # type: Dict[Tuple[int, ...], Tuple[int, ...]]
+
+# the presence of members without one, shared as presences are replaced rather than mutated
+_offline_presence = Presence(status=Status.OFFLINE)
+
+
+def _intern_role_ids(role_ids: Iterable[int]) -> Tuple[int, ...]:
+    """
+    Gets a sorted tuple of role IDs, shared with other members that have the same roles.
+    """
+    role_ids = tuple(sorted(role_ids))
+    if not role_ids:
+        return ()
+
+    try:
+        return _interned_role_ids[role_ids]
+    except KeyError:
+        pass
+
+    if len(_interned_role_ids) < MAX_INTERNED_ROLE_IDS:
+        _interned_role_ids[role_ids] = role_ids
+
+    return role_ids
+
 
 class Nickname(object):
     """
@@ -129,18 +158,15 @@ class MemberRoleContainer(collections.Sequence):
     def __init__(self, member: "Member"):
         self._member = member
 
-    def _sorted_roles(self) -> "List[dt_role.Role]":
-        if not self._member.guild:
-            return []
+    def _sorted_roles(self) -> "Tuple[dt_role.Role, ...]":
+        guild = self._member.guild
+        if not guild:
+            return ()
 
-        roles = filter(
-            lambda r: r is not None, map(self._member.guild.roles.get, self._member.role_ids)
-        )
+        # cached by the guild until its roles change
+        return guild._get_sorted_roles(self._member.role_ids)
 
-        return sorted(roles, reverse=True)
-
-    # opt: the default Sequence makes us re-create the sorted role list constantly
-    # we don't wanna cache it, without introducing invalidation hell
+    # opt: the default Sequence would index into the sorted roles one at a time
     # so we just put `__iter__` on `_sorted_roles`
     def __iter__(self) -> type(iter([])):
         return iter(self._sorted_roles())
@@ -240,45 +266,64 @@ class MemberRoleContainer(collections.Sequence):
 class Member(Dataclass):
     """
     A member represents somebody who is inside a guild.
+
+    Members are kept compact, as there can be millions of them: the role IDs are an interned
+    tuple, the user is shared with the user cache, and the nickname and role wrappers are created
+    on access.
     """
 
     __slots__ = (
-        "_user_data",
-        "role_ids",
+        "_user",
+        "_role_ids",
         "joined_at",
-        "_nickname",
+        "_nick",
         "guild_id",
         "presence",
-        "roles",
     )
 
     def __init__(self, **kwargs):
         super().__init__(kwargs["user"]["id"])
 
-        # copy user data for when the user is decached
-        self._user_data = kwargs["user"]
-        get_current_client().state.make_user(self._user_data)
+        state = get_current_client().state
 
-        #: An iterable of role IDs this member has.
-        self.role_ids = [int(rid) for rid in kwargs.get("roles", [])]
+        # keep the user for when the user is decached
+        self._user = state.make_user(kwargs["user"])  # type: dt_user.User
 
-        #: A :class:`._MemberRoleContainer` that represents the roles of this member.
-        self.roles = MemberRoleContainer(self)
+        self._role_ids = _intern_role_ids(int(rid) for rid in kwargs.get("roles", []))
 
         #: The date the user joined the guild.
         self.joined_at = to_datetime(kwargs.get("joined_at", None))  # type: datetime.datetime
 
-        nick = kwargs.get("nick")
-        #: The member's current :class:`.Nickname`.
-        self._nickname = Nickname(self, nick)  # type: Nickname
+        self._nick = kwargs.get("nick")  # type: Optional[str]
 
         #: The ID of the guild that this member is in.
         self.guild_id = None  # type: int
 
         #: The current :class:`.Presence` of this member.
-        self.presence = Presence(
-            status=kwargs.get("status", Status.OFFLINE), game=kwargs.get("game", None)
-        )
+        #: Presences are shared, so this should be replaced rather than modified.
+        if "status" in kwargs or "game" in kwargs:
+            self.presence = state.make_presence(kwargs)
+        else:
+            self.presence = _offline_presence
+
+    @property
+    def role_ids(self) -> Tuple[int, ...]:
+        """
+        :getter: A sorted tuple of the IDs of the roles this member has.
+        :setter: Sets the role IDs of this member, from any iterable of IDs.
+        """
+        return self._role_ids
+
+    @role_ids.setter
+    def role_ids(self, value: Iterable[int]):
+        self._role_ids = _intern_role_ids(value)
+
+    @property
+    def roles(self) -> MemberRoleContainer:
+        """
+        :return: A :class:`.MemberRoleContainer` that represents the roles of this member.
+        """
+        return MemberRoleContainer(self)
 
     @property
     def guild(self) -> "dt_guild.Guild":
@@ -305,14 +350,14 @@ class Member(Dataclass):
         :getter: A :class:`._Nickname` for this member.
         :setter: Coerces a string nickname into a :class:`._Nickname`. Do not use.
         """
-        return self._nickname
+        return Nickname(self, self._nick)
 
     @nickname.setter
     def nickname(self, value: str):
         if isinstance(value, Nickname):
             # unwrap nicknames, in case of error
             value = value.value
-        self._nickname.value = value
+        self._nick = value
 
     def __hash__(self) -> int:
         return hash(self.guild_id) + hash(self.user.id)
@@ -327,19 +372,8 @@ class Member(Dataclass):
         """
         Copies a member object.
         """
-        new_object = copy.copy(self)
-        new_object.roles = MemberRoleContainer(new_object)
-        new_object.role_ids = self.role_ids.copy()
-        new_object._nickname = copy.copy(self._nickname)
-
-        return new_object
-
-    def __del__(self):
-        try:
-            get_current_client().state._check_decache_user(self.id)
-        except (AttributeError, LookupError):
-            # during shutdown
-            pass
+        # everything mutable is replaced rather than modified, so a shallow copy is enough
+        return copy.copy(self)
 
     @property
     def user(self) -> "dt_user.User":
@@ -349,8 +383,7 @@ class Member(Dataclass):
         try:
             return get_current_client().state._users[self.id]
         except KeyError:
-            # don't go through make_user as it'll cache it
-            return dt_user.User(**self._user_data)
+            return self._user
 
     @property
     def name(self) -> str:
@@ -417,16 +450,12 @@ class Member(Dataclass):
         """
         :return: The calculated guild permissions for a member.
         """
-        if self == self.guild.owner:
+        guild = self.guild
+        if self.id == guild.owner_id:
             return Permissions.all()
 
-        bitfield = 0
-        # add the default roles
-        bitfield |= self.guild.default_role.permissions.bitfield
-        for role in self.roles:
-            bitfield |= role.permissions.bitfield
-
-        permissions = Permissions(bitfield)
+        # includes the default role, and is cached by the guild until its roles change
+        permissions = Permissions(guild._get_role_permissions(self.role_ids))
         if permissions.administrator:
             return Permissions.all()
 
@@ -457,3 +486,344 @@ class Member(Dataclass):
         Kicks this member from the guild.
         """
         return await self.guild.kick(self)
+
+
+class _MemberRecord(NamedTuple):
+    """
+    The compact raw data of a member that hasn't been turned into a :class:`.Member` yet.
+    """
+
+    username: str
+    discriminator: str
+    avatar: Optional[str]
+    bot: bool
+    role_ids: Tuple[int, ...]
+    joined_at: Optional[str]
+    nick: Optional[str]
+    presence: Optional[Presence]
+
+
+class _MemberNameIndex(object):
+    """
+    An index of casefolded username and nickname -> member IDs, for a :class:`.MemberMap`.
+    """
+
+    __slots__ = ("_ids", "_keys", "_sorted")
+
+    def __init__(self):
+        # name -> member ID, or a set of member IDs if several members share the name
+        self._ids = {}  # type: Dict[str, Union[int, set]]
+
+        # member ID -> the (username, nickname) names the member is indexed under
+        self._keys = {}  # type: Dict[int, Tuple[str, Optional[str]]]
+
+        # the sorted names, for prefix searches; built on the first prefix search
+        self._sorted = None  # type: Optional[List[str]]
+
+    def _add_name(self, name: str, member_id: int) -> None:
+        existing = self._ids.get(name)
+        if existing is None:
+            self._ids[name] = member_id
+            if self._sorted is not None:
+                bisect.insort(self._sorted, name)
+        elif isinstance(existing, set):
+            existing.add(member_id)
+        elif existing != member_id:
+            self._ids[name] = {existing, member_id}
+
+    def _remove_name(self, name: str, member_id: int) -> None:
+        existing = self._ids.get(name)
+        if isinstance(existing, set):
+            existing.discard(member_id)
+            if len(existing) == 1:
+                self._ids[name] = next(iter(existing))
+
+        elif existing == member_id:
+            del self._ids[name]
+            if self._sorted is not None:
+                idx = bisect.bisect_left(self._sorted, name)
+                del self._sorted[idx]
+
+    def add(self, member_id: int, username: str, nickname: Optional[str]) -> None:
+        """
+        Indexes a member, replacing the names it was previously indexed under.
+        """
+        keys = (username.casefold(), nickname.casefold() if nickname else None)
+        old_keys = self._keys.get(member_id)
+        if old_keys == keys:
+            return
+
+        if old_keys is not None:
+            self.remove(member_id)
+
+        self._keys[member_id] = keys
+        for name in keys:
+            if name is not None:
+                self._add_name(name, member_id)
+
+    def remove(self, member_id: int) -> None:
+        """
+        Removes a member from the index.
+        """
+        keys = self._keys.pop(member_id, None)
+        if keys is None:
+            return
+
+        for name in keys:
+            if name is not None:
+                self._remove_name(name, member_id)
+
+    def get(self, name: str) -> List[int]:
+        """
+        :return: The IDs of the members with a username or nickname that casefolds to ``name``.
+        """
+        ids = self._ids.get(name.casefold())
+        if ids is None:
+            return []
+
+        if isinstance(ids, set):
+            return sorted(ids)
+
+        return [ids]
+
+    def prefix(self, prefix: str) -> Iterator[int]:
+        """
+        :return: The IDs of the members with a username or nickname starting with ``prefix``,
+            case-insensitively. Members may be yielded more than once.
+        """
+        if self._sorted is None:
+            self._sorted = sorted(self._ids)
+
+        prefix = prefix.casefold()
+        names = self._sorted
+        idx = bisect.bisect_left(names, prefix)
+        while idx < len(names) and names[idx].startswith(prefix):
+            ids = self._ids[names[idx]]
+            if isinstance(ids, set):
+                yield from sorted(ids)
+            else:
+                yield ids
+
+            idx += 1
+
+
+class MemberMap(collections.abc.MutableMapping):
+    """
+    A mapping of member ID -> :class:`.Member` for the members of a guild.
+
+    Members can be added as compact records of their raw data with :meth:`.MemberMap.add_record`,
+    which are only turned into :class:`.Member` objects (and cache their user) when they are first
+    accessed, by lookup or by iterating over the values.
+
+    Members can be searched by name with :meth:`.MemberMap.find_by_name` and
+    :meth:`.MemberMap.find_by_prefix`, which use an index built on the first search and kept up
+    to date afterwards.
+    """
+
+    __slots__ = ("_guild_id", "_entries", "_names")
+
+    def __init__(self, guild_id: int):
+        self._guild_id = guild_id
+
+        # member ID -> Member, or a _MemberRecord if the member hasn't been accessed yet
+        self._entries = {}  # type: Dict[int, Union[Member, _MemberRecord]]
+
+        # the name index, or None if nothing has been searched for yet
+        self._names = None  # type: Optional[_MemberNameIndex]
+
+    def _index_name(self, member_id: int, entry: "Union[Member, _MemberRecord]") -> None:
+        """
+        Adds a member to the name index.
+        """
+        if isinstance(entry, _MemberRecord):
+            # the record's username goes stale once the user is cached and renamed
+            user = get_current_client().state._users.get(member_id)
+            username = user.username if user is not None else entry.username
+            self._names.add(member_id, username, entry.nick)
+        else:
+            self._names.add(member_id, entry.user.username, entry._nick)
+
+    def _name_index(self) -> _MemberNameIndex:
+        """
+        Gets the name index, building it if this is the first search.
+        """
+        if self._names is None:
+            self._names = _MemberNameIndex()
+            for member_id, entry in self._entries.items():
+                self._index_name(member_id, entry)
+
+        return self._names
+
+    def reindex(self, member_id: int) -> None:
+        """
+        Updates the name index for a member, after its username or nickname changed.
+        """
+        if self._names is None:
+            return
+
+        entry = self._entries.get(member_id)
+        if entry is not None:
+            self._index_name(member_id, entry)
+
+    def find_by_name(self, name: str, discriminator: str = None) -> "List[Member]":
+        """
+        Finds members by their exact username or nickname.
+
+        :param name: The username or nickname of the member.
+        :param discriminator: If provided, the discriminator the member must have.
+        :return: A list of the :class:`.Member` objects that matched.
+        """
+        found = []
+        for member_id in self._name_index().get(name):
+            member = self[member_id]
+            user = member.user
+            if discriminator is not None and discriminator != user.discriminator:
+                continue
+
+            if user.username == name or member._nick == name:
+                found.append(member)
+
+        return found
+
+    def find_by_prefix(self, prefix: str, limit: int = None) -> "List[Member]":
+        """
+        Finds members with a username or nickname starting with ``prefix``, case-insensitively.
+
+        :param prefix: The start of the username or nickname.
+        :param limit: The maximum number of members to return.
+        :return: A list of the :class:`.Member` objects that matched.
+        """
+        found = []
+        seen = set()
+        for member_id in self._name_index().prefix(prefix):
+            if member_id in seen:
+                continue
+
+            seen.add(member_id)
+            found.append(self[member_id])
+            if limit is not None and len(found) >= limit:
+                break
+
+        return found
+
+    def _materialise(self, member_id: int, record: _MemberRecord) -> "Member":
+        """
+        Turns a member record into a :class:`.Member`.
+        """
+        user_data = {
+            "id": member_id,
+            "username": record.username,
+            "discriminator": record.discriminator,
+            "avatar": record.avatar,
+            "bot": record.bot,
+        }
+        member = Member(
+            user=user_data, roles=record.role_ids, joined_at=record.joined_at, nick=record.nick
+        )
+        member.guild_id = self._guild_id
+        if record.presence is not None:
+            member.presence = record.presence
+
+        # replacing an existing key is safe whilst iterating
+        self._entries[member_id] = member
+        if self._names is not None:
+            self._index_name(member_id, member)
+
+        return member
+
+    def add_record(self, member_data: dict) -> None:
+        """
+        Adds a member from its raw data, without creating a :class:`.Member`.
+
+        If the member is already cached, only the nickname is updated.
+
+        :param member_data: The member data dictionary, as returned from Discord.
+        """
+        user_data = member_data["user"]
+        member_id = int(user_data["id"])
+
+        existing = self._entries.get(member_id)
+        if isinstance(existing, Member):
+            existing.nickname = member_data.get("nick", existing.nickname.value)
+            self.reindex(member_id)
+            return
+
+        record = self._entries[member_id] = _MemberRecord(
+            username=user_data["username"],
+            discriminator=user_data.get("discriminator", "0000"),
+            avatar=user_data.get("avatar"),
+            bot=user_data.get("bot", False),
+            role_ids=_intern_role_ids(int(rid) for rid in member_data.get("roles", [])),
+            joined_at=member_data.get("joined_at"),
+            nick=member_data.get("nick"),
+            presence=None,
+        )
+        if self._names is not None:
+            self._index_name(member_id, record)
+
+    def set_presence(self, member_id: int, presence: Presence) -> None:
+        """
+        Sets the presence of a member, without creating a :class:`.Member` for it.
+        """
+        entry = self._entries[member_id]
+        if isinstance(entry, _MemberRecord):
+            self._entries[member_id] = entry._replace(presence=presence)
+        else:
+            entry.presence = presence
+
+    def remove_role(self, role_id: int) -> None:
+        """
+        Removes a role from every member, without creating a :class:`.Member` for each one.
+        """
+        for member_id, entry in self._entries.items():
+            if role_id not in entry.role_ids:
+                continue
+
+            role_ids = [rid for rid in entry.role_ids if rid != role_id]
+            if isinstance(entry, _MemberRecord):
+                self._entries[member_id] = entry._replace(role_ids=_intern_role_ids(role_ids))
+            else:
+                entry.role_ids = role_ids
+
+    def copy(self) -> "MemberMap":
+        """
+        :return: A shallow copy of this mapping.
+        """
+        new = MemberMap(self._guild_id)
+        new._entries = self._entries.copy()
+        return new
+
+    def __getitem__(self, member_id: int) -> "Member":
+        entry = self._entries[member_id]
+        if isinstance(entry, _MemberRecord):
+            return self._materialise(member_id, entry)
+
+        return entry
+
+    def get(self, member_id: int, default=None) -> "Optional[Member]":
+        try:
+            return self[member_id]
+        except KeyError:
+            return default
+
+    def __setitem__(self, member_id: int, member: "Member") -> None:
+        self._entries[member_id] = member
+        if self._names is not None:
+            self._index_name(member_id, member)
+
+    def __delitem__(self, member_id: int) -> None:
+        del self._entries[member_id]
+        if self._names is not None:
+            self._names.remove(member_id)
+
+    def __contains__(self, member_id: int) -> bool:
+        return member_id in self._entries
+
+    def __iter__(self) -> Iterator[int]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return f"<MemberMap guild_id={self._guild_id} members={len(self._entries)}>"
@@ -544,6 +544,10 @@ class Overwrite(object):
         if item == "_immutable":
             return super().__getattribute__("_immutable")
 
+        # special lookups (e.g. __setstate__ when unpickling) happen before target is set
+        if item.startswith("__"):
+            raise AttributeError(item)
+
         if isinstance(self.target, dt_member.dt_user.User):  # lol
             permissions = Permissions(515136)
         elif isinstance(self.target, dt_member.Member):
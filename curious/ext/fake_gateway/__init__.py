@@ -0,0 +1,672 @@
+# This file is part of curious.
+#
+# curious is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Lesser General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# curious is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with curious.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A local fake Discord gateway, for load testing the gateway, client and state without touching
+Discord.
+
+This requires ``wsproto`` (``pip install curious[wsproto]``).
+
+.. code-block:: python3
+
+    async def main():
+        config = FakeGatewayConfig(guilds=500, members_per_guild=2000, event_rate=200)
+        gateway = FakeGateway(config)
+        client = Client("fake.token.here")
+        client.application_info = gateway.make_app_info()
+
+        async with anyio.create_task_group() as tg:
+            await tg.spawn(gateway.serve)
+            await gateway.wait_started()
+            await client.run_async(shard_count=4, gateway_url=gateway.url)
+
+    anyio.run(main)
+
+Guilds are assigned to shards the same way Discord does, ``(guild_id >> 22) % shard_count``.
+"""
+import logging
+import random
+import time
+import uuid
+import zlib
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import anyio
+from anyio.exceptions import ClosedResourceError
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import (
+    AcceptConnection,
+    BytesMessage,
+    CloseConnection,
+    Ping,
+    Request,
+    TextMessage,
+)
+from wsproto.utilities import LocalProtocolError
+
+from curious.core.codec import get_gateway_codec
+from curious.core.gateway import GatewayOp
+from curious.dataclasses.appinfo import AppInfo
+from curious.dataclasses.bases import DISCORD_EPOCH
+
+logger = logging.getLogger("curious.fake_gateway")
+
+#: The timestamp used for generated snowflakes.
+_BASE_TIMESTAMP = 1500000000000 - DISCORD_EPOCH
+
+#: The activities sent in presence updates.
+_ACTIVITIES = [
+    None,
+    {"name": "a game", "type": 0},
+    {"name": "another game", "type": 0},
+    {"name": "some music", "type": 2},
+]
+
+
+@dataclass
+class FakeGatewayConfig:
+    """
+    Represents the configuration for a :class:`.FakeGateway`.
+    """
+
+    #: The total number of guilds, across every shard.
+    guilds: int = 10
+
+    #: The number of members in each guild, not including the bot.
+    members_per_guild: int = 100
+
+    #: The number of text channels in each guild.
+    channels_per_guild: int = 5
+
+    #: The number of synthetic events sent per second, per connection, once a shard is ready.
+    event_rate: float = 0
+
+    #: The relative weights of the synthetic events sent.
+    event_weights: Dict[str, float] = field(
+        default_factory=lambda: {"MESSAGE_CREATE": 1.0, "TYPING_START": 0.0, "PRESENCE_UPDATE": 0.0}
+    )
+
+    #: The heartbeat interval sent in HELLO, in milliseconds.
+    heartbeat_interval: int = 41250
+
+    #: Guilds with more members than this are large, and only include the bot in GUILD_CREATE.
+    large_threshold: int = 250
+
+
+@dataclass
+class FakeGatewayStats:
+    """
+    Represents the statistics for a :class:`.FakeGateway`.
+    """
+
+    #: The number of websocket connections accepted.
+    connections: int = 0
+
+    #: The number of IDENTIFYs received.
+    identifies: int = 0
+
+    #: The number of successful RESUMEs.
+    resumes: int = 0
+
+    #: The number of INVALIDATE_SESSIONs sent.
+    invalidations: int = 0
+
+    #: The number of dispatches sent.
+    dispatches: int = 0
+
+    #: The number of GUILD_MEMBERS_CHUNKs sent.
+    chunks: int = 0
+
+    #: The number of bytes sent, after compression.
+    bytes_sent: int = 0
+
+
+@dataclass
+class _FakeSession:
+    session_id: str
+    shard_id: int
+    shard_count: int
+    sequence: int = 0
+
+
+def _snowflake(offset: int, increment: int = 0) -> int:
+    return ((_BASE_TIMESTAMP + offset) << 22) | increment
+
+
+class _FakeConnection(object):
+    """
+    Represents a single client connected to the fake gateway.
+    """
+
+    def __init__(self, gateway: "FakeGateway", sock: anyio.SocketStream):
+        self.gateway = gateway
+        self.sock = sock
+        self.ws = WSConnection(ConnectionType.SERVER)
+
+        self.codec = None
+        self.compressor = None
+        self.session: Optional[_FakeSession] = None
+
+        self._send_lock = anyio.create_lock()
+        self._closed = False
+        self._emitting = False
+
+    async def _send_raw(self, event) -> None:
+        data = self.ws.send(event)
+        async with self._send_lock:
+            await self.sock.send_all(data)
+
+        self.gateway.stats.bytes_sent += len(data)
+
+    async def send(self, op: GatewayOp, d=None, *, t: str = None) -> None:
+        """
+        Sends a payload to the client.
+        """
+        payload = {"op": op, "d": d, "s": None, "t": t}
+        if op == GatewayOp.DISPATCH:
+            self.session.sequence += 1
+            payload["s"] = self.session.sequence
+            self.gateway.stats.dispatches += 1
+
+        encoded = self.codec.dumps(payload)
+        if self.compressor is not None:
+            if isinstance(encoded, str):
+                encoded = encoded.encode("utf-8")
+
+            data = self.compressor.compress(encoded) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+            await self._send_raw(BytesMessage(data=data))
+        elif self.codec.binary:
+            await self._send_raw(BytesMessage(data=encoded))
+        else:
+            await self._send_raw(TextMessage(data=encoded))
+
+    async def dispatch(self, name: str, d: dict) -> None:
+        """
+        Sends a dispatch to the client.
+        """
+        await self.send(GatewayOp.DISPATCH, d, t=name)
+
+    async def close(self, code: int, reason: str) -> None:
+        """
+        Closes the connection with a close code, as Discord does when a client misbehaves.
+        """
+        logger.warning("Closing client connection with %s: %s", code, reason)
+        self._closed = True
+        self._emitting = False
+        try:
+            await self._send_raw(CloseConnection(code=code, reason=reason))
+        except (OSError, ClosedResourceError, LocalProtocolError):
+            pass
+
+    async def invalidate(self) -> None:
+        """
+        Invalidates the session of this connection.
+        """
+        if self.session is not None:
+            self.gateway.sessions.pop(self.session.session_id, None)
+
+        self.session = None
+        self._emitting = False
+        self.gateway.stats.invalidations += 1
+        await self.send(GatewayOp.INVALIDATE_SESSION, False)
+
+    def _handle_request(self, event: Request) -> None:
+        query = parse_qs(urlsplit(event.target).query)
+        encoding = query.get("encoding", ["json"])[0]
+        self.codec = get_gateway_codec(encoding)
+        if query.get("compress", [None])[0] == "zlib-stream":
+            self.compressor = zlib.compressobj()
+
+    async def _handle_payload(self, data) -> None:
+        try:
+            payload = self.codec.loads(data)
+            op = payload["op"]
+            d = payload.get("d")
+        except Exception:
+            logger.debug("Failed to decode client payload", exc_info=True)
+            await self.close(4002, "Error while decoding payload.")
+            return
+
+        if self.session is None and op in (
+            GatewayOp.REQUEST_MEMBERS,
+            GatewayOp.PRESENCE,
+            GatewayOp.VOICE_STATE,
+        ):
+            # these need a session, so ignore them until the client has identified
+            logger.warning("Ignoring opcode %s from a client that hasn't identified", op)
+            return
+
+        if op == GatewayOp.HEARTBEAT:
+            await self.send(GatewayOp.HEARTBEAT_ACK)
+
+        elif op == GatewayOp.IDENTIFY:
+            await self._handle_identify(d)
+
+        elif op == GatewayOp.RESUME:
+            await self._handle_resume(d)
+
+        elif op == GatewayOp.REQUEST_MEMBERS:
+            await self._handle_request_members(d)
+
+        elif op in (GatewayOp.PRESENCE, GatewayOp.VOICE_STATE):
+            pass
+
+        else:
+            logger.warning("Unhandled opcode %s from client", op)
+
+    async def _handle_identify(self, d: dict) -> None:
+        self.gateway.stats.identifies += 1
+        shard_id, shard_count = d.get("shard", [0, 1])
+        self.session = _FakeSession(
+            session_id=uuid.uuid4().hex, shard_id=shard_id, shard_count=shard_count
+        )
+        self.gateway.sessions[self.session.session_id] = self.session
+
+        guild_ids = self.gateway.guild_ids_for(shard_id, shard_count)
+        await self.dispatch(
+            "READY",
+            {
+                "v": 6,
+                "user": self.gateway.bot_user,
+                "session_id": self.session.session_id,
+                "guilds": [{"id": str(id), "unavailable": True} for id in guild_ids],
+                "private_channels": [],
+                "_trace": ["fake-gateway"],
+            },
+        )
+
+        for guild_id in guild_ids:
+            await self.dispatch("GUILD_CREATE", self.gateway.make_guild(guild_id))
+            await anyio.sleep(0)
+
+        await self._start_emitting()
+
+    async def _handle_resume(self, d: dict) -> None:
+        session = self.gateway.sessions.get(d.get("session_id"))
+        if session is None:
+            await self.invalidate()
+            return
+
+        self.gateway.stats.resumes += 1
+        self.session = session
+        await self.dispatch("RESUMED", {"_trace": ["fake-gateway"]})
+        await self._start_emitting()
+
+    async def _handle_request_members(self, d: dict) -> None:
+        guild_ids = d.get("guild_id", [])
+        if not isinstance(guild_ids, list):
+            guild_ids = [guild_ids]
+
+        for guild_id in guild_ids:
+            guild_id = int(guild_id)
+            members = list(self.gateway.make_members(guild_id))
+            for i in range(0, len(members), 1000):
+                await self.dispatch(
+                    "GUILD_MEMBERS_CHUNK",
+                    {"guild_id": str(guild_id), "members": members[i : i + 1000]},
+                )
+                self.gateway.stats.chunks += 1
+                await anyio.sleep(0)
+
+    async def _start_emitting(self) -> None:
+        if self.gateway.config.event_rate <= 0 or self._emitting:
+            return
+
+        self._emitting = True
+        await self.gateway.task_group.spawn(self._emit_events)
+
+    async def _emit_events(self) -> None:
+        """
+        Sends synthetic events at the configured rate.
+        """
+        config = self.gateway.config
+        names = list(config.event_weights)
+        weights = [config.event_weights[name] for name in names]
+        guild_ids = self.gateway.guild_ids_for(self.session.shard_id, self.session.shard_count)
+        if not guild_ids:
+            return
+
+        last = time.monotonic()
+        owed = 0.0
+        while self._emitting and not self._closed:
+            await anyio.sleep(0.01)
+            now = time.monotonic()
+            owed += (now - last) * config.event_rate
+            last = now
+
+            while owed >= 1 and self._emitting:
+                owed -= 1
+                name = random.choices(names, weights)[0]
+                guild_id = random.choice(guild_ids)
+                try:
+                    await self.dispatch(name, self.gateway.make_event(name, guild_id))
+                except (OSError, ClosedResourceError, LocalProtocolError):
+                    return
+
+    async def run(self) -> None:
+        """
+        Runs this connection until the client disconnects.
+        """
+        self.gateway.stats.connections += 1
+        text_parts, binary_parts = [], []
+
+        try:
+            while not self._closed:
+                data = await self.sock.receive_some(65536)
+                self.ws.receive_data(data or None)
+
+                for event in self.ws.events():
+                    if self._closed:
+                        break
+
+                    if isinstance(event, Request):
+                        self._handle_request(event)
+                        await self._send_raw(AcceptConnection())
+                        await self.send(
+                            GatewayOp.HELLO,
+                            {
+                                "heartbeat_interval": self.gateway.config.heartbeat_interval,
+                                "_trace": ["fake-gateway"],
+                            },
+                        )
+
+                    elif isinstance(event, TextMessage):
+                        text_parts.append(event.data)
+                        if event.message_finished:
+                            await self._handle_payload("".join(text_parts))
+                            text_parts.clear()
+
+                    elif isinstance(event, BytesMessage):
+                        binary_parts.append(event.data)
+                        if event.message_finished:
+                            await self._handle_payload(b"".join(binary_parts))
+                            binary_parts.clear()
+
+                    elif isinstance(event, Ping):
+                        await self._send_raw(event.response())
+
+                    elif isinstance(event, CloseConnection):
+                        self._closed = True
+                        try:
+                            await self._send_raw(event.response())
+                        except LocalProtocolError:
+                            pass
+
+                if not data:
+                    self._closed = True
+        except (OSError, ClosedResourceError, LocalProtocolError):
+            pass
+        finally:
+            self._closed = True
+            self._emitting = False
+            self.gateway.connections.discard(self)
+            try:
+                await self.sock.close()
+            except (OSError, ClosedResourceError):
+                pass
+
+
+class FakeGateway(object):
+    """
+    A fake gateway server, that synthesises guilds, members and events.
+    """
+
+    def __init__(self, config: FakeGatewayConfig = None, *, host: str = "127.0.0.1", port: int = 0):
+        """
+        :param config: The :class:`.FakeGatewayConfig` to use.
+        :param host: The interface to listen on.
+        :param port: The port to listen on. If this is 0, a random port is used.
+        """
+        #: The :class:`.FakeGatewayConfig` for this gateway.
+        self.config = config or FakeGatewayConfig()
+
+        #: The interface to listen on.
+        self.host = host
+
+        #: The port this gateway is listening on.
+        self.port = port
+
+        #: The :class:`.FakeGatewayStats` for this gateway.
+        self.stats = FakeGatewayStats()
+
+        #: The current connections.
+        self.connections = set()
+
+        #: The sessions that can be resumed.
+        self.sessions: Dict[str, _FakeSession] = {}
+
+        #: The task group connections are ran in.
+        self.task_group: anyio.TaskGroup = None
+
+        #: The user the bot is logged in as.
+        self.bot_user = {
+            "id": str(_snowflake(0)),
+            "username": "FakeBot",
+            "discriminator": "0000",
+            "avatar": None,
+            "bot": True,
+        }
+
+        self._started = anyio.create_event()
+
+    @property
+    def url(self) -> str:
+        """
+        :return: The websocket URL to pass to :meth:`.Client.run_async`.
+        """
+        return f"ws://{self.host}:{self.port}"
+
+    def make_app_info(self) -> AppInfo:
+        """
+        :return: An :class:`.AppInfo` for the fake bot, to set as :attr:`.Client.application_info`
+            so that it isn't fetched over HTTP.
+        """
+        return AppInfo(application={"id": self.bot_user["id"], "name": "FakeBot"})
+
+    # data generation
+    def guild_ids_for(self, shard_id: int, shard_count: int) -> List[int]:
+        """
+        :return: The IDs of the guilds on the specified shard.
+        """
+        ids = (_snowflake(i + 1) for i in range(self.config.guilds))
+        return [id for id in ids if (id >> 22) % shard_count == shard_id]
+
+    def _user_id(self, guild_id: int, index: int) -> int:
+        # members are unique per guild
+        return _snowflake(guild_id >> 22, index + 1)
+
+    def _member(self, guild_id: int, index: int) -> dict:
+        user_id = self._user_id(guild_id, index)
+        return {
+            "user": {
+                "id": str(user_id),
+                "username": f"user{index}",
+                "discriminator": f"{index % 10000:04d}",
+                "avatar": None,
+            },
+            "nick": None,
+            "roles": [],
+            "joined_at": "2018-01-01T00:00:00+00:00",
+            "deaf": False,
+            "mute": False,
+        }
+
+    def make_members(self, guild_id: int) -> Iterator[dict]:
+        """
+        :return: An iterator of member dicts for a guild, including the bot.
+        """
+        yield {
+            "user": self.bot_user,
+            "nick": None,
+            "roles": [],
+            "joined_at": "2018-01-01T00:00:00+00:00",
+            "deaf": False,
+            "mute": False,
+        }
+
+        for i in range(self.config.members_per_guild):
+            yield self._member(guild_id, i)
+
+    def _channel_id(self, guild_id: int, index: int) -> int:
+        return _snowflake((guild_id >> 22) + self.config.guilds, index)
+
+    def make_guild(self, guild_id: int) -> dict:
+        """
+        :return: The GUILD_CREATE payload for a guild.
+        """
+        member_count = self.config.members_per_guild + 1
+        large = member_count > self.config.large_threshold
+        if large:
+            members = [next(self.make_members(guild_id))]
+        else:
+            members = list(self.make_members(guild_id))
+
+        channels = [
+            {
+                "id": str(self._channel_id(guild_id, i)),
+                "type": 0,
+                "guild_id": str(guild_id),
+                "name": f"channel-{i}",
+                "position": i,
+                "permission_overwrites": [],
+                "topic": None,
+                "nsfw": False,
+                "parent_id": None,
+            }
+            for i in range(self.config.channels_per_guild)
+        ]
+
+        return {
+            "id": str(guild_id),
+            "name": f"Guild {guild_id >> 22}",
+            "icon": None,
+            "splash": None,
+            "owner_id": self.bot_user["id"],
+            "region": "us-east",
+            "afk_channel_id": None,
+            "afk_timeout": 300,
+            "verification_level": 0,
+            "default_message_notifications": 0,
+            "explicit_content_filter": 0,
+            "mfa_level": 0,
+            "features": [],
+            "emojis": [],
+            "roles": [
+                {
+                    "id": str(guild_id),
+                    "name": "@everyone",
+                    "permissions": 104324161,
+                    "color": 0,
+                    "hoist": False,
+                    "position": 0,
+                    "managed": False,
+                    "mentionable": False,
+                }
+            ],
+            "large": large,
+            "unavailable": False,
+            "member_count": member_count,
+            "members": members,
+            "channels": channels,
+            "presences": [],
+            "voice_states": [],
+        }
+
+    def make_event(self, name: str, guild_id: int) -> dict:
+        """
+        :return: A synthetic dispatch of the specified type for a guild.
+        """
+        index = random.randrange(self.config.members_per_guild or 1)
+        member = self._member(guild_id, index)
+        channel_index = random.randrange(self.config.channels_per_guild)
+        channel_id = str(self._channel_id(guild_id, channel_index))
+
+        if name == "TYPING_START":
+            return {
+                "channel_id": channel_id,
+                "guild_id": str(guild_id),
+                "user_id": member["user"]["id"],
+                "timestamp": int(time.time()),
+            }
+
+        if name == "PRESENCE_UPDATE":
+            # a small set of activities, so that presences repeat like they do on Discord
+            game = random.choice(_ACTIVITIES)
+            return {
+                "user": member["user"],
+                "guild_id": str(guild_id),
+                "roles": member["roles"],
+                "status": random.choice(["online", "idle", "dnd", "offline"]),
+                "game": game,
+                "activities": [game] if game is not None else [],
+            }
+
+        return {
+            "id": str(_snowflake(int(time.time() * 1000) - DISCORD_EPOCH, random.randrange(4096))),
+            "channel_id": channel_id,
+            "guild_id": str(guild_id),
+            "author": member["user"],
+            "member": {k: v for (k, v) in member.items() if k != "user"},
+            "content": "hello world",
+            "timestamp": "2018-01-01T00:00:00+00:00",
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": [],
+            "pinned": False,
+            "type": 0,
+        }
+
+    # server
+    async def wait_started(self) -> None:
+        """
+        Waits until the server is listening. :attr:`.FakeGateway.url` is valid after this.
+        """
+        await self._started.wait()
+
+    async def invalidate_sessions(self) -> None:
+        """
+        Sends INVALIDATE_SESSION to every connected client, forcing them to identify again.
+        """
+        for connection in list(self.connections):
+            await connection.invalidate()
+
+    async def _handle_connection(self, sock: anyio.SocketStream) -> None:
+        connection = _FakeConnection(self, sock)
+        self.connections.add(connection)
+        try:
+            await connection.run()
+        except Exception:
+            # one broken client shouldn't take down the server and every other connection
+            logger.exception("Error in fake gateway connection")
+
+    async def serve(self) -> None:
+        """
+        Runs the server forever.
+        """
+        async with anyio.create_task_group() as tg:
+            self.task_group = tg
+            async with await anyio.create_tcp_server(self.port, self.host) as server:
+                self.port = server.port
+                logger.info(f"Fake gateway listening on {self.url}")
+                await self._started.set()
+
+                async for sock in server.accept_connections():
+                    await tg.spawn(self._handle_connection, sock)
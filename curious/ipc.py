@@ -14,7 +14,6 @@
 # along with curious.  If not, see <http://www.gnu.org/licenses/>.
 import contextlib
 import enum
-import json
 import os
 import struct
 import uuid
@@ -23,6 +22,7 @@ from typing import AsyncContextManager, Optional, Union
 
 import anyio
 
+from curious.core.codec import get_json_codec
 from curious.dataclasses.presence import RichActivity
 
 
@@ -89,7 +89,7 @@ class IPCPacket(object):
         Packs JSON in a compact representation.
         :param data: The data to pack.
         """
-        return json.dumps(data, indent=None, separators=(",", ":"))
+        return get_json_codec().dumps(data)
 
     # properties
     @property
@@ -127,11 +127,12 @@ class IPCPacket(object):
         buf = BytesIO()
         # Add opcode - little endian (why not network order?)
         buf.write(self.opcode.to_bytes(4, byteorder="little"))
-        data = self._pack_json(self._json_data)
+        data = self._pack_json(self._json_data).encode("utf-8")
         # Add data length - little endian (why not network order?)
+        # NB: this is the length in bytes, as the codec might not escape non-ASCII characters
         buf.write(len(data).to_bytes(4, byteorder="little"))
         # Add data - string, obviously
-        buf.write(data.encode("utf-8"))
+        buf.write(data)
         return buf.getvalue()
 
     @classmethod
@@ -142,12 +143,12 @@ class IPCPacket(object):
         This method is not usually what you want.
         """
         opcode, length = struct.unpack("<ii", data[:8])
-        raw_data = data[8:].decode("utf-8")
+        raw_data = data[8:]
 
         if len(raw_data) != length:
             raise ValueError("Got invalid length.")
 
-        return IPCPacket(IPCOpcode(opcode), json.loads(raw_data))
+        return IPCPacket(IPCOpcode(opcode), get_json_codec().loads(raw_data))
 
 
 class IPCClient(object):
@@ -197,7 +198,7 @@ class IPCClient(object):
 
         opcode, length = struct.unpack("<ii", size)
         body = await self._sock.receive_exactly(length)
-        body_data = json.loads(body.decode("utf-8"))
+        body_data = get_json_codec().loads(body)
 
         packet = IPCPacket(IPCOpcode(opcode), body_data)
 
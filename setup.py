@@ -21,6 +21,14 @@ groundwork_requires = [
     "toml",
 ]
 
+wsproto_requires = [
+    "wsproto>=0.14.0",
+]
+
+etf_requires = [
+    "erlpack",
+]
+
 py36_requires = [
     "dataclasses>=0.3",  # PEP 557
     "contextvars>=2.1",
@@ -39,7 +47,7 @@ setup(
         'curious', 'curious.core', 'curious.core._ws_wrapper', 'curious.core.event',
         'curious.commands', 'curious.dataclasses',
         'curious.groundwork', 'curious.groundwork.stock_plugins',
-        'curious.ext.paginator',
+        'curious.ext.paginator', 'curious.ext.fake_gateway',
     ],
     url='https://github.com/SunDwarf/curious',
     license='LGPLv3',
@@ -61,6 +69,8 @@ setup(
     install_requires=install_requires,
     extras_require={
         "groundwork": groundwork_requires,
+        "wsproto": wsproto_requires,
+        "etf": etf_requires,
     },
     entry_points={
         "console_scripts": ["curious=curious.groundwork.runner:main"]
@@ -0,0 +1,104 @@
+"""
+Tests for cluster worker handling and identify coordination between workers.
+"""
+import multiprocessing
+import time
+
+import anyio
+
+from curious.core.cluster import Cluster, ClusterWorker, _WorkerHandle
+
+#: The identify window used by the tests, shortened from 5 seconds.
+WINDOW = 0.5
+
+
+async def _run_workers(connect_delays):
+    """
+    Runs a cluster parent and one worker per connect delay, each with a single shard in the same
+    identify bucket.
+
+    Each shard acquires its slot, waits for its connect delay (standing in for connecting and
+    receiving HELLO), then identifies.
+
+    :return: A mapping of shard ID -> the time that shard identified.
+    """
+    cluster = Cluster("token", None, workers=len(connect_delays), gateway_url="ws://localhost")
+    cluster.identify_limiter.IDENTIFY_WINDOW = WINDOW
+    cluster._workers = {i: _WorkerHandle(i, [i]) for i in range(len(connect_delays))}
+    identified_at = {}
+
+    async def _shard(worker: ClusterWorker, shard_id: int, delay: float):
+        await worker.identify_limiter.acquire(shard_id)
+        await anyio.sleep(delay)
+        await worker.identify_limiter.identified(shard_id)
+        identified_at[shard_id] = time.monotonic()
+
+    async with anyio.create_task_group() as tg:
+        cluster._task_group = tg
+        server = await anyio.create_tcp_server(interface="127.0.0.1")
+        await tg.spawn(cluster._serve, server)
+
+        workers = []
+        for worker_id in range(len(connect_delays)):
+            sock = await anyio.connect_tcp("127.0.0.1", server.port)
+            worker = ClusterWorker(None, worker_id, [worker_id], sock)
+            await worker.send("hello", worker_id=worker_id, secret=cluster._secret)
+            await tg.spawn(worker._read_messages)
+            workers.append(worker)
+
+        async with anyio.create_task_group() as shards:
+            for shard_id, (worker, delay) in enumerate(zip(workers, connect_delays)):
+                await shards.spawn(_shard, worker, shard_id, delay)
+                # make sure the shards ask for a slot in order
+                await anyio.sleep(0.05)
+
+        await tg.cancel_scope.cancel()
+
+    return identified_at
+
+
+def test_identify_window_follows_actual_identify():
+    # the first shard takes a while to connect after getting its slot, so the second shard must
+    # wait a whole window after the first shard's real IDENTIFY, not after the slot was granted
+    identified_at = anyio.run(_run_workers, [0.3, 0.0])
+
+    assert identified_at[1] - identified_at[0] >= WINDOW
+
+
+def _ignore_sigterm():
+    import signal
+
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    time.sleep(60)
+
+
+def test_terminate_does_not_block_event_loop():
+    # a worker that ignores SIGTERM must be killed, without blocking the loop while waiting
+    async def _terminate():
+        ctx = multiprocessing.get_context("spawn")
+        worker = _WorkerHandle(0, [0])
+        worker.TERMINATE_TIMEOUT = 0.5
+        worker.process = ctx.Process(target=_ignore_sigterm, daemon=True)
+        worker.process.start()
+        # give the worker time to ignore SIGTERM
+        await anyio.sleep(1)
+
+        ticks = []
+
+        async def _tick():
+            while True:
+                ticks.append(time.monotonic())
+                await anyio.sleep(0.05)
+
+        async with anyio.create_task_group() as tg:
+            await tg.spawn(_tick)
+            await worker.terminate()
+            await tg.cancel_scope.cancel()
+
+        return worker, ticks
+
+    worker, ticks = anyio.run(_terminate)
+
+    assert not worker.process.is_alive()
+    assert worker.process.exitcode == -9
+    assert len(ticks) >= 5
@@ -0,0 +1,189 @@
+"""
+Tests for the External Term Format gateway codecs.
+"""
+import struct
+import sys
+import types
+
+import pytest
+
+from curious.core import _etf
+from curious.core.codec import _make_etf_codec
+
+#: A READY-ish payload, in the shape the JSON gateway produces.
+PAYLOAD = {
+    "op": 0,
+    "s": 1,
+    "t": "READY",
+    "d": {
+        "v": 6,
+        "session_id": "a1b2c3",
+        "user": {"id": 80528701850124288, "username": "bot", "bot": True, "avatar": None},
+        "guilds": [{"id": 198101180180594688, "unavailable": True}],
+        "_trace": ["gateway-prd-main-1"],
+        "shard": [0, 1],
+        "ratio": 0.5,
+        "negative": -12345,
+        "empty": [],
+    },
+}
+
+
+def _binary(value: str) -> bytes:
+    raw = value.encode("utf-8")
+    return bytes([_etf.BINARY_EXT]) + struct.pack(">I", len(raw)) + raw
+
+
+def _small_atom(name: str) -> bytes:
+    return bytes([_etf.SMALL_ATOM_UTF8_EXT, len(name)]) + name.encode("utf-8")
+
+
+def _atom(name: str) -> bytes:
+    return bytes([_etf.ATOM_EXT]) + struct.pack(">H", len(name)) + name.encode("latin-1")
+
+
+def _small_big(value: int) -> bytes:
+    raw = abs(value).to_bytes((abs(value).bit_length() + 7) // 8, "little")
+    return bytes([_etf.SMALL_BIG_EXT, len(raw), 1 if value < 0 else 0]) + raw
+
+
+def _large_big(value: int) -> bytes:
+    raw = abs(value).to_bytes((abs(value).bit_length() + 7) // 8, "little")
+    return bytes([_etf.LARGE_BIG_EXT]) + struct.pack(">IB", len(raw), value < 0) + raw
+
+
+def _map(*pairs: bytes) -> bytes:
+    return bytes([_etf.MAP_EXT]) + struct.pack(">I", len(pairs) // 2) + b"".join(pairs)
+
+
+def _term(body: bytes) -> bytes:
+    return bytes([_etf.FORMAT_VERSION]) + body
+
+
+#: A hand-built term like Discord sends, with atom keys, atom constants and bignum snowflakes.
+DISCORD_TERM = _term(
+    _map(
+        _small_atom("t"), _small_atom("nil"),
+        _atom("op"), bytes([_etf.SMALL_INTEGER_EXT, 10]),
+        _small_atom("d"), _map(
+            _small_atom("heartbeat_interval"), bytes([_etf.INTEGER_EXT]) + struct.pack(">i", 41250),
+            _small_atom("user"), _map(
+                _small_atom("id"), _small_big(80528701850124288),
+                _small_atom("bot"), _small_atom("true"),
+                _small_atom("verified"), _atom("false"),
+                _small_atom("username"), _binary("bot"),
+            ),
+            _small_atom("big"), _large_big(-(2 ** 70)),
+            _small_atom("shard"), bytes([_etf.STRING_EXT]) + struct.pack(">H", 2) + b"\x00\x01",
+        ),
+    )
+)
+
+#: The structure DISCORD_TERM should decode to.
+DISCORD_EXPECTED = {
+    "t": None,
+    "op": 10,
+    "d": {
+        "heartbeat_interval": 41250,
+        "user": {"id": 80528701850124288, "bot": True, "verified": False, "username": "bot"},
+        "big": -(2 ** 70),
+        "shard": [0, 1],
+    },
+}
+
+
+def test_round_trip():
+    assert _etf.decode(_etf.encode(PAYLOAD)) == PAYLOAD
+
+
+def test_round_trip_big_integers():
+    for value in (2 ** 31, -(2 ** 31) - 1, 2 ** 64 - 1, 2 ** 200, -(2 ** 200)):
+        assert _etf.decode(_etf.encode(value)) == value
+
+
+def test_decode_discord_term():
+    assert _etf.decode(DISCORD_TERM) == DISCORD_EXPECTED
+
+
+def test_decode_atoms():
+    assert _etf.decode(_term(_small_atom("nil"))) is None
+    assert _etf.decode(_term(_small_atom("true"))) is True
+    assert _etf.decode(_term(_atom("false"))) is False
+    assert _etf.decode(_term(_atom("other"))) == "other"
+
+
+def test_decode_string_ext():
+    # erlang sends lists of small integers as a STRING_EXT
+    term = _term(bytes([_etf.STRING_EXT]) + struct.pack(">H", 3) + b"\x01\x02\xff")
+    assert _etf.decode(term) == [1, 2, 255]
+
+
+def test_decode_nested_maps():
+    term = _term(_map(_binary("a"), _map(_binary("b"), _map(_binary("c"), _small_atom("nil")))))
+    assert _etf.decode(term) == {"a": {"b": {"c": None}}}
+
+
+def test_decode_errors():
+    with pytest.raises(_etf.ETFDecodeError):
+        _etf.decode(b"")
+
+    with pytest.raises(_etf.ETFDecodeError):
+        _etf.decode(_binary("no version"))
+
+    with pytest.raises(_etf.ETFDecodeError):
+        _etf.decode(DISCORD_TERM[:-3])
+
+    with pytest.raises(_etf.ETFDecodeError):
+        _etf.decode(_term(b"\xff"))
+
+
+def test_codec_matches_pure_python():
+    # whichever backend is installed must decode to the same structure
+    codec = _make_etf_codec()
+    assert codec.loads(DISCORD_TERM) == DISCORD_EXPECTED
+    assert codec.loads(codec.dumps(PAYLOAD)) == PAYLOAD
+
+
+class _FakeAtom(str):
+    pass
+
+
+def _erlpackify(obb):
+    # what an old erlpack decoder without encode_binary_ext returns: bytes and atoms
+    if obb is None or obb is True or obb is False:
+        return _FakeAtom({None: "nil", True: "true", False: "false"}[obb])
+
+    if isinstance(obb, str):
+        return obb.encode("utf-8")
+
+    if isinstance(obb, dict):
+        return {_erlpackify(k): _erlpackify(v) for k, v in obb.items()}
+
+    if isinstance(obb, list):
+        return [_erlpackify(i) for i in obb]
+
+    return obb
+
+
+class _FakeDecoder:
+    def __init__(self, encoding: str = None):
+        pass
+
+    def loads(self, data: bytes):
+        return _erlpackify(_etf.decode(data))
+
+
+def test_erlpack_normalisation(monkeypatch):
+    fake = types.ModuleType("erlpack")
+    fake.Atom = _FakeAtom
+    fake.ErlangTermDecoder = _FakeDecoder
+    fake.pack = _etf.encode
+    monkeypatch.setitem(sys.modules, "erlpack", fake)
+
+    codec = _make_etf_codec()
+    assert codec.name == "erlpack"
+    assert codec.loads(DISCORD_TERM) == DISCORD_EXPECTED
+
+    decoded = codec.loads(_etf.encode(PAYLOAD))
+    assert decoded == PAYLOAD
+    assert all(type(key) is str for key in decoded["d"]["user"])
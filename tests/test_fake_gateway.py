@@ -0,0 +1,94 @@
+"""
+Tests for the fake gateway's handling of misbehaving clients.
+"""
+import json
+from urllib.parse import urlsplit
+
+import anyio
+from wsproto import ConnectionType, WSConnection
+from wsproto.events import AcceptConnection, CloseConnection, Request, TextMessage
+
+from curious.core.gateway import GatewayOp
+from curious.ext.fake_gateway import FakeGateway, FakeGatewayConfig
+
+
+class _Client:
+    """
+    A bare websocket client, which sends whatever it is told to.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.ws = WSConnection(ConnectionType.CLIENT)
+
+    @classmethod
+    async def connect(cls, url: str) -> "_Client":
+        split = urlsplit(url)
+        client = cls(await anyio.connect_tcp(split.hostname, split.port))
+        await client.sock.send_all(
+            client.ws.send(Request(host=split.netloc, target="/?v=6&encoding=json"))
+        )
+        assert isinstance(await client.receive(), AcceptConnection)
+        return client
+
+    async def send(self, payload) -> None:
+        if not isinstance(payload, str):
+            payload = json.dumps(payload)
+
+        await self.sock.send_all(self.ws.send(TextMessage(data=payload)))
+
+    async def receive(self):
+        while True:
+            for event in self.ws.events():
+                return event
+
+            self.ws.receive_data(await self.sock.receive_some(65536) or None)
+
+    async def receive_op(self) -> int:
+        event = await self.receive()
+        assert isinstance(event, TextMessage), event
+        return json.loads(event.data)["op"]
+
+
+async def _run(test):
+    gateway = FakeGateway(FakeGatewayConfig(guilds=1, members_per_guild=5, event_rate=0))
+    async with anyio.create_task_group() as tg:
+        await tg.spawn(gateway.serve)
+        await gateway.wait_started()
+        async with anyio.fail_after(5):
+            await test(gateway)
+
+        await tg.cancel_scope.cancel()
+
+
+def test_malformed_payload_closes_connection():
+    async def _test(gateway: FakeGateway):
+        bad = await _Client.connect(gateway.url)
+        good = await _Client.connect(gateway.url)
+        assert await bad.receive_op() == GatewayOp.HELLO
+        assert await good.receive_op() == GatewayOp.HELLO
+
+        await bad.send("{not json")
+        event = await bad.receive()
+        assert isinstance(event, CloseConnection)
+        assert event.code == 4002
+
+        # the server and the other connection are unaffected
+        await good.send({"op": GatewayOp.HEARTBEAT, "d": None})
+        assert await good.receive_op() == GatewayOp.HEARTBEAT_ACK
+        other = await _Client.connect(gateway.url)
+        assert await other.receive_op() == GatewayOp.HELLO
+
+    anyio.run(_run, _test)
+
+
+def test_request_members_before_identify_is_ignored():
+    async def _test(gateway: FakeGateway):
+        client = await _Client.connect(gateway.url)
+        assert await client.receive_op() == GatewayOp.HELLO
+
+        await client.send({"op": GatewayOp.REQUEST_MEMBERS, "d": {"guild_id": "1"}})
+        await client.send({"op": GatewayOp.HEARTBEAT, "d": None})
+        assert await client.receive_op() == GatewayOp.HEARTBEAT_ACK
+
+    anyio.run(_run, _test)
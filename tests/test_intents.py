@@ -0,0 +1,50 @@
+"""
+Tests for choosing the gateway intents a client identifies with.
+"""
+import anyio
+
+from curious.core.client import Client
+from curious.core.gateway import GatewayIntent
+
+
+def _make_client(**kwargs) -> Client:
+    async def _make():
+        return Client("a.b.c", **kwargs)
+
+    return anyio.run(_make)
+
+
+def test_no_intents_by_default():
+    # bots that don't opt in keep receiving every event, including privileged ones
+    assert _make_client().intents is None
+
+
+def test_privileged_intents():
+    client = _make_client(privileged_intents=GatewayIntent.GUILD_MEMBERS)
+    assert client.intents == GatewayIntent.unprivileged() | GatewayIntent.GUILD_MEMBERS
+
+    client = _make_client(privileged_intents=GatewayIntent(0))
+    assert client.intents == GatewayIntent.unprivileged()
+
+
+def test_explicit_intents():
+    client = _make_client(
+        intents=GatewayIntent.GUILDS, privileged_intents=GatewayIntent.privileged()
+    )
+    assert client.intents == GatewayIntent.GUILDS
+
+
+def test_derived_intents():
+    client = _make_client(derive_intents=True)
+
+    async def on_message(ctx, message):
+        pass
+
+    client.events.add_event(on_message, "message_create")
+    intents = client.intents
+    assert intents & GatewayIntent.GUILD_MESSAGES
+    assert not intents & GatewayIntent.GUILD_BANS
+    assert not intents & GatewayIntent.privileged()
+
+    client.privileged_intents = GatewayIntent.GUILD_PRESENCES
+    assert client.intents == intents | GatewayIntent.GUILD_PRESENCES
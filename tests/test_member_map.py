@@ -0,0 +1,268 @@
+"""
+Tests for the guild member map and its lazily created members.
+"""
+import anyio
+import pytest
+
+from curious.core import _current_client, _current_shard, state as md_state
+from curious.core.cache import CachePolicy
+from curious.core.client import Client
+from curious.dataclasses.bases import allow_external_makes
+from curious.dataclasses.member import Member, MemberMap, _MemberRecord
+from curious.dataclasses.presence import Presence, Status
+
+
+async def _make_client() -> Client:
+    return Client("a.b.c", cache_policy=CachePolicy(lazy_members=True))
+
+
+@pytest.fixture
+def client() -> Client:
+    # the client creates its events, so it has to be made inside an event loop
+    client = anyio.run(_make_client)
+    token = _current_client.set(client)
+    yield client
+    _current_client.reset(token)
+
+
+def _member_data(member_id: int, username: str = None, *, nick: str = None, roles=()) -> dict:
+    return {
+        "user": {
+            "id": str(member_id),
+            "username": username or f"user{member_id}",
+            "discriminator": "0001",
+        },
+        "roles": [str(role_id) for role_id in roles],
+        "joined_at": None,
+        "nick": nick,
+    }
+
+
+def _member_map(*members: dict) -> MemberMap:
+    member_map = MemberMap(1)
+    for member_data in members:
+        member_map.add_record(member_data)
+
+    return member_map
+
+
+def test_records_materialise_on_access(client):
+    members = _member_map(_member_data(10, nick="ten", roles=(3, 2)), _member_data(11))
+
+    assert len(members) == 2
+    assert 10 in members
+    assert isinstance(members._entries[10], _MemberRecord)
+    # records don't cache their user until they are accessed
+    assert 10 not in client.state._users
+
+    member = members[10]
+    assert isinstance(member, Member)
+    assert member is members[10]
+    assert member.guild_id == 1
+    assert member.user.username == "user10"
+    assert member.nickname == "ten"
+    assert member.role_ids == (2, 3)
+    assert client.state._users[10] is member.user
+
+    assert isinstance(members._entries[11], _MemberRecord)
+    assert members.get(12) is None
+
+
+def test_materialise_whilst_iterating(client):
+    members = _member_map(*(_member_data(i) for i in range(10, 15)))
+
+    assert [member.id for member in members.values()] == list(range(10, 15))
+    assert all(isinstance(entry, Member) for entry in members._entries.values())
+
+
+def test_add_record_updates_existing_member(client):
+    members = _member_map(_member_data(10, nick="old"))
+    member = members[10]
+
+    members.add_record(_member_data(10, "ignored", nick="new"))
+    assert members[10] is member
+    assert member.nickname == "new"
+    assert member.user.username == "user10"
+
+
+def test_set_presence(client):
+    members = _member_map(_member_data(10), _member_data(11))
+    online = Presence(status=Status.ONLINE)
+
+    members.set_presence(10, online)
+    assert isinstance(members._entries[10], _MemberRecord)
+    assert members[10].presence is online
+
+    member = members[11]
+    members.set_presence(11, online)
+    assert member.presence is online
+
+
+def test_remove_role(client):
+    members = _member_map(_member_data(10, roles=(2, 3)), _member_data(11, roles=(2,)))
+    member = members[11]
+
+    members.remove_role(2)
+    assert members._entries[10].role_ids == (3,)
+    assert member.role_ids == ()
+    assert members[10].role_ids == (3,)
+
+
+def test_copy(client):
+    members = _member_map(_member_data(10), _member_data(11))
+    copied = members.copy()
+
+    del members[10]
+    assert 10 not in members
+    assert 10 in copied
+
+    # materialising in one map doesn't affect the other
+    copied[11]
+    assert isinstance(members._entries[11], _MemberRecord)
+
+
+def test_delete(client):
+    members = _member_map(_member_data(10), _member_data(11))
+    assert members.find_by_name("user10")
+
+    del members[10]
+    assert 10 not in members
+    assert members.find_by_name("user10") == []
+    with pytest.raises(KeyError):
+        del members[10]
+
+    assert members.pop(11).id == 11
+    assert len(members) == 0
+
+
+class _Clock:
+    """
+    Stands in for the time module, so that member TTLs can be tested without sleeping.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+async def _drain(events) -> list:
+    return [event async for event in events]
+
+
+def test_evict_records(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(md_state, "time", clock)
+
+    async def _test():
+        client = Client("a.b.c", cache_policy=CachePolicy(lazy_members=True, member_ttl=10))
+        _current_client.set(client)
+        _current_shard.set(0)
+        state = client.state
+        state._user = state.make_user({"id": "1", "username": "bot", "discriminator": "0000"})
+
+        guild_data = {"id": "100", "members": [_member_data(10), _member_data(11)]}
+        await _drain(state.handle_guild_create(guild_data))
+        guild = state._guilds[100]
+        assert isinstance(guild._members._entries[10], _MemberRecord)
+
+        clock.now += 11
+        state._touch_member(guild, 11)
+        assert 10 not in guild._members
+        assert 11 in guild._members
+        assert guild._members.find_by_name("user10") == []
+        assert 10 not in state._users
+
+    anyio.run(_test)
+
+
+def test_name_index(client):
+    members = _member_map(
+        _member_data(10, "Alice", nick="ally"), _member_data(11, "alice"), _member_data(12, "bob")
+    )
+
+    assert [member.id for member in members.find_by_name("alice")] == [11]
+    assert [member.id for member in members.find_by_name("Alice", "0001")] == [10]
+    assert [member.id for member in members.find_by_name("ally")] == [10]
+    assert members.find_by_name("alice", "0002") == []
+    assert [member.id for member in members.find_by_prefix("AL")] == [10, 11]
+    assert [member.id for member in members.find_by_prefix("al", limit=1)] == [10]
+
+    # the index is kept up to date after the first search
+    members.add_record(_member_data(13, "alfred"))
+    with allow_external_makes():
+        members[14] = Member(**_member_data(14, "alan"))
+
+    del members[11]
+    assert [member.id for member in members.find_by_prefix("al")] == [14, 13, 10]
+
+    members[10].nickname = "bobby"
+    members.reindex(10)
+    assert members.find_by_name("ally") == []
+    assert [member.id for member in members.find_by_prefix("bob")] == [12, 10]
+
+
+def test_name_index_renamed_record(client):
+    members = _member_map(_member_data(10), _member_data(11))
+    assert members.find_by_name("user10")
+
+    # the user is cached and renamed elsewhere, whilst this member is still a record
+    user = client.state.make_user(_member_data(11)["user"])
+    user.username = "renamed"
+    members.reindex(11)
+    assert [member.id for member in members.find_by_name("renamed")] == [11]
+    assert members.find_by_name("user11") == []
+
+    # records added after the rename are indexed under the cached username, too
+    members.add_record(_member_data(11, "user11"))
+    assert [member.id for member in members.find_by_prefix("ren")] == [11]
+
+
+def test_name_index_rename_across_guilds():
+    async def _test():
+        client = Client("a.b.c", cache_policy=CachePolicy(lazy_members=True))
+        _current_client.set(client)
+        _current_shard.set(0)
+        state = client.state
+
+        for guild_id in (100, 200):
+            guild_data = {"id": str(guild_id), "members": [_member_data(11), _member_data(12)]}
+            await _drain(state.handle_guild_create(guild_data))
+
+        first, second = state._guilds[100], state._guilds[200]
+        assert second.search_for_member(name="user11").id == 11
+
+        renamed = {"id": "12", "username": "renamed", "discriminator": "0001"}
+        update = {"guild_id": "100", "user": renamed, "roles": []}
+        await _drain(state.handle_guild_member_update(update))
+
+        assert first.search_for_member(name="renamed").id == 12
+        assert second.search_for_member(name="renamed").id == 12
+        assert second.search_for_member(name="user12") is None
+        assert [member.id for member in second.search_members("ren")] == [12]
+
+    anyio.run(_test)
+
+
+def test_search_for_member_precedence():
+    async def _test():
+        client = Client("a.b.c")
+        _current_client.set(client)
+        _current_shard.set(0)
+
+        members = [
+            _member_data(10, "someone", nick="alice"),
+            _member_data(11, "alice"),
+            _member_data(13, "other", nick="bob"),
+            _member_data(12, "another", nick="bob"),
+        ]
+        await _drain(client.state.handle_guild_create({"id": "100", "members": members}))
+        guild = client.state._guilds[100]
+
+        # a username match wins over a nickname match that comes first
+        assert guild.search_for_member(name="alice").id == 11
+        # otherwise, the lowest ID wins
+        assert guild.search_for_member(name="bob").id == 12
+
+    anyio.run(_test)
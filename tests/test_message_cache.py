@@ -0,0 +1,205 @@
+"""
+Tests for the per-channel message cache and its retention policies.
+"""
+import pytest
+
+from curious.core import cache as md_cache
+from curious.core.cache import MessageCache, MessageStore, RetentionPolicy
+from curious.dataclasses.bases import allow_external_makes
+from curious.dataclasses.channel import ChannelType
+from curious.dataclasses.message import Message
+
+
+class _Clock:
+    """
+    Stands in for the time module, so that TTLs can be tested without sleeping.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch) -> _Clock:
+    clock = _Clock()
+    monkeypatch.setattr(md_cache, "time", clock)
+    return clock
+
+
+def _message(message_id: int, channel_id: int = 1) -> Message:
+    with allow_external_makes():
+        return Message(id=message_id, channel_id=channel_id)
+
+
+def _ids(messages) -> list:
+    return [message.id for message in messages]
+
+
+def test_cache_evicts_oldest():
+    cache = MessageCache(3, lru=False)
+    evicted = []
+    cache.add_eviction_callback(evicted.append)
+
+    for i in range(5):
+        cache.add(_message(i))
+
+    assert _ids(cache) == [2, 3, 4]
+    assert _ids(evicted) == [0, 1]
+    assert cache.get(0) is None
+
+    # lookups don't change the order without LRU
+    cache.get(2)
+    cache.add(_message(5))
+    assert _ids(cache) == [3, 4, 5]
+
+
+def test_cache_lru():
+    cache = MessageCache(3, lru=True)
+    for i in range(3):
+        cache.add(_message(i))
+
+    cache.get(0)
+    cache.add(_message(3))
+    assert _ids(cache) == [2, 0, 3]
+
+
+def test_cache_remove_and_shrink():
+    cache = MessageCache(5)
+    evicted = []
+    cache.add_eviction_callback(evicted.append)
+    for i in range(5):
+        cache.add(_message(i))
+
+    assert cache.remove(2).id == 2
+    assert cache.remove(2) is None
+    assert 2 not in cache
+    # removed messages aren't passed to the eviction callbacks
+    assert evicted == []
+
+    cache.max_size = 2
+    assert _ids(cache) == [3, 4]
+    assert _ids(evicted) == [0, 1]
+
+
+def test_cache_ttl(clock):
+    cache = MessageCache(None, ttl=10, lru=True)
+    evicted = []
+    cache.add_eviction_callback(evicted.append)
+
+    cache.add(_message(0))
+    clock.now += 5
+    cache.add(_message(1))
+    clock.now += 4
+    # looking up a message with LRU refreshes its TTL
+    assert cache.get(0).id == 0
+
+    clock.now += 6
+    assert cache.get(1) is None
+    assert _ids(evicted) == [1]
+    assert _ids(cache) == [0]
+
+    clock.now += 10
+    assert cache.get(0) is None
+    assert len(cache) == 0
+
+
+def test_store_policy_lookup():
+    text, voice = RetentionPolicy(max_messages=10), RetentionPolicy.disabled()
+    store = MessageStore(None, default_policy=text, policies={ChannelType.VOICE: voice})
+    override = RetentionPolicy(max_messages=1)
+
+    assert store.policy_for(1) is text
+    assert store.policy_for(1, ChannelType.TEXT) is text
+    assert store.policy_for(1, ChannelType.VOICE) is voice
+
+    store.set_channel_policy(1, override)
+    assert store.policy_for(1, ChannelType.VOICE) is override
+    assert store.policy_for(2, ChannelType.VOICE) is voice
+
+    store.set_channel_policy(1, None)
+    assert store.policy_for(1, ChannelType.VOICE) is voice
+
+
+def test_store_disabled_policy():
+    store = MessageStore(None, policies={ChannelType.VOICE: RetentionPolicy.disabled()})
+    store.add(_message(1, channel_id=1), ChannelType.VOICE)
+    store.add(_message(2, channel_id=2), ChannelType.TEXT)
+
+    assert 1 not in store
+    assert 2 in store
+    assert store.channel_cache(1) is None
+
+
+def test_store_per_channel_limit():
+    store = MessageStore(None, default_policy=RetentionPolicy(max_messages=2, lru=False))
+    evicted = []
+    store.add_eviction_callback(evicted.append)
+
+    # a busy channel can't push out another channel's messages
+    store.add(_message(100, channel_id=2))
+    for i in range(5):
+        store.add(_message(i, channel_id=1))
+
+    assert _ids(store) == [100, 3, 4]
+    assert _ids(evicted) == [0, 1, 2]
+    assert len(store.channel_cache(1)) == 2
+    assert store.stats.evictions == 3
+
+
+def test_store_global_limit():
+    store = MessageStore(3, default_policy=RetentionPolicy(max_messages=None, lru=True))
+    store.add(_message(0, channel_id=1))
+    store.add(_message(1, channel_id=2))
+    store.add(_message(2, channel_id=1))
+
+    # an LRU lookup moves the message to the back of the global order as well
+    assert store.get(0).id == 0
+    store.add(_message(3, channel_id=3))
+
+    assert _ids(store) == [2, 0, 3]
+    # channel 2's only message was evicted, so its cache is dropped
+    assert store.channel_cache(2) is None
+
+    store.max_messages = 1
+    assert _ids(store) == [3]
+    assert store.channel_cache(1) is None
+
+
+def test_store_ttl(clock):
+    store = MessageStore(None, default_policy=RetentionPolicy(max_messages=None, ttl=10))
+    evicted = []
+    store.add_eviction_callback(evicted.append)
+    store.add(_message(0, channel_id=1))
+    store.add(_message(1, channel_id=1))
+
+    clock.now += 11
+    assert store.get(0) is None
+    assert _ids(evicted) == [0, 1]
+    assert len(store) == 0
+    assert store.channel_cache(1) is None
+    assert store.stats.misses == 1
+
+
+def test_store_remove_and_drop_channel():
+    store = MessageStore(None)
+    for i in range(3):
+        store.add(_message(i, channel_id=1))
+    store.add(_message(10, channel_id=2))
+
+    assert store.remove(0).id == 0
+    assert store.remove(0) is None
+    assert store.get(0) is None
+
+    store.drop_channel(1)
+    assert _ids(store) == [10]
+    assert store.channel_cache(1) is None
+
+    store.set_channel_policy(2, RetentionPolicy(max_messages=5))
+    # setting a policy starts the channel from a clean slate
+    assert len(store) == 0
+
+    assert store.get(10) is None
+    assert store.stats.hits == 0
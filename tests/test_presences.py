@@ -0,0 +1,103 @@
+"""
+Tests for interning presences and activities in the state.
+"""
+import anyio
+import pytest
+
+from curious.core import _current_client
+from curious.core.client import Client
+from curious.dataclasses.bases import allow_external_makes
+from curious.dataclasses.member import Member
+from curious.dataclasses.presence import ActivityType, RichActivity, Status
+
+
+async def _make_client() -> Client:
+    return Client("a.b.c")
+
+
+@pytest.fixture
+def client() -> Client:
+    # the client creates its events, so it has to be made inside an event loop
+    client = anyio.run(_make_client)
+    token = _current_client.set(client)
+    yield client
+    _current_client.reset(token)
+
+
+def test_presences_are_shared(client):
+    state = client.state
+    first = state.make_presence(
+        {
+            "status": "online",
+            "game": {"name": "a game", "type": 0},
+            "client_status": {"web": "online"},
+        }
+    )
+    # the same presence, with the keys in a different order
+    second = state.make_presence(
+        {
+            "client_status": {"web": "online"},
+            "game": {"type": 0, "name": "a game"},
+            "status": "online",
+        }
+    )
+
+    assert first is second
+    assert first.status == Status.ONLINE
+    assert first.game.name == "a game"
+    assert first.web == Status.ONLINE
+    assert state.presence_intern_stats.hits == 1
+
+    other = state.make_presence({"status": "idle", "game": {"type": 0, "name": "a game"}})
+    assert other is not first
+    assert other.game is first.game
+
+
+def test_activities_are_keyed_by_their_fields(client):
+    state = client.state
+    streaming = state.make_presence(
+        {"status": "online", "game": {"name": "a game", "type": 1, "url": "https://a"}}
+    )
+    playing = state.make_presence({"status": "online", "game": {"name": "a game", "type": 0}})
+    assert streaming.game is not playing.game
+    assert streaming.game.type == ActivityType.STREAMING
+
+    rich_data = {
+        "name": "a game",
+        "type": 0,
+        "application_id": "1",
+        "party": {"id": "p", "size": [1, 4]},
+        "assets": {"large_image": "a"},
+    }
+    rich = state.make_presence({"status": "online", "activities": [rich_data]})
+    assert isinstance(rich.activities[0], RichActivity)
+    assert rich.activities[0] is not playing.game
+    assert state.make_presence({"status": "online", "activities": [dict(rich_data)]}) is rich
+
+    other_party = dict(rich_data, party={"id": "p", "size": [2, 4]})
+    assert state.make_presence({"status": "online", "activities": [other_party]}) is not rich
+
+
+def test_malformed_presences_are_not_interned(client):
+    state = client.state
+    data = {"status": "online", "activities": [{"name": "a game", "type": 0, "url": ["a"]}]}
+    first, second = state.make_presence(data), state.make_presence(data)
+
+    assert first is not second
+    assert len(state._presences) == 0
+
+
+def _member_data(member_id: int) -> dict:
+    return {
+        "user": {"id": str(member_id), "username": f"user{member_id}", "discriminator": "0001"},
+        "status": "online",
+        "game": {"name": "a game", "type": 0},
+    }
+
+
+def test_member_presences_are_shared(client):
+    with allow_external_makes():
+        first, second = Member(**_member_data(10)), Member(**_member_data(11))
+
+    assert first.presence is second.presence
+    assert first.status == Status.ONLINE
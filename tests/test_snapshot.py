@@ -0,0 +1,178 @@
+"""
+Tests for loading state snapshots.
+"""
+import pickle
+import sys
+
+import anyio
+import pytest
+
+from curious.core import _current_client, _current_shard
+from curious.core.cache import CachePolicy
+from curious.core.client import Client
+from curious.core.state import State
+from curious.dataclasses.member import _MemberRecord
+
+
+class _Exploit:
+    def __reduce__(self):
+        return (exec, ("import sys; sys._snapshot_exploited = True",))
+
+
+def test_snapshot_round_trip():
+    async def _restore():
+        state = State()
+        return await State().restore(state.snapshot())
+
+    assert anyio.run(_restore)
+
+
+def test_snapshot_refuses_other_classes():
+    snapshot = pickle.dumps({"version": State.SNAPSHOT_VERSION, "user": _Exploit()})
+
+    assert not anyio.run(State().restore, snapshot)
+    assert not hasattr(sys, "_snapshot_exploited")
+
+
+def _guild_data(guild_id: int) -> dict:
+    base = guild_id * 1000
+    members = [
+        {
+            "user": {"id": "1", "username": "bot", "discriminator": "0000", "bot": True},
+            "roles": [str(base + 1)],
+        }
+    ]
+    for i in range(10, 110):
+        members.append(
+            {
+                "user": {"id": str(i), "username": f"user{i}", "discriminator": f"{i:04d}"},
+                "roles": [str(base + 1)] if i % 3 == 0 else [],
+                "nick": f"nick{i}" if i % 5 == 0 else None,
+                "joined_at": "2018-01-01T00:00:00+00:00",
+            }
+        )
+
+    return {
+        "id": str(guild_id),
+        "name": f"Guild {guild_id}",
+        "owner_id": "1",
+        "roles": [
+            # @everyone can read, but not send messages
+            {"id": str(guild_id), "name": "@everyone", "permissions": 1024, "position": 0},
+            {"id": str(base + 1), "name": "mod", "permissions": 2048 | 8192, "position": 1},
+        ],
+        "channels": [
+            {"id": str(base + 10), "type": 0, "name": "general", "position": 0},
+            {
+                "id": str(base + 11),
+                "type": 0,
+                "name": "secret",
+                "position": 1,
+                "permission_overwrites": [
+                    {"id": str(guild_id), "type": "role", "allow": 0, "deny": 1024},
+                ],
+            },
+        ],
+        "members": members,
+        "presences": [
+            {"user": {"id": str(i)}, "status": "online", "game": {"name": "a game", "type": 0}}
+            for i in range(10, 110, 2)
+        ],
+    }
+
+
+def _message_data(message_id: int, channel_id: int, author_id: int) -> dict:
+    return {
+        "id": str(message_id),
+        "channel_id": str(channel_id),
+        "author": {"id": str(author_id), "username": f"user{author_id}", "discriminator": "0001"},
+        "content": f"message {message_id}",
+        "timestamp": "2018-01-01T00:00:00+00:00",
+        "mentions": [],
+        "mention_roles": [],
+        "attachments": [],
+        "embeds": [],
+        "type": 0,
+    }
+
+
+async def _drain(events) -> list:
+    return [event async for event in events]
+
+
+async def _make_client(lazy_members: bool) -> Client:
+    return Client("a.b.c", cache_policy=CachePolicy(lazy_members=lazy_members))
+
+
+def _summarise(state: State) -> dict:
+    """
+    Gets the cached data of a state that should survive a snapshot.
+    """
+    guilds = {}
+    for guild in state._guilds.values():
+        members = {
+            member.id: (
+                member.user.username,
+                member.nickname.value,
+                member.role_ids,
+                member.status,
+                member.presence.game.name if member.presence.game else None,
+                member.guild_permissions.bitfield,
+            )
+            for member in guild.members.values()
+        }
+        channels = {channel.id: channel.name for channel in guild.channels.values()}
+        roles = {role.id: (role.name, role.permissions.bitfield) for role in guild.roles.values()}
+        guilds[guild.id] = (guild.name, members, channels, roles)
+
+    messages = [(message.id, message.channel_id, message.content) for message in state.messages]
+    return {
+        "user": state._user.id,
+        "guilds": guilds,
+        "channels": sorted(state._channels),
+        "users": sorted(state._users),
+        "messages": messages,
+    }
+
+
+@pytest.mark.parametrize("lazy_members", [False, True])
+def test_snapshot_round_trip_populated(lazy_members):
+    async def _test():
+        client = await _make_client(lazy_members)
+        _current_client.set(client)
+        _current_shard.set(0)
+        state = client.state
+
+        ready = {"user": {"id": "1", "username": "bot", "discriminator": "0000", "bot": True}}
+        await _drain(state.handle_ready(ready))
+        for guild_id in (100, 200):
+            await _drain(state.handle_guild_create(_guild_data(guild_id)))
+            for i in range(41):
+                message = _message_data(guild_id * 1000 + 500 + i, guild_id * 1000 + 10, 10 + i)
+                await _drain(state.handle_message_create(message))
+
+        guild = state._guilds[100]
+        assert isinstance(guild._members._entries[105], _MemberRecord) == lazy_members
+        snapshot = state.snapshot()
+        expected = _summarise(state)
+
+        restored = await _make_client(lazy_members)
+        _current_client.set(restored)
+        assert await restored.state.restore(snapshot)
+        assert _summarise(restored.state) == expected
+        assert len(restored.state.messages) == 82
+
+        guild = restored.state._guilds[100]
+        assert guild.search_for_member(name="user12").id == 12
+        assert guild.search_for_member(name="nick15").id == 15
+        assert [member.id for member in guild.search_members("user29")] == [29]
+
+        general, secret = guild.channels[100010], guild.channels[100011]
+        member, mod = guild.members[11], guild.members[12]
+        assert general.effective_permissions(member).read_messages
+        assert not general.effective_permissions(member).send_messages
+        assert general.effective_permissions(mod).send_messages
+        assert not secret.effective_permissions(member).read_messages
+        assert restored.state.find_channel(200011) is restored.state._guilds[200].channels[200011]
+
+    anyio.run(_test)
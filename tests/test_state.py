@@ -0,0 +1,78 @@
+"""
+Tests for the state's indexes of cached objects.
+"""
+import anyio
+
+from curious.core import _current_client, _current_shard
+from curious.core.client import Client
+
+
+def _channel_data(channel_id: int) -> dict:
+    return {"id": str(channel_id), "type": 0, "name": f"channel-{channel_id}", "position": 0}
+
+
+def _guild_data(guild_id: int, channel_ids) -> dict:
+    return {
+        "id": str(guild_id),
+        "name": "guild",
+        "roles": [{"id": str(guild_id), "name": "@everyone", "permissions": 0}],
+        "channels": [_channel_data(channel_id) for channel_id in channel_ids],
+        "members": [],
+    }
+
+
+async def _drain(events) -> list:
+    return [event async for event in events]
+
+
+async def _make_state():
+    client = Client("a.b.c")
+    _current_client.set(client)
+    _current_shard.set(0)
+    return client.state
+
+
+def test_repeated_guild_create_replaces_channels():
+    async def _test():
+        state = await _make_state()
+        await _drain(state.handle_guild_create(_guild_data(100, (1, 2, 3))))
+        assert state.find_channel(1).guild_id == 100
+
+        # e.g. after an outage, with channel 1 deleted and channel 4 created in the meantime
+        await _drain(state.handle_guild_create(_guild_data(100, (2, 3, 4))))
+        guild = state._guilds[100]
+        assert state.find_channel(1) is None
+        assert sorted(guild.channels) == [2, 3, 4]
+        assert sorted(state._channels) == [2, 3, 4]
+        assert state.find_channel(4) is guild.channels[4]
+
+        # an unavailable guild keeps its channels until it comes back
+        await _drain(state.handle_guild_create({"id": "100", "unavailable": True}))
+        assert sorted(state._channels) == [2, 3, 4]
+
+    anyio.run(_test)
+
+
+def test_find_member_or_user():
+    async def _test():
+        state = await _make_state()
+        guild_data = _guild_data(100, (1,))
+        guild_data["members"] = [
+            {"user": {"id": str(i), "username": f"user{i}", "discriminator": "0001"}, "roles": []}
+            for i in (10, 11)
+        ]
+        await _drain(state.handle_guild_create(guild_data))
+        guild = state._guilds[100]
+        assert state.find_member_or_user(10) is guild.members[10]
+
+        # a member removed without updating the index falls back to the user
+        user = guild.members[11].user
+        del guild._members[11]
+        assert state.find_member_or_user(11) is user
+
+        # as does a member of a guild that is no longer cached
+        del state._guilds[100]
+        assert state.find_member_or_user(10) is state._users[10]
+        assert state.find_member_or_user(12) is None
+
+    anyio.run(_test)